@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bounded thread pools for blocking work in async handlers, plus an event-loop lag probe.
+src/api/executors.py
+
+Chat turns hand retrieval (embedding, vector search, rerank) and SQLite access to separate
+pools so neither can starve the other, and so no handler blocks the event loop that streams
+tokens to every chat. Each pool admits at most workers + max_queue calls; further callers
+wait on the loop without holding a thread. /v1/metrics reports queue depths and loop lag.
+
+@author: LIU Ziyi
+@date: 2026-01-01
+@license: Apache-2.0
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class BoundedExecutor:
+    def __init__(self, name: str, max_workers: int, max_queue: int) -> None:
+        self.name = name
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(0, int(max_queue))
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        self._slots = asyncio.Semaphore(self.max_workers + self.max_queue)
+        self._lock = threading.Lock()
+        self._waiting = 0  # callers blocked on a free slot
+        self._queued = 0  # submitted, not yet started by a worker
+        self._running = 0
+        self._completed = 0
+        self._max_depth = 0
+        self._wait_s = 0.0  # summed submit-to-start latency
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run fn(*args, **kwargs) on the pool and await its result."""
+        loop = asyncio.get_running_loop()
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        submitted = time.perf_counter()
+        with self._lock:
+            self._queued += 1
+            self._max_depth = max(self._max_depth, self._queued + self._waiting)
+        try:
+            fut = self._pool.submit(self._call, submitted, fn, args, kwargs)
+        except BaseException:
+            with self._lock:
+                self._queued -= 1
+            self._slots.release()
+            raise
+        # The slot frees when the work really ends, even if the awaiting task is cancelled.
+        fut.add_done_callback(lambda _: loop.call_soon_threadsafe(self._slots.release))
+        return await asyncio.wrap_future(fut)
+
+    def _call(self, submitted: float, fn: Callable[..., T], args: tuple, kwargs: dict) -> T:
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._wait_s += time.perf_counter() - submitted
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": self._queued + self._waiting,
+                "max_queued": self._max_depth,
+                "completed": self._completed,
+                "avg_wait_ms": round(self._wait_s / self._completed * 1000, 2) if self._completed else 0.0,
+            }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class LoopLagMonitor:
+    """Samples how late a periodic wake-up fires; sustained lag means something blocks the loop."""
+
+    def __init__(self, interval_s: float = 0.05, window: int = 1200) -> None:
+        self.interval_s = max(0.001, float(interval_s))
+        self._samples: deque[float] = deque(maxlen=max(1, int(window)))
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            t = loop.time()
+            await asyncio.sleep(self.interval_s)
+            self._samples.append(max(0.0, loop.time() - t - self.interval_s))
+
+    def stats(self) -> dict[str, float]:
+        samples = sorted(self._samples)
+        if not samples:
+            return {"last_ms": 0.0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        return {
+            "last_ms": round(self._samples[-1] * 1000, 2),
+            "p50_ms": round(samples[len(samples) // 2] * 1000, 2),
+            "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 2),
+            "max_ms": round(samples[-1] * 1000, 2),
+        }
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Background indexing scheduler for the API server.
+src/api/index_jobs.py
+
+One worker task runs index jobs one at a time (the pipeline is a single writer), picking
+the lowest priority value first: chat uploads, then removals, then full rescans. A job that
+is still queued absorbs duplicate requests of the same kind, so ten rescans requested while
+one is running collapse into a single follow-up run. Progress reports from the pipeline are
+forwarded as `index_progress` events to the chats that asked for the job.
+
+@author: LIU Ziyi
+@date: 2026-01-01
+@license: Apache-2.0
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import itertools
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional
+
+from src.rag.pipeline import RagPipeline
+
+logger = logging.getLogger("index_jobs")
+
+JOB_INDEX = "index"  # index_paths(paths), e.g. chat uploads
+JOB_REMOVE = "remove"  # remove_paths(paths)
+JOB_SCAN = "scan"  # build_or_update_index() over DOCS_GLOBS
+
+_PRIORITY = {JOB_INDEX: 0, JOB_REMOVE: 1, JOB_SCAN: 2}
+
+Notify = Callable[[str, dict[str, Any]], Awaitable[None]]
+
+
+@dataclass
+class IndexJob:
+    job_id: str
+    kind: str
+    paths: list[str] = field(default_factory=list)
+    chat_ids: set[str] = field(default_factory=set)
+    status: str = "queued"  # queued | running | done | failed
+    created_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    progress: dict[str, Any] = field(default_factory=dict)
+    result: dict[str, Any] | None = None
+    error: str | None = None
+    done: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status,
+            "paths": len(self.paths),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class IndexScheduler:
+    def __init__(self, rag: RagPipeline, notify: Optional[Notify] = None, keep_finished: int = 200) -> None:
+        self.rag = rag
+        self.notify = notify
+        self.keep_finished = max(1, int(keep_finished))
+        self._jobs: dict[str, IndexJob] = {}
+        self._queue: asyncio.PriorityQueue[tuple[int, int, str]] = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._worker: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run_forever())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._worker
+            self._worker = None
+
+    def get(self, job_id: str) -> IndexJob | None:
+        return self._jobs.get(job_id)
+
+    def submit(self, kind: str, paths: Optional[list[str]] = None, chat_id: Optional[str] = None) -> IndexJob:
+        """Queue a job (or join a queued one of the same kind) and return it without waiting."""
+        if kind not in _PRIORITY:
+            raise ValueError(f"unknown index job kind: {kind}")
+        for job in self._jobs.values():
+            if job.status == "queued" and job.kind == kind:
+                job.paths.extend(p for p in (paths or []) if p not in job.paths)
+                if chat_id:
+                    job.chat_ids.add(chat_id)
+                return job
+
+        job = IndexJob(job_id=uuid.uuid4().hex, kind=kind, paths=list(dict.fromkeys(paths or [])))
+        if chat_id:
+            job.chat_ids.add(chat_id)
+        self._jobs[job.job_id] = job
+        self._queue.put_nowait((_PRIORITY[kind], next(self._seq), job.job_id))
+        self._prune()
+        return job
+
+    async def wait(self, job: IndexJob) -> dict[str, Any]:
+        await job.done.wait()
+        if job.status == "failed":
+            raise RuntimeError(f"index job {job.job_id} failed: {job.error}")
+        return job.result or {}
+
+    def _prune(self) -> None:
+        finished = [j for j in self._jobs.values() if j.status in ("done", "failed")]
+        for job in sorted(finished, key=lambda j: j.finished_at or 0.0)[:max(0, len(finished) - self.keep_finished)]:
+            self._jobs.pop(job.job_id, None)
+
+    async def _run_forever(self) -> None:
+        while True:
+            _, _, job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            if job is None or job.status != "queued":
+                continue
+            await self._run(job)
+
+    async def _run(self, job: IndexJob) -> None:
+        loop = asyncio.get_running_loop()
+        job.status = "running"
+        job.started_at = time.time()
+        await self._emit(job, {"stage": "started"})
+
+        def on_progress(report: dict[str, Any]) -> None:
+            # Called on the indexing thread; hop back onto the event loop.
+            loop.call_soon_threadsafe(lambda: loop.create_task(self._emit(job, report)))
+
+        try:
+            if job.kind == JOB_INDEX:
+                result = await asyncio.to_thread(self.rag.index_paths, list(job.paths), progress=on_progress)
+            elif job.kind == JOB_REMOVE:
+                result = await asyncio.to_thread(self.rag.remove_paths, list(job.paths), progress=on_progress)
+            else:
+                result = await asyncio.to_thread(self.rag.build_or_update_index, progress=on_progress)
+            job.result = dict(result)
+            job.status = "done"
+        except Exception as exc:
+            logger.exception("Index job %s (%s) failed", job.job_id, job.kind)
+            job.error = str(exc)
+            job.status = "failed"
+        job.finished_at = time.time()
+        job.done.set()
+        await self._emit(job, {"stage": job.status})
+
+    async def _emit(self, job: IndexJob, report: dict[str, Any]) -> None:
+        job.progress = {**job.progress, **report}
+        if self.notify is None:
+            return
+        event = {"event": "index_progress", "job_id": job.job_id, "kind": job.kind, "status": job.status, **job.progress}
+        for chat_id in list(job.chat_ids):
+            try:
+                await self.notify(chat_id, event)
+            except Exception:
+                logger.debug("index_progress delivery failed for chat %s", chat_id, exc_info=True)
@@ -18,11 +18,10 @@ import os
 from pathlib import Path
 import re
 import shutil
-import threading
 import time
 from contextlib import asynccontextmanager
 from dataclasses import dataclass, field
-from typing import Any, Optional, cast
+from typing import Any, AsyncIterator, Awaitable, Optional, TypeVar, cast
 
 from fastapi import FastAPI, File, Request, UploadFile, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
@@ -30,21 +29,26 @@ from fastapi.responses import FileResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
+from src.api.executors import BoundedExecutor, LoopLagMonitor
+from src.api.index_jobs import JOB_INDEX, JOB_REMOVE, JOB_SCAN, IndexScheduler
+from src.api.ws_fanout import TOKEN_EVENTS, TurnBacklog, WsSubscriber
 from src.chat.build_messages import build_llm_messages
 from src.chat.build_messages import format_rag_context
 from src.chat.think_split import split_think_stream
 from src.config import AppConfig, load_config
 from src.models.base import GenerationParams
-from src.models.base import ChatModel
+from src.models.base import ChatModel, stream_in_thread
 from src.models.registry import create_chat_model
 from src.rag.pipeline import RagPipeline
-from src.storage.history_db import HistoryDB, UploadedFileRow
+from src.rag.watcher import create_doc_watcher
+from src.storage.history_db import HistoryDB, MessageRow, UploadedFileRow
 from src.storage.persist import persist_turn
 
 APP_DIR = Path(__file__).resolve().parent
 STATIC_DIR = APP_DIR / "static"
 
 logger = logging.getLogger("api_server")
+T = TypeVar("T")
 RECALL_HISTORY_PATTERNS = (
     re.compile(r"(前面|之前|刚才|上面).{0,8}(问|说|提到).{0,8}(什么)"),
     re.compile(r"(我).{0,4}(前面|之前|刚才|上面).{0,8}(问|说|提到).{0,8}(什么)"),
@@ -60,8 +64,8 @@ COMPLEX_QUERY_PATTERNS = (
 @dataclass
 class ActiveTurn:
     chat_id: str
-    backlog: list[dict[str, Any]] = field(default_factory=list)
-    subscribers: set[WebSocket] = field(default_factory=set)
+    backlog: TurnBacklog = field(default_factory=TurnBacklog)
+    subscribers: set[WsSubscriber] = field(default_factory=set)
     task: asyncio.Task | None = None
 
 
@@ -85,6 +89,18 @@ def _state_turns(app: FastAPI) -> dict[str, ActiveTurn]:
     return cast(dict[str, ActiveTurn], app.state.active_turns)
 
 
+def _state_index_jobs(app: FastAPI) -> IndexScheduler:
+    return cast(IndexScheduler, app.state.index_jobs)
+
+
+def _state_retrieval_pool(app: FastAPI) -> BoundedExecutor:
+    return cast(BoundedExecutor, app.state.retrieval_pool)
+
+
+def _state_db_pool(app: FastAPI) -> BoundedExecutor:
+    return cast(BoundedExecutor, app.state.db_pool)
+
+
 def _health_payload(app: FastAPI) -> dict:
     cfg = _state_cfg(app)
     rag = _state_rag(app)
@@ -103,6 +119,24 @@ def _health_payload(app: FastAPI) -> dict:
     }
 
 
+class _StageTimer:
+    """Start/end of each turn stage in ms since the message arrived, kept in the turn meta."""
+
+    def __init__(self) -> None:
+        self.t0 = time.perf_counter()
+        self.stages: dict[str, dict[str, int]] = {}
+
+    def ms(self) -> int:
+        return int((time.perf_counter() - self.t0) * 1000)
+
+    async def run(self, name: str, aw: Awaitable[T]) -> T:
+        start = self.ms()
+        try:
+            return await aw
+        finally:
+            self.stages[name] = {"start_ms": start, "end_ms": self.ms()}
+
+
 def _chat_upload_root(cfg: AppConfig, chat_id: str) -> Path:
     return Path(cfg.RAG.UPLOAD_DIR).expanduser() / chat_id
 
@@ -127,19 +161,58 @@ def _uploaded_file_to_dict(row: UploadedFileRow) -> dict:
     return row.to_dict()
 
 
-def _resolve_doc_ids_for_uploads(app: FastAPI, uploads: list[dict]) -> list[str]:
-    if not uploads:
-        return []
-    store = _state_rag(app).store
-    resolved: list[str] = []
+def _upload_paths(uploads: list[dict]) -> list[str]:
+    paths: list[str] = []
     for item in uploads:
         raw_path = str(item.get("rel_path") or "").strip()
         if not raw_path:
             continue
         try:
-            ap = str(Path(raw_path).expanduser().resolve())
+            paths.append(str(Path(raw_path).expanduser().resolve()))
         except Exception:
             continue
+    return paths
+
+
+def _open_turn_rows(
+        db: HistoryDB,
+        chat_id: str | None,
+        message: str,
+) -> tuple[str, bool, int, list[dict], int | None] | None:
+    """
+    Record the user side of a new turn: (chat_id, created_new, pending uploads, attached
+    uploads, user msg id), or None when there is neither a message nor a pending upload.
+    """
+    pending_uploads = len(db.list_pending_uploaded_files(chat_id)) if chat_id else 0
+    if not message and pending_uploads == 0:
+        return None
+
+    created_new = False
+    if not chat_id:
+        chat_id = db.create_chat(first_user_text=message)
+        created_new = True
+
+    pending_uploads = len(db.list_pending_uploaded_files(chat_id))
+    attached_uploads: list[dict] = []
+    user_msg_id: int | None = None
+    if message:
+        db.maybe_update_title_from_first_user_text(chat_id=chat_id, first_user_text=message)
+        user_msg_id = db.add_message(chat_id=chat_id, role="user", content=message)
+        attached_rows = db.attach_pending_uploads_to_message(chat_id=chat_id, msg_id=user_msg_id)
+        attached_uploads = [_uploaded_file_to_dict(row) for row in attached_rows]
+    elif pending_uploads > 0:
+        user_msg_id = db.add_message(chat_id=chat_id, role="user", content="")
+        attached_rows = db.attach_pending_uploads_to_message(chat_id=chat_id, msg_id=user_msg_id)
+        attached_uploads = [_uploaded_file_to_dict(row) for row in attached_rows]
+    return str(chat_id), created_new, pending_uploads, attached_uploads, user_msg_id
+
+
+def _resolve_doc_ids_for_uploads(app: FastAPI, uploads: list[dict]) -> list[str]:
+    if not uploads:
+        return []
+    store = _state_rag(app).store
+    resolved: list[str] = []
+    for ap in _upload_paths(uploads):
         doc = store.get_doc_by_path(ap)
         if doc is not None:
             resolved.append(doc.doc_id)
@@ -153,11 +226,10 @@ def _looks_like_history_recall(message: str) -> bool:
     return any(p.search(text) for p in RECALL_HISTORY_PATTERNS)
 
 
-def _build_history_recall_answer(db: HistoryDB, chat_id: str, current_message: str) -> str | None:
+def _build_history_recall_answer(past: list[MessageRow], current_message: str) -> str | None:
     if not _looks_like_history_recall(current_message):
         return None
 
-    past = db.get_messages(chat_id=chat_id, limit=2000)
     user_msgs = [m.content.strip() for m in past if m.role == "user" and m.content.strip()]
     if not user_msgs:
         return "这段对话里还没有可回顾的历史提问。"
@@ -253,6 +325,10 @@ def create_app(config_path: str | None = None) -> FastAPI:
         app.state.model = create_chat_model(cfg.MODEL)
         app.state.rag = RagPipeline(cfg)
         app.state.active_turns = {}
+        app.state.retrieval_pool = BoundedExecutor("retrieval", cfg.SERVER.RETRIEVAL_WORKERS, cfg.SERVER.RETRIEVAL_QUEUE_MAX)
+        app.state.db_pool = BoundedExecutor("db", cfg.SERVER.DB_WORKERS, cfg.SERVER.DB_QUEUE_MAX)
+        app.state.loop_lag = LoopLagMonitor()
+        app.state.loop_lag.start()
         try:
             await asyncio.to_thread(app.state.model.prepare)
         except Exception:
@@ -262,7 +338,28 @@ def create_app(config_path: str | None = None) -> FastAPI:
             logger.info("RAG warmup: %s", warmup_result)
         except Exception:
             logger.exception("RAG warmup failed")
+        app.state.index_jobs = IndexScheduler(app.state.rag, notify=_broadcast)
+        app.state.index_jobs.start()
+        watcher = None
+        if cfg.RAG.ENABLED and cfg.RAG.WATCH:
+            loop = asyncio.get_running_loop()
+            jobs = app.state.index_jobs
+            watcher = create_doc_watcher(
+                cfg,
+                on_changes=lambda paths: loop.call_soon_threadsafe(jobs.submit, JOB_INDEX, paths),
+                on_overflow=lambda: loop.call_soon_threadsafe(jobs.submit, JOB_SCAN),
+            )
+            watcher.start()
         yield
+        if watcher is not None:
+            await asyncio.to_thread(watcher.stop)
+        await app.state.index_jobs.stop()
+        aclose = getattr(app.state.model, "aclose", None)
+        if aclose is not None:
+            await aclose()
+        await app.state.loop_lag.stop()
+        app.state.retrieval_pool.shutdown()
+        app.state.db_pool.shutdown()
 
     app = FastAPI(lifespan=lifespan)
 
@@ -278,20 +375,27 @@ def create_app(config_path: str | None = None) -> FastAPI:
         turn = _state_turns(app).get(chat_id)
         if turn is None:
             return
-        turn.backlog.append(obj)
-        dead: list[WebSocket] = []
-        payload = json.dumps(obj, ensure_ascii=False)
-        for ws in list(turn.subscribers):
-            try:
-                await ws.send_text(payload)
-            except Exception:
-                dead.append(ws)
-        for ws in dead:
-            turn.subscribers.discard(ws)
-
-    async def _replay_turn(turn: ActiveTurn, websocket: WebSocket) -> None:
-        for obj in turn.backlog:
-            await websocket.send_text(json.dumps(obj, ensure_ascii=False))
+        turn.backlog.add(obj)
+        # Only queues here; each subscriber's sender task does the (possibly slow) socket writes.
+        payload = None if obj.get("event") in TOKEN_EVENTS else json.dumps(obj, ensure_ascii=False)
+        for sub in list(turn.subscribers):
+            if not sub.put(obj, payload):
+                turn.subscribers.discard(sub)
+
+    def _subscribe(turn: ActiveTurn, websocket: WebSocket, replay: bool = False) -> WsSubscriber:
+        server_cfg = _state_cfg(app).SERVER
+        sub = WsSubscriber(
+            websocket,
+            flush_ms=server_cfg.WS_FLUSH_MS,
+            flush_chars=server_cfg.WS_FLUSH_CHARS,
+            max_queue=server_cfg.WS_QUEUE_MAX,
+        )
+        if replay:
+            # Queued before joining, with no await in between, so no live event can slip ahead.
+            sub.put(turn.backlog.snapshot())
+        turn.subscribers.add(sub)
+        sub.start()
+        return sub
 
     async def _run_chat_turn(
             chat_id: str,
@@ -302,11 +406,15 @@ def create_app(config_path: str | None = None) -> FastAPI:
             user_msg_id: int | None,
             attached_uploads: list[dict],
             attached_doc_ids: list[str],
+            timer: _StageTimer,
     ) -> None:
         db = _state_db(app)
         model = _state_model(app)
         rag = _state_rag(app)
         cfg = _state_cfg(app)
+        # Everything blocking goes to a pool: this loop streams tokens for every chat.
+        db_pool = _state_db_pool(app)
+        retrieval_pool = _state_retrieval_pool(app)
 
         snips = []
         citation_docs = []
@@ -319,29 +427,11 @@ def create_app(config_path: str | None = None) -> FastAPI:
             max_new_tokens=min(cfg.MODEL.MAX_NEW_TOKENS, 8192),
         )
 
-        async def token_stream(messages: list[dict[str, str]]):
-            loop = asyncio.get_running_loop()
-            q: asyncio.Queue[Optional[str]] = asyncio.Queue(maxsize=256)
-
-            def _producer():
-                try:
-                    for chunk in model.stream_chat(messages, params):
-                        asyncio.run_coroutine_threadsafe(q.put(chunk), loop).result()
-                except Exception as e:
-                    asyncio.run_coroutine_threadsafe(q.put(f"__STREAM_ERROR__:{e}"), loop).result()
-                finally:
-                    asyncio.run_coroutine_threadsafe(q.put(None), loop).result()
-
-            t = threading.Thread(target=_producer, daemon=True)
-            t.start()
-
-            while True:
-                item = await q.get()
-                if item is None:
-                    break
-                if isinstance(item, str) and item.startswith("__STREAM_ERROR__:"):
-                    raise RuntimeError(item.split(":", 1)[1])
-                yield item
+        def token_stream(messages: list[dict[str, str]]) -> AsyncIterator[str]:
+            astream = getattr(model, "astream_chat", None)
+            if astream is not None:
+                return astream(messages, params)
+            return stream_in_thread(model.stream_chat, messages, params)
 
         think_state = {"mode": "answer", "buf": ""}
         think_started = False
@@ -358,60 +448,82 @@ def create_app(config_path: str | None = None) -> FastAPI:
                 answer_text.append(tail)
             think_state["buf"] = ""
 
-        t0 = time.perf_counter()
         think_t0: Optional[float] = None
         think_ms: Optional[int] = None
+        ttft_ms: Optional[int] = None
 
-        try:
-            if created_new:
-                await _broadcast(chat_id, {"event": "chat_created", "chat_id": chat_id})
+        async def _send_token(event: str, token: str) -> None:
+            nonlocal ttft_ms
+            if ttft_ms is None:
+                ttft_ms = timer.ms()
+            await _broadcast(chat_id, {"event": event, "token": token})
 
-            recall_answer = _build_history_recall_answer(db, chat_id=chat_id, current_message=message)
-            if recall_answer:
-                total_ms = int((time.perf_counter() - t0) * 1000)
-                meta = {
-                    "think_ms": 0,
-                    "total_ms": total_ms,
-                    "created_new": created_new,
-                    "session_id": session_id,
-                    "mode": "history_recall",
-                }
-                await _broadcast(chat_id, {"event": "stage", "stage": "generation"})
-                await _broadcast(chat_id, {"event": "answer_token", "token": recall_answer})
-                persist_turn(db, chat_id=chat_id, assistant_answer=recall_answer, assistant_think="", meta=meta)
-                await _broadcast(chat_id, {"event": "done", "chat_id": chat_id, "think_ms": 0, "total_ms": total_ms})
-                return
+        async def _finish_canned(answer: str, mode: str, **extra: Any) -> None:
+            # History recall and upload-only turns answer without the model.
+            await _broadcast(chat_id, {"event": "stage", "stage": "generation"})
+            await _send_token("answer_token", answer)
+            total_ms = timer.ms()
+            meta = {
+                "think_ms": 0,
+                "total_ms": total_ms,
+                "ttft_ms": ttft_ms,
+                "stages": timer.stages,
+                "created_new": created_new,
+                "session_id": session_id,
+                "mode": mode,
+                **extra,
+            }
+            await db_pool.run(persist_turn, db, chat_id=chat_id, assistant_answer=answer, assistant_think="", meta=meta)
+            await _broadcast(
+                chat_id, {"event": "done", "chat_id": chat_id, "think_ms": 0, "total_ms": total_ms, "ttft_ms": ttft_ms}
+            )
 
-            await _broadcast(chat_id, {"event": "stage", "stage": "preparing"})
+        async def _load_history() -> list[MessageRow]:
+            return await timer.run("history", db_pool.run(db.get_messages, chat_id=chat_id, limit=2000))
+
+        async def _retrieve() -> list:
+            nonlocal attached_doc_ids
             if pending_uploads > 0:
                 await _broadcast(chat_id, {"event": "stage", "stage": "parsing"})
-                build_result = await asyncio.to_thread(rag.build_or_update_index)
+                index_job = _state_index_jobs(app).submit(JOB_INDEX, _upload_paths(attached_uploads), chat_id=chat_id)
+                build_result = await timer.run("uploads", _state_index_jobs(app).wait(index_job))
                 if user_msg_id is not None:
-                    db.mark_uploaded_files_processed(chat_id, user_msg_id)
-                attached_doc_ids = _resolve_doc_ids_for_uploads(app, attached_uploads)
+                    await db_pool.run(db.mark_uploaded_files_processed, chat_id, user_msg_id)
+                attached_doc_ids = await db_pool.run(_resolve_doc_ids_for_uploads, app, attached_uploads)
                 await _broadcast(chat_id, {"event": "uploads_processed", "count": pending_uploads, "index": build_result})
                 if not message:
-                    total_ms = int((time.perf_counter() - t0) * 1000)
-                    ack = f"Processed {pending_uploads} uploaded file{'s' if pending_uploads != 1 else ''}. You can ask about them now."
-                    meta = {
-                        "think_ms": 0,
-                        "total_ms": total_ms,
-                        "created_new": created_new,
-                        "session_id": session_id,
-                        "mode": "uploads_processed",
-                        "uploads": attached_uploads,
-                    }
-                    await _broadcast(chat_id, {"event": "stage", "stage": "generation"})
-                    await _broadcast(chat_id, {"event": "answer_token", "token": ack})
-                    persist_turn(db, chat_id=chat_id, assistant_answer=ack, assistant_think="", meta=meta)
-                    await _broadcast(chat_id, {"event": "done", "chat_id": chat_id, "think_ms": 0, "total_ms": total_ms})
+                    return []
+            await _broadcast(chat_id, {"event": "stage", "stage": "retrieval"})
+            if not cfg.RAG.ENABLED:
+                return []
+            if not attached_doc_ids and attached_uploads:
+                attached_doc_ids = await db_pool.run(_resolve_doc_ids_for_uploads, app, attached_uploads)
+            return await timer.run(
+                "retrieval",
+                retrieval_pool.run(rag.retrieve, message, top_k=cfg.RAG.TOP_K, preferred_doc_ids=attached_doc_ids or None),
+            )
+
+        try:
+            if created_new:
+                await _broadcast(chat_id, {"event": "chat_created", "chat_id": chat_id})
+
+            if _looks_like_history_recall(message):
+                recall_answer = _build_history_recall_answer(await _load_history(), message)
+                if recall_answer:
+                    await _finish_canned(recall_answer, "history_recall")
                     return
 
-            await _broadcast(chat_id, {"event": "stage", "stage": "retrieval"})
-            if cfg.RAG.ENABLED:
-                if not attached_doc_ids and attached_uploads:
-                    attached_doc_ids = _resolve_doc_ids_for_uploads(app, attached_uploads)
-                snips = rag.retrieve(message, top_k=cfg.RAG.TOP_K, preferred_doc_ids=attached_doc_ids or None)
+            await _broadcast(chat_id, {"event": "stage", "stage": "preparing"})
+            # History and retrieval (after any upload indexing) are independent; the
+            # prompt needs both, so the slower of the two sets time-to-first-token.
+            past, snips = await asyncio.gather(_load_history(), _retrieve())
+
+            if pending_uploads > 0 and not message:
+                ack = f"Processed {pending_uploads} uploaded file{'s' if pending_uploads != 1 else ''}. You can ask about them now."
+                await _finish_canned(ack, "uploads_processed", uploads=attached_uploads)
+                return
+
+            if snips:
                 snips, citation_docs = _assign_citation_ids(snips)
                 rag_context = format_rag_context(snips, max_chars=cfg.RAG.PROMPT_MAX_CHARS)
                 rag_docs_payload = [
@@ -442,8 +554,11 @@ def create_app(config_path: str | None = None) -> FastAPI:
                     max_new_tokens=min(cfg.MODEL.MAX_NEW_TOKENS, 8192),
                 )
 
-            messages = build_llm_messages(db, chat_id=chat_id, rag_context=rag_context, response_mode=response_mode)
+            messages = build_llm_messages(
+                db, chat_id=chat_id, rag_context=rag_context, response_mode=response_mode, history=past
+            )
             await _broadcast(chat_id, {"event": "stage", "stage": "generation"})
+            generation_start = timer.ms()
 
             expose_thinking = response_mode != "simple"
 
@@ -457,17 +572,18 @@ def create_app(config_path: str | None = None) -> FastAPI:
                             think_started = True
                             think_t0 = time.perf_counter()
                             await _broadcast(chat_id, {"event": "think_start"})
-                        await _broadcast(chat_id, {"event": "think_token", "token": think_part})
+                        await _send_token("think_token", think_part)
 
                 if answer_part:
                     if expose_thinking and think_started and think_ms is None and think_t0 is not None:
                         think_ms = int((time.perf_counter() - think_t0) * 1000)
                         await _broadcast(chat_id, {"event": "think_end", "think_ms": think_ms})
                     answer_text.append(answer_part)
-                    await _broadcast(chat_id, {"event": "answer_token", "token": answer_part})
+                    await _send_token("answer_token", answer_part)
 
             _flush_split_buffer()
-            total_ms = int((time.perf_counter() - t0) * 1000)
+            total_ms = timer.ms()
+            timer.stages["generation"] = {"start_ms": generation_start, "end_ms": total_ms}
 
             if expose_thinking and think_started and think_ms is None and think_t0 is not None:
                 think_ms = int((time.perf_counter() - think_t0) * 1000)
@@ -485,20 +601,26 @@ def create_app(config_path: str | None = None) -> FastAPI:
             meta = {
                 "think_ms": think_ms or 0,
                 "total_ms": total_ms,
+                "ttft_ms": ttft_ms,
+                "stages": timer.stages,
                 "created_new": created_new,
                 "session_id": session_id,
                 "response_mode": response_mode,
                 "uploads": attached_uploads,
                 "citations": citation_docs,
             }
-            persist_turn(
+            await db_pool.run(
+                persist_turn,
                 db,
                 chat_id=chat_id,
                 assistant_answer=full_answer,
                 assistant_think=full_think if expose_thinking else "",
                 meta=meta,
             )
-            await _broadcast(chat_id, {"event": "done", "chat_id": chat_id, "think_ms": meta["think_ms"], "total_ms": total_ms})
+            await _broadcast(
+                chat_id,
+                {"event": "done", "chat_id": chat_id, "think_ms": meta["think_ms"], "total_ms": total_ms, "ttft_ms": ttft_ms},
+            )
         except Exception as e:
             logger.exception("WS error: %s", e)
             await _broadcast(chat_id, {"event": "error", "error": str(e)})
@@ -528,9 +650,30 @@ def create_app(config_path: str | None = None) -> FastAPI:
         return JSONResponse(_health_payload(app))
 
 
+    @app.get("/v1/metrics")
+    async def metrics():
+        return {
+            "executors": {
+                "retrieval": _state_retrieval_pool(app).stats(),
+                "db": _state_db_pool(app).stats(),
+            },
+            "event_loop_lag": app.state.loop_lag.stats(),
+            "active_turns": len(_state_turns(app)),
+        }
+
+
     @app.post("/v1/index/build")
-    def build_index():
-        return _state_rag(app).build_or_update_index()
+    async def build_index():
+        job = _state_index_jobs(app).submit(JOB_SCAN)
+        return {"ok": True, **job.to_dict()}
+
+
+    @app.get("/v1/index/jobs/{job_id}")
+    async def get_index_job(job_id: str):
+        job = _state_index_jobs(app).get(job_id)
+        if job is None:
+            return JSONResponse({"detail": "index job not found"}, status_code=404)
+        return job.to_dict()
 
 
     @app.post("/v1/chats")
@@ -548,12 +691,16 @@ def create_app(config_path: str | None = None) -> FastAPI:
     async def upload_file(chat_id: str, file: UploadFile = File(...)):
         cfg = _state_cfg(app)
         db = _state_db(app)
-        if db.get_chat(chat_id) is None:
+        db_pool = _state_db_pool(app)
+        if await db_pool.run(db.get_chat, chat_id) is None:
             return JSONResponse({"detail": "chat not found"}, status_code=404)
         original_name = Path(file.filename or "").name
         suffix = Path(original_name).suffix.lower()
         if not original_name:
             return JSONResponse({"detail": "missing filename"}, status_code=400)
+        # The index scan only picks up DOCS_EXTS, so anything else would never be retrievable.
+        if suffix not in {e.lower() if e.startswith(".") else f".{e.lower()}" for e in cfg.DOCS_EXTS}:
+            return JSONResponse({"detail": f"unsupported file type: {suffix or '(none)'}"}, status_code=400)
 
         safe_stem, _ = _safe_upload_name(original_name)
         upload_dir = _chat_upload_root(cfg, chat_id)
@@ -581,15 +728,20 @@ def create_app(config_path: str | None = None) -> FastAPI:
                     out.write(chunk)
 
             try:
-                from src.rag.parsers import parse_file_sections
-                parse_file_sections(target)
+                from src.rag.parsers import file_sha1, parse_file_sections
+                # Validating the upload also fills the section cache, so indexing it is parse-free.
+                section_cache = _state_rag(app).section_cache
+                await _state_retrieval_pool(app).run(
+                    lambda: parse_file_sections(target, sha1=file_sha1(target), cache=section_cache)
+                )
             except Exception as exc:
                 with contextlib.suppress(FileNotFoundError):
                     target.unlink()
                 return JSONResponse({"detail": f"unsupported or unreadable file: {exc}"}, status_code=400)
 
             rel_path = _safe_display_path(target)
-            upload_id = db.add_uploaded_file(
+            upload_id = await db_pool.run(
+                db.add_uploaded_file,
                 chat_id=chat_id,
                 original_name=original_name,
                 stored_name=target.name,
@@ -618,17 +770,19 @@ def create_app(config_path: str | None = None) -> FastAPI:
 
 
     @app.delete("/v1/chats/{chat_id}/uploads/{upload_id}")
-    def delete_upload(chat_id: str, upload_id: int):
+    async def delete_upload(chat_id: str, upload_id: int):
         cfg = _state_cfg(app)
-        row = _state_db(app).delete_uploaded_file(chat_id=chat_id, upload_id=upload_id)
+        row = await _state_db_pool(app).run(_state_db(app).delete_uploaded_file, chat_id=chat_id, upload_id=upload_id)
         if row is None:
             return JSONResponse({"detail": "upload not found"}, status_code=404)
         file_path = _chat_upload_root(cfg, chat_id) / row.stored_name
         with contextlib.suppress(FileNotFoundError):
             file_path.unlink()
+        job_id = None
         if bool(row.processed):
-            _state_rag(app).build_or_update_index()
-        return {"ok": True, "upload_id": upload_id}
+            job = _state_index_jobs(app).submit(JOB_REMOVE, [str(file_path.expanduser().resolve())], chat_id=chat_id)
+            job_id = job.job_id
+        return {"ok": True, "upload_id": upload_id, "job_id": job_id}
 
 
     @app.get("/v1/files/{doc_id}")
@@ -668,14 +822,16 @@ def create_app(config_path: str | None = None) -> FastAPI:
 
 
     @app.delete("/v1/chats/{chat_id}")
-    def delete_chat(chat_id: str):
+    async def delete_chat(chat_id: str):
         cfg = _state_cfg(app)
         upload_root = _chat_upload_root(cfg, chat_id)
+        uploaded: list[str] = []
         if upload_root.exists():
-            shutil.rmtree(upload_root, ignore_errors=True)
-        _state_db(app).delete_chat(chat_id=chat_id)
-        _state_rag(app).build_or_update_index()
-        return {"ok": True}
+            uploaded = [str(p.resolve()) for p in upload_root.rglob("*") if p.is_file()]
+            await asyncio.to_thread(shutil.rmtree, upload_root, True)
+        await _state_db_pool(app).run(_state_db(app).delete_chat, chat_id=chat_id)
+        job_id = _state_index_jobs(app).submit(JOB_REMOVE, uploaded).job_id if uploaded else None
+        return {"ok": True, "job_id": job_id}
 
 
     @app.websocket("/v1/chat/ws")
@@ -705,46 +861,41 @@ def create_app(config_path: str | None = None) -> FastAPI:
                     await websocket.send_text(json.dumps({"event": "error", "error": "chat_busy"}))
                     await websocket.close()
                     return
-                existing_turn.subscribers.add(websocket)
-                await _replay_turn(existing_turn, websocket)
+                sub = _subscribe(existing_turn, websocket, replay=True)
                 try:
                     while True:
                         await websocket.receive_text()
                 except WebSocketDisconnect:
-                    existing_turn.subscribers.discard(websocket)
                     return
+                finally:
+                    existing_turn.subscribers.discard(sub)
+                    await sub.close()
 
-        pending_uploads = len(db.list_pending_uploaded_files(chat_id)) if chat_id else 0
-
-        if not message and pending_uploads == 0:
+        timer = _StageTimer()
+        turns = _state_turns(app)
+        reserved: ActiveTurn | None = None
+        if chat_id:
+            # Claim the chat before the first await so a concurrent message gets chat_busy.
+            reserved = turns[str(chat_id)] = ActiveTurn(chat_id=str(chat_id))
+        try:
+            rows = await timer.run("open_turn", _state_db_pool(app).run(_open_turn_rows, db, chat_id, message))
+        except Exception:
+            if reserved is not None:
+                turns.pop(str(chat_id), None)
+            raise
+        if rows is None:
+            if reserved is not None:
+                await _broadcast(str(chat_id), {"event": "error", "error": "no_active_turn"})
+                turns.pop(str(chat_id), None)
             await websocket.send_text(json.dumps({"event": "error", "error": "no_active_turn"}))
             await websocket.close()
             return
-
-        created_new = False
-        if not chat_id:
-            chat_id = db.create_chat(first_user_text=message)
-            created_new = True
-
-        pending_uploads = len(db.list_pending_uploaded_files(chat_id))
-        attached_uploads: list[dict] = []
+        chat_id, created_new, pending_uploads, attached_uploads, user_msg_id = rows
         attached_doc_ids: list[str] = []
 
-        if message:
-            db.maybe_update_title_from_first_user_text(chat_id=chat_id, first_user_text=message)
-            user_msg_id = db.add_message(chat_id=chat_id, role="user", content=message)
-            attached_rows = db.attach_pending_uploads_to_message(chat_id=chat_id, msg_id=user_msg_id)
-            attached_uploads = [_uploaded_file_to_dict(row) for row in attached_rows]
-        elif pending_uploads > 0:
-            user_msg_id = db.add_message(chat_id=chat_id, role="user", content="")
-            attached_rows = db.attach_pending_uploads_to_message(chat_id=chat_id, msg_id=user_msg_id)
-            attached_uploads = [_uploaded_file_to_dict(row) for row in attached_rows]
-        else:
-            user_msg_id = None
-
-        turn = ActiveTurn(chat_id=str(chat_id))
-        turn.subscribers.add(websocket)
-        _state_turns(app)[str(chat_id)] = turn
+        turn = reserved or ActiveTurn(chat_id=chat_id)
+        sub = _subscribe(turn, websocket)
+        turns[chat_id] = turn
         turn.task = asyncio.create_task(
             _run_chat_turn(
                 chat_id=str(chat_id),
@@ -755,15 +906,17 @@ def create_app(config_path: str | None = None) -> FastAPI:
                 user_msg_id=user_msg_id,
                 attached_uploads=attached_uploads,
                 attached_doc_ids=attached_doc_ids,
+                timer=timer,
             )
         )
         try:
             while True:
                 await websocket.receive_text()
         except WebSocketDisconnect:
-            turn.subscribers.discard(websocket)
             return
         finally:
+            turn.subscribers.discard(sub)
+            await sub.close()
             with contextlib.suppress(Exception):
                 await websocket.close()
             logger.info("WS close for chat_id=%s", chat_id)
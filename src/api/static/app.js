@@ -907,6 +907,20 @@
         }
     }
 
+    function snapshotEvents(snap) {
+        const events = [...(snap.events || [])];
+        if (snap.stage) events.push({ event: "stage", stage: snap.stage });
+        if (snap.rag) events.push(snap.rag);
+        if (snap.think_started) events.push({ event: "think_start" });
+        if (snap.think_text) events.push({ event: "think_token", token: snap.think_text });
+        if (snap.think_ms !== null && snap.think_ms !== undefined) {
+            events.push({ event: "think_end", think_ms: snap.think_ms });
+        }
+        if (snap.answer_text) events.push({ event: "answer_token", token: snap.answer_text });
+        if (snap.finished) events.push(snap.finished);
+        return events;
+    }
+
     async function maybeResumeTurn(chatId) {
         if (!chatId || isBusy) return;
         closeWs();
@@ -926,6 +940,14 @@
             } catch (_) {
                 return;
             }
+            if (obj.event === "snapshot") {
+                // The server sends the turn so far as one frame; replay it through the same handler.
+                snapshotEvents(obj).forEach(handleResumeEvent);
+                return;
+            }
+            handleResumeEvent(obj);
+        };
+        const handleResumeEvent = (obj) => {
             const ev = obj.event;
             if (ev === "error") {
                 if (!shouldIgnoreResumeError(obj.error || "")) {
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-viewer WebSocket send queues for streamed chat turns.
+src/api/ws_fanout.py
+
+Broadcasting only appends to each subscriber's queue; a sender task per subscriber writes
+the frames out, so a slow phone delays nobody but itself. Consecutive answer/think tokens
+merge into one frame per flush window, which also fast-forwards a lagging client: it
+receives the same text in fewer, larger frames. A client that still falls WS_QUEUE_MAX
+frames behind is closed with 1013 (try again later) and can reconnect to replay the turn.
+
+Replay comes from TurnBacklog: the turn folded into its current state (stage, rag payload,
+think/answer text, think timing) plus a ring of recent other events, sent as one
+`snapshot` frame ahead of the live events.
+
+@author: LIU Ziyi
+@date: 2026-01-01
+@license: Apache-2.0
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+import logging
+from collections import deque
+from typing import Any, Optional
+
+from fastapi import WebSocket
+
+logger = logging.getLogger("ws_fanout")
+
+TOKEN_EVENTS = frozenset({"answer_token", "think_token"})
+
+
+class _Text:
+    """Append-only string; folds its parts every so often so tokens do not each keep an object."""
+
+    __slots__ = ("_parts",)
+
+    def __init__(self) -> None:
+        self._parts: list[str] = []
+
+    def write(self, token: str) -> None:
+        self._parts.append(token)
+        if len(self._parts) >= 512:
+            self._parts = ["".join(self._parts)]
+
+    def getvalue(self) -> str:
+        return "".join(self._parts)
+
+
+class TurnBacklog:
+    """Replay state of one turn, O(answer length) however many token events it took."""
+
+    def __init__(self, recent: int = 32) -> None:
+        self.stage: Optional[str] = None
+        self.rag: Optional[dict[str, Any]] = None
+        self.think_started = False
+        self.think_ms: Optional[int] = None
+        self.finished: Optional[dict[str, Any]] = None  # the done / error event
+        self.recent: deque[dict[str, Any]] = deque(maxlen=max(1, int(recent)))
+        self._think = _Text()
+        self._answer = _Text()
+
+    def add(self, obj: dict[str, Any]) -> None:
+        event = obj.get("event")
+        if event == "answer_token":
+            self._answer.write(str(obj.get("token") or ""))
+        elif event == "think_token":
+            self._think.write(str(obj.get("token") or ""))
+        elif event == "stage":
+            self.stage = obj.get("stage")
+        elif event == "rag":
+            self.rag = obj
+        elif event == "think_start":
+            self.think_started = True
+        elif event == "think_end":
+            self.think_ms = int(obj.get("think_ms") or 0)
+        elif event in ("done", "error"):
+            self.finished = obj
+        else:
+            self.recent.append(obj)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "event": "snapshot",
+            "events": list(self.recent),
+            "stage": self.stage,
+            "rag": self.rag,
+            "think_started": self.think_started,
+            "think_text": self._think.getvalue(),
+            "think_ms": self.think_ms,
+            "answer_text": self._answer.getvalue(),
+            "finished": self.finished,
+        }
+
+
+class _TokenRun:
+    """Unsent tokens of one kind, merged into a single frame."""
+
+    __slots__ = ("event", "parts", "chars", "first_at")
+
+    def __init__(self, event: str, first_at: float) -> None:
+        self.event = event
+        self.parts: list[str] = []
+        self.chars = 0
+        self.first_at = first_at
+
+    def add(self, token: str) -> None:
+        self.parts.append(token)
+        self.chars += len(token)
+
+    def payload(self) -> str:
+        return json.dumps({"event": self.event, "token": "".join(self.parts)}, ensure_ascii=False)
+
+
+class WsSubscriber:
+    def __init__(self, ws: WebSocket, flush_ms: int = 30, flush_chars: int = 256, max_queue: int = 256) -> None:
+        self.ws = ws
+        self.flush_s = max(0, int(flush_ms)) / 1000.0
+        self.flush_chars = max(1, int(flush_chars))
+        self.max_queue = max(1, int(max_queue))
+        self.frames_sent = 0
+        self.dropped = False
+        self._queue: deque[_TokenRun | str] = deque()
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    def put(self, obj: dict[str, Any], payload: Optional[str] = None) -> bool:
+        """Queue one event without waiting; False once the subscriber has been dropped."""
+        if self.dropped:
+            return False
+        event = obj.get("event")
+        if event in TOKEN_EVENTS:
+            last = self._queue[-1] if self._queue else None
+            if not isinstance(last, _TokenRun) or last.event != event:
+                last = _TokenRun(str(event), asyncio.get_running_loop().time())
+                if not self._append(last):
+                    return False
+            last.add(str(obj.get("token") or ""))
+        elif not self._append(payload if payload is not None else json.dumps(obj, ensure_ascii=False)):
+            return False
+        self._wake.set()
+        return True
+
+    def _append(self, item: _TokenRun | str) -> bool:
+        if len(self._queue) >= self.max_queue:
+            logger.info("WS subscriber %s lagging by %d frames; dropping it", self.ws.client, len(self._queue))
+            self.dropped = True
+            self._queue.clear()
+            self._wake.set()
+            return False
+        self._queue.append(item)
+        return True
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                while not self._queue and not self.dropped:
+                    self._wake.clear()
+                    await self._wake.wait()
+                if self.dropped:
+                    with contextlib.suppress(Exception):
+                        await self.ws.close(code=1013)
+                    return
+                head = self._queue[0]
+                if isinstance(head, _TokenRun) and len(self._queue) == 1 and head.chars < self.flush_chars:
+                    # Hold the frame open for the rest of the window so more tokens can join it.
+                    delay = head.first_at + self.flush_s - loop.time()
+                    if delay > 0:
+                        self._wake.clear()
+                        with contextlib.suppress(asyncio.TimeoutError):
+                            await asyncio.wait_for(self._wake.wait(), delay)
+                        continue
+                item = self._queue.popleft()
+                await self.ws.send_text(item.payload() if isinstance(item, _TokenRun) else item)
+                self.frames_sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Socket gone; the next put() reports it so the broadcaster forgets us.
+            self.dropped = True
+            self._queue.clear()
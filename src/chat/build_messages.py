@@ -11,11 +11,11 @@ src/chat/build_messages.py
 from __future__ import annotations
 
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 from src.chat.system_prompt import SYSTEM_PROMPT
 from src.rag.types import RagSnippet
-from src.storage.history_db import HistoryDB
+from src.storage.history_db import HistoryDB, MessageRow
 
 Message = Dict[str, str]
 
@@ -42,8 +42,10 @@ def build_llm_messages(
         chat_id: str,
         rag_context: str = "",
         response_mode: str = "default",
+        history: Optional[List[MessageRow]] = None,
 ) -> List[Message]:
-    past = db.get_messages(chat_id=chat_id, limit=2000)
+    """`history` is the chat's messages if the caller already loaded them (no DB access then)."""
+    past = history if history is not None else db.get_messages(chat_id=chat_id, limit=2000)
     history_msgs = [{"role": m.role, "content": m.content} for m in past if m.role in ("user", "assistant")]
 
     sys_content = SYSTEM_PROMPT
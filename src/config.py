@@ -61,26 +61,58 @@ class RagConfig:
 
     # Storage
     INDEX_DIR: str = "data/rag"
-    INDEX_FILE: str = "chunks.index.faiss"  # if faiss exists -> real faiss index; else -> npz stored with this name
+    INDEX_FILE: str = "chunks.index.faiss"  # if faiss exists -> real faiss index; else -> raw .npy matrix stored with this name
+    INDEX_DTYPE: str = "float32"  # numpy backend storage: "float32" | "float16"
     SQLITE_FILE: str = "rag_meta.db"
     UPLOAD_DIR: str = "data/raw/uploads"
 
     # Scanning
     MAX_FILE_SIZE_MB: int = 30
+    INDEX_WORKERS: int = 1  # processes for hashing/parsing/chunking; 0 -> one per CPU
+    REBUILD_BATCH_SIZE: int = 2048  # chunks per page when a full rebuild streams SQLite -> embedder -> index
+    WATCH: bool = False  # server: watch DOCS_GLOBS and index changes as they happen
+    WATCH_DEBOUNCE_S: float = 1.0  # quiet period before a burst of file events is indexed
+    WATCH_POLL_S: float = 5.0  # scan interval when inotify is unavailable
 
     # Chunking
     CHUNK_SIZE: int = 1000
     CHUNK_OVERLAP: int = 150
+    CHUNKER: str = "cdc"  # "cdc" (content-defined boundaries, edits re-embed only nearby chunks) | "fixed"
 
     # Retrieval
     TOP_K: int = 6
     CANDIDATES_K: int = 30  # pre-rerank candidates
+    LEXICAL_K: int = 30  # BM25 (SQLite FTS5) candidates fused with vector hits; 0 -> vector only
+    RRF_K: int = 60  # reciprocal-rank fusion constant
+
+    # Index type: "auto" -> "sparse" for the hashing embedder, else "flat".
+    # "ivf" / "ivfpq" are approximate search for the numpy backend.
+    INDEX_TYPE: str = "auto"  # "auto" | "sparse" | "flat" | "ivf" | "ivfpq"
+    IVF_NLIST: int = 0  # 0 -> 4 * sqrt(rows)
+    IVF_NPROBE: int = 16
+    IVF_MIN_ROWS: int = 20000  # below this, flat search is used
+    PQ_M: int = 64  # sub-quantizers for "ivfpq"; must divide EMBED_DIM
+
+    # Segments / tombstones (numpy backend only)
+    COMPACT_RATIO: float = 0.2  # compact on save once this fraction of rows is deleted
+    MAX_SEGMENTS: int = 16
 
     # Embedding (configurable)
     EMBEDDER_BACKEND: str = "hashing"  # "hashing" | "ollama"
     EMBED_DIM: int = 2048
     OLLAMA_URL: str = "http://localhost:11434"
     OLLAMA_EMBED_MODEL: str = "nomic-embed-text"
+    EMBED_BATCH_SIZE: int = 32  # texts per ollama /api/embed request
+    EMBED_CONCURRENCY: int = 4  # ollama embed requests in flight
+    EMBED_CACHE_ENABLED: bool = True  # persistent cache for non-local embedders (e.g. ollama)
+    EMBED_CACHE_FILE: str = "embed_cache.db"  # stored under INDEX_DIR
+    EMBED_CACHE_MAX_MB: int = 512
+    PARSE_CACHE_ENABLED: bool = True  # keep extracted PDF/DOCX/XLSX text so rebuilds skip parsing
+    PARSE_CACHE_DIR: str = "parse_cache"  # stored under INDEX_DIR
+    PARSE_CACHE_MAX_MB: int = 1024
+    PDF_WORKERS: int = 0  # extraction processes per PDF; 0 -> CPUs left over by INDEX_WORKERS
+    PDF_PAGE_TIMEOUT_S: float = 30.0  # skip a page that takes longer (worker processes only); 0 disables
+    PDF_DOC_TIMEOUT_S: float = 300.0  # skip the pages not extracted by then; 0 disables
 
     # Rerank (configurable)
     RERANK_BACKEND: str = "hybrid"  # "hybrid"
@@ -90,6 +122,17 @@ class RagConfig:
     PROMPT_MAX_CHARS: int = 6000
 
 
+@dataclass(frozen=True)
+class ServerConfig:
+    WS_FLUSH_MS: int = 30  # token events within this window go out as one frame
+    WS_FLUSH_CHARS: int = 256  # ...unless this many characters pile up first
+    WS_QUEUE_MAX: int = 256  # frames a subscriber may fall behind before it is disconnected
+    RETRIEVAL_WORKERS: int = 2  # threads for retrieval / parsing in request handlers
+    RETRIEVAL_QUEUE_MAX: int = 32  # calls allowed to wait for one; more wait on the event loop
+    DB_WORKERS: int = 4  # threads for history / index SQLite access
+    DB_QUEUE_MAX: int = 128
+
+
 @dataclass(frozen=True)
 class AppConfig:
     LOG_LEVEL: str = "INFO"
@@ -99,6 +142,7 @@ class AppConfig:
     DOCS_EXTS: tuple[str, ...] = (".txt", ".md", ".tex", ".pdf", ".doc", ".docx", ".html", ".htm", ".csv", ".xls", ".xlsx", ".xlsm")
     MODEL: ModelConfig = ModelConfig()
     RAG: RagConfig = RagConfig()
+    SERVER: ServerConfig = ServerConfig()
 
     @property
     def model(self) -> ModelConfig:
@@ -108,6 +152,10 @@ class AppConfig:
     def rag(self) -> RagConfig:
         return self.RAG
 
+    @property
+    def server(self) -> ServerConfig:
+        return self.SERVER
+
 
 def _get(d: Dict[str, Any], key: str, default: Any) -> Any:
     v = d.get(key, default)
@@ -129,6 +177,9 @@ def load_config(path: str | Path | None = None) -> AppConfig:
     rag_d_raw = normalized.get("RAG", {}) or {}
     rag_d = {str(k).upper(): v for k, v in rag_d_raw.items()}
 
+    server_d_raw = normalized.get("SERVER", {}) or {}
+    server_d = {str(k).upper(): v for k, v in server_d_raw.items()}
+
     model = ModelConfig(
         BACKEND=str(_get(model_d, "BACKEND", ModelConfig.BACKEND)),
         MODEL_NAME=str(_get(model_d, "MODEL_NAME", ModelConfig.MODEL_NAME)),
@@ -143,22 +194,59 @@ def load_config(path: str | Path | None = None) -> AppConfig:
         ENABLED=bool(_get(rag_d, "ENABLED", RagConfig.ENABLED)),
         INDEX_DIR=str(_get(rag_d, "INDEX_DIR", RagConfig.INDEX_DIR)),
         INDEX_FILE=str(_get(rag_d, "INDEX_FILE", RagConfig.INDEX_FILE)),
+        INDEX_DTYPE=str(_get(rag_d, "INDEX_DTYPE", RagConfig.INDEX_DTYPE)),
         SQLITE_FILE=str(_get(rag_d, "SQLITE_FILE", RagConfig.SQLITE_FILE)),
         UPLOAD_DIR=str(_get(rag_d, "UPLOAD_DIR", RagConfig.UPLOAD_DIR)),
         MAX_FILE_SIZE_MB=int(_get(rag_d, "MAX_FILE_SIZE_MB", RagConfig.MAX_FILE_SIZE_MB)),
+        INDEX_WORKERS=int(_get(rag_d, "INDEX_WORKERS", RagConfig.INDEX_WORKERS)),
+        REBUILD_BATCH_SIZE=int(_get(rag_d, "REBUILD_BATCH_SIZE", RagConfig.REBUILD_BATCH_SIZE)),
         CHUNK_SIZE=int(_get(rag_d, "CHUNK_SIZE", RagConfig.CHUNK_SIZE)),
         CHUNK_OVERLAP=int(_get(rag_d, "CHUNK_OVERLAP", RagConfig.CHUNK_OVERLAP)),
+        CHUNKER=str(_get(rag_d, "CHUNKER", RagConfig.CHUNKER)),
         TOP_K=int(_get(rag_d, "TOP_K", RagConfig.TOP_K)),
         CANDIDATES_K=int(_get(rag_d, "CANDIDATES_K", RagConfig.CANDIDATES_K)),
+        LEXICAL_K=int(_get(rag_d, "LEXICAL_K", RagConfig.LEXICAL_K)),
+        RRF_K=int(_get(rag_d, "RRF_K", RagConfig.RRF_K)),
+        INDEX_TYPE=str(_get(rag_d, "INDEX_TYPE", RagConfig.INDEX_TYPE)).lower(),
+        IVF_NLIST=int(_get(rag_d, "IVF_NLIST", RagConfig.IVF_NLIST)),
+        IVF_NPROBE=int(_get(rag_d, "IVF_NPROBE", RagConfig.IVF_NPROBE)),
+        IVF_MIN_ROWS=int(_get(rag_d, "IVF_MIN_ROWS", RagConfig.IVF_MIN_ROWS)),
+        PQ_M=int(_get(rag_d, "PQ_M", RagConfig.PQ_M)),
+        COMPACT_RATIO=float(_get(rag_d, "COMPACT_RATIO", RagConfig.COMPACT_RATIO)),
+        MAX_SEGMENTS=int(_get(rag_d, "MAX_SEGMENTS", RagConfig.MAX_SEGMENTS)),
+        WATCH=bool(_get(rag_d, "WATCH", RagConfig.WATCH)),
+        WATCH_DEBOUNCE_S=float(_get(rag_d, "WATCH_DEBOUNCE_S", RagConfig.WATCH_DEBOUNCE_S)),
+        WATCH_POLL_S=float(_get(rag_d, "WATCH_POLL_S", RagConfig.WATCH_POLL_S)),
         EMBEDDER_BACKEND=str(_get(rag_d, "EMBEDDER_BACKEND", RagConfig.EMBEDDER_BACKEND)),
         EMBED_DIM=int(_get(rag_d, "EMBED_DIM", RagConfig.EMBED_DIM)),
         OLLAMA_URL=str(_get(rag_d, "OLLAMA_URL", RagConfig.OLLAMA_URL)),
         OLLAMA_EMBED_MODEL=str(_get(rag_d, "OLLAMA_EMBED_MODEL", RagConfig.OLLAMA_EMBED_MODEL)),
+        EMBED_BATCH_SIZE=int(_get(rag_d, "EMBED_BATCH_SIZE", RagConfig.EMBED_BATCH_SIZE)),
+        EMBED_CONCURRENCY=int(_get(rag_d, "EMBED_CONCURRENCY", RagConfig.EMBED_CONCURRENCY)),
+        EMBED_CACHE_ENABLED=bool(_get(rag_d, "EMBED_CACHE_ENABLED", RagConfig.EMBED_CACHE_ENABLED)),
+        EMBED_CACHE_FILE=str(_get(rag_d, "EMBED_CACHE_FILE", RagConfig.EMBED_CACHE_FILE)),
+        EMBED_CACHE_MAX_MB=int(_get(rag_d, "EMBED_CACHE_MAX_MB", RagConfig.EMBED_CACHE_MAX_MB)),
+        PARSE_CACHE_ENABLED=bool(_get(rag_d, "PARSE_CACHE_ENABLED", RagConfig.PARSE_CACHE_ENABLED)),
+        PARSE_CACHE_DIR=str(_get(rag_d, "PARSE_CACHE_DIR", RagConfig.PARSE_CACHE_DIR)),
+        PARSE_CACHE_MAX_MB=int(_get(rag_d, "PARSE_CACHE_MAX_MB", RagConfig.PARSE_CACHE_MAX_MB)),
+        PDF_WORKERS=int(_get(rag_d, "PDF_WORKERS", RagConfig.PDF_WORKERS)),
+        PDF_PAGE_TIMEOUT_S=float(_get(rag_d, "PDF_PAGE_TIMEOUT_S", RagConfig.PDF_PAGE_TIMEOUT_S)),
+        PDF_DOC_TIMEOUT_S=float(_get(rag_d, "PDF_DOC_TIMEOUT_S", RagConfig.PDF_DOC_TIMEOUT_S)),
         RERANK_BACKEND=str(_get(rag_d, "RERANK_BACKEND", RagConfig.RERANK_BACKEND)),
         RERANK_ALPHA=float(_get(rag_d, "RERANK_ALPHA", RagConfig.RERANK_ALPHA)),
         PROMPT_MAX_CHARS=int(_get(rag_d, "PROMPT_MAX_CHARS", RagConfig.PROMPT_MAX_CHARS)),
     )
 
+    server = ServerConfig(
+        WS_FLUSH_MS=int(_get(server_d, "WS_FLUSH_MS", ServerConfig.WS_FLUSH_MS)),
+        WS_FLUSH_CHARS=int(_get(server_d, "WS_FLUSH_CHARS", ServerConfig.WS_FLUSH_CHARS)),
+        WS_QUEUE_MAX=int(_get(server_d, "WS_QUEUE_MAX", ServerConfig.WS_QUEUE_MAX)),
+        RETRIEVAL_WORKERS=int(_get(server_d, "RETRIEVAL_WORKERS", ServerConfig.RETRIEVAL_WORKERS)),
+        RETRIEVAL_QUEUE_MAX=int(_get(server_d, "RETRIEVAL_QUEUE_MAX", ServerConfig.RETRIEVAL_QUEUE_MAX)),
+        DB_WORKERS=int(_get(server_d, "DB_WORKERS", ServerConfig.DB_WORKERS)),
+        DB_QUEUE_MAX=int(_get(server_d, "DB_QUEUE_MAX", ServerConfig.DB_QUEUE_MAX)),
+    )
+
     return AppConfig(
         LOG_LEVEL=str(_get(normalized, "LOG_LEVEL", AppConfig.LOG_LEVEL)),
         DEVICE=str(_get(normalized, "DEVICE", AppConfig.DEVICE)),
@@ -167,4 +255,5 @@ def load_config(path: str | Path | None = None) -> AppConfig:
         DOCS_EXTS=tuple(_get(normalized, "DOCS_EXTS", list(AppConfig.DOCS_EXTS))),
         MODEL=model,
         RAG=rag,
+        SERVER=server,
     )
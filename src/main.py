@@ -4,16 +4,72 @@ import argparse
 import json
 import os
 
+import numpy as np
 import uvicorn
 
 from src.api.server import create_app
 from src.config import load_config
 from src.rag.pipeline import RagPipeline
+from src.rag.vector_index import VectorIndex
+from src.rag.watcher import create_doc_watcher
 
 
-def _build_index(config_path: str) -> int:
+def _build_index(config_path: str, workers: int | None) -> int:
     cfg = load_config(config_path)
-    result = RagPipeline(cfg).build_or_update_index()
+    result = RagPipeline(cfg).build_or_update_index(workers=workers)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+def _watch(config_path: str, workers: int | None) -> int:
+    cfg = load_config(config_path)
+    rag = RagPipeline(cfg)
+    print(json.dumps(rag.build_or_update_index(workers=workers), ensure_ascii=False), flush=True)
+
+    def on_changes(paths: list[str]) -> None:
+        result = rag.index_paths(paths, workers=workers)
+        print(json.dumps({"paths": len(paths), **result}, ensure_ascii=False), flush=True)
+
+    def on_overflow() -> None:
+        print(json.dumps(rag.build_or_update_index(workers=workers), ensure_ascii=False), flush=True)
+
+    watcher = create_doc_watcher(cfg, on_changes, on_overflow)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def _bench_index(config_path: str, synthetic: int, queries: int, k: int, nprobes: str, pq_m: int) -> int:
+    from src.rag.ivf import recall_latency_report
+
+    cfg = load_config(config_path)
+    rng = np.random.default_rng(0)
+    if synthetic > 0:
+        centers = rng.standard_normal((max(16, synthetic // 500), cfg.RAG.EMBED_DIM)).astype(np.float32)
+        mat = centers[rng.integers(0, centers.shape[0], size=synthetic)]
+        mat = mat + 0.5 * rng.standard_normal(mat.shape).astype(np.float32)
+    else:
+        vindex = RagPipeline(cfg).vindex
+        vindex.load()
+        if not isinstance(vindex, VectorIndex) or vindex._index is not None:
+            raise SystemExit("bench-index needs the dense numpy backend (sparse or faiss index configured)")
+        mat, _ = vindex.live_vectors()
+    mat /= np.maximum(np.linalg.norm(mat, axis=1, keepdims=True), 1e-12)
+
+    picks = rng.choice(mat.shape[0], size=min(queries, mat.shape[0]), replace=False)
+    q = mat[picks] + 0.05 * rng.standard_normal((picks.shape[0], mat.shape[1])).astype(np.float32)
+    q /= np.maximum(np.linalg.norm(q, axis=1, keepdims=True), 1e-12)
+
+    result = recall_latency_report(
+        mat,
+        q,
+        k=k,
+        nlist=cfg.RAG.IVF_NLIST,
+        nprobes=tuple(int(x) for x in nprobes.split(",") if x.strip()),
+        pq_m=pq_m,
+    )
     print(json.dumps(result, ensure_ascii=False, indent=2))
     return 0
 
@@ -42,13 +98,30 @@ def main() -> int:
 
     build = sub.add_parser("build-index", help="Build or update the RAG index")
     build.add_argument("--config", default="configs/mobile_rag.yaml")
+    build.add_argument("--workers", type=int, default=None, help="parse/chunk processes (default: RAG.INDEX_WORKERS)")
+
+    watch = sub.add_parser("watch", help="Build the index, then keep it in sync with DOCS_GLOBS as files change")
+    watch.add_argument("--config", default="configs/mobile_rag.yaml")
+    watch.add_argument("--workers", type=int, default=None, help="parse/chunk processes (default: RAG.INDEX_WORKERS)")
+
+    bench = sub.add_parser("bench-index", help="Report recall@k vs latency of IVF(/PQ) against flat search")
+    bench.add_argument("--config", default="configs/mobile_rag.yaml")
+    bench.add_argument("--synthetic", type=int, default=0, help="use N random clustered vectors instead of the index")
+    bench.add_argument("--queries", type=int, default=200)
+    bench.add_argument("--k", type=int, default=10)
+    bench.add_argument("--nprobe", default="1,4,16,64")
+    bench.add_argument("--pq-m", type=int, default=0)
 
     args = parser.parse_args()
 
     if args.command == "serve":
         return _serve(args.config, args.host, args.port, args.reload)
     if args.command == "build-index":
-        return _build_index(args.config)
+        return _build_index(args.config, args.workers)
+    if args.command == "watch":
+        return _watch(args.config, args.workers)
+    if args.command == "bench-index":
+        return _bench_index(args.config, args.synthetic, args.queries, args.k, args.nprobe, args.pq_m)
     return 1
 
 
@@ -10,8 +10,10 @@ src/models/base.py
 """
 from __future__ import annotations
 
+import asyncio
+import threading
 from dataclasses import dataclass
-from typing import Dict, Iterable, List, Protocol
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Protocol
 
 
 @dataclass(frozen=True)
@@ -31,4 +33,37 @@ class ChatModel(Protocol):
             self, messages: List[Message], params: GenerationParams
     ) -> Iterable[str]: ...
 
+    def astream_chat(
+            self, messages: List[Message], params: GenerationParams
+    ) -> AsyncIterator[str]: ...
+
     def chat(self, messages: List[Message], params: GenerationParams) -> str: ...
+
+
+async def stream_in_thread(
+        stream_chat: Callable[[List[Message], GenerationParams], Iterable[str]],
+        messages: List[Message],
+        params: GenerationParams,
+) -> AsyncIterator[str]:
+    """Fallback for sync-only backends: drain a blocking stream_chat on its own thread."""
+    loop = asyncio.get_running_loop()
+    q: asyncio.Queue[Optional[str]] = asyncio.Queue(maxsize=256)
+    errors: List[BaseException] = []
+
+    def _producer() -> None:
+        try:
+            for chunk in stream_chat(messages, params):
+                asyncio.run_coroutine_threadsafe(q.put(chunk), loop).result()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            asyncio.run_coroutine_threadsafe(q.put(None), loop).result()
+
+    threading.Thread(target=_producer, daemon=True).start()
+    while True:
+        item = await q.get()
+        if item is None:
+            break
+        yield item
+    if errors:
+        raise RuntimeError(str(errors[0])) from errors[0]
@@ -12,8 +12,9 @@ from __future__ import annotations
 
 import json
 import logging
-from typing import Iterable, List
+from typing import Any, AsyncIterator, Dict, Iterable, List
 
+import httpx
 import requests
 
 from .base import ChatModel, GenerationParams, Message
@@ -21,6 +22,35 @@ from .base import ChatModel, GenerationParams, Message
 logger = logging.getLogger("ollama")
 
 
+class _ThinkFramer:
+    """Turns Ollama /api/chat stream objects into tokens, wrapping thinking in <think>...</think>."""
+
+    def __init__(self, think: bool) -> None:
+        self.think = think
+        self.open = False
+
+    def feed(self, obj: Dict[str, Any]) -> List[str]:
+        out: List[str] = []
+        msg = obj.get("message") or {}
+        think = msg.get("thinking") or ""
+        content = msg.get("content") or ""
+        if self.think and think:
+            # Emit a continuous <think> stream rather than wrapping each chunk.
+            if not self.open:
+                out.append("<think>")
+                self.open = True
+            out.append(think)
+        if content:
+            if self.open:
+                out.append("</think>")
+                self.open = False
+            out.append(content)
+        if obj.get("done") and self.open:
+            out.append("</think>")
+            self.open = False
+        return out
+
+
 class OllamaChatModel(ChatModel):
     def __init__(self, model: str, think: bool, base_url: str = "http://localhost:11434"):
         self.model = model
@@ -28,8 +58,12 @@ class OllamaChatModel(ChatModel):
         self.base_url = base_url.rstrip("/")
         self._session = requests.Session()
         self._model_ready = False
+        # One pooled async client shared by every streaming turn (created on first use).
+        self._aclient: "httpx.AsyncClient | None" = None
 
     def prepare(self) -> None:
+        # Building the client loads the CA bundle; do it here, off the event loop.
+        self._async_client()
         self._ensure_model_ready()
 
     def _ensure_model_ready(self) -> None:
@@ -58,17 +92,11 @@ class OllamaChatModel(ChatModel):
                 ) from exc
             raise
 
-    def stream_chat(
-            self, messages: List[Message], params: GenerationParams
-    ) -> Iterable[str]:
-        think_open = False
-
-        self._ensure_model_ready()
-        url = f"{self.base_url}/api/chat"
-        payload = {
+    def _chat_payload(self, messages: List[Message], params: GenerationParams, stream: bool) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {
             "model": self.model,
             "messages": messages,
-            "stream": True,
+            "stream": stream,
             "options": {
                 "temperature": params.temperature,
                 "top_p": params.top_p,
@@ -76,13 +104,22 @@ class OllamaChatModel(ChatModel):
             },
         }
         if self.think:
-            payload["keep_alive"] = -1
+            if stream:
+                payload["keep_alive"] = -1
             payload["think"] = True
         try:
-            logger.debug("Ollama stream payload: %s", json.dumps(payload, ensure_ascii=False, indent=2)[:2000])
+            logger.debug("Ollama chat payload: %s", json.dumps(payload, ensure_ascii=False, indent=2)[:2000])
         except Exception:
             logger.exception("Failed to serialize Ollama payload for logging")
-        with self._session.post(url, json=payload, stream=True, timeout=600) as r:
+        return payload
+
+    def stream_chat(
+            self, messages: List[Message], params: GenerationParams
+    ) -> Iterable[str]:
+        self._ensure_model_ready()
+        framer = _ThinkFramer(self.think)
+        payload = self._chat_payload(messages, params, stream=True)
+        with self._session.post(f"{self.base_url}/api/chat", json=payload, stream=True, timeout=600) as r:
             self._raise_for_status(r)
             for line in r.iter_lines(decode_unicode=True):
                 if not line:
@@ -92,55 +129,76 @@ class OllamaChatModel(ChatModel):
                 except Exception:
                     logger.debug("Ollama stream non-json line: %s", line)
                     continue
-                # logger.debug("Ollama stream line obj: %s", obj)
                 # obj examples:
                 # {'model': 'qwen3:4b-thinking', 'created_at': '2025-12-31T17:23:34.679427401Z', 'message': {'role': 'assistant', 'content': '', 'thinking': 'Okay'}, 'done': False}
                 # {'model': 'qwen3:4b-thinking', 'created_at': '2025-12-31T17:23:47.066107705Z', 'message': {'role': 'assistant', 'content': 'Hello'}, 'done': False}
                 # {'model': 'qwen3:4b-thinking', 'created_at': '2025-12-31T17:23:47.571839233Z', 'message': {'role': 'assistant', 'content': ''}, 'done': True, 'done_reason': 'stop', 'total_duration': 13262200995, 'load_duration': 88595972, 'prompt_eval_count': 34, 'prompt_eval_duration': 278191196, 'eval_count': 747, 'eval_duration': 12621372075}
-                msg = obj.get("message") or {}
-                think = msg.get("thinking") or ""
-                content = msg.get("content") or ""
-
-                if self.think and think:
-                    # Emit a continuous <think> stream rather than wrapping each chunk.
-                    if not think_open:
-                        yield "<think>"
-                        think_open = True
-                    yield think
-                if content:
-                    # logger.debug(f"Ollama stream content: {content}")
-                    if think_open:
-                        yield "</think>"
-                        think_open = False
-                    yield content
-
+                yield from framer.feed(obj)
                 if obj.get("done"):
-                    # logger.debug(f"Ollama stream done: {obj}")
-                    if think_open:
-                        yield "</think>"
-                        think_open = False
                     break
 
+    def _async_client(self) -> "httpx.AsyncClient":
+        if self._aclient is None:
+            self._aclient = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(600.0, connect=30.0),
+                limits=httpx.Limits(max_connections=256, max_keepalive_connections=32),
+            )
+        return self._aclient
+
+    async def _aensure_model_ready(self) -> None:
+        if self._model_ready:
+            return
+        try:
+            resp = await self._async_client().post("/api/show", json={"model": self.model}, timeout=30.0)
+        except httpx.HTTPError as exc:
+            raise RuntimeError(f"Failed to verify Ollama model '{self.model}': {exc}") from exc
+        if resp.status_code == 404:
+            raise ValueError(
+                f"Ollama model '{self.model}' not found. Run `ollama pull {self.model}` or update MODEL_NAME."
+            )
+        resp.raise_for_status()
+        self._model_ready = True
+
+    async def astream_chat(
+            self, messages: List[Message], params: GenerationParams
+    ) -> AsyncIterator[str]:
+        """stream_chat on the event loop: no thread per turn, connections pooled across turns."""
+        await self._aensure_model_ready()
+        framer = _ThinkFramer(self.think)
+        payload = self._chat_payload(messages, params, stream=True)
+        try:
+            async with self._async_client().stream("POST", "/api/chat", json=payload) as r:
+                if r.status_code == 404:
+                    raise ValueError(f"Ollama model '{self.model}' not available at {self.base_url}.")
+                if r.status_code >= 400:
+                    await r.aread()
+                    r.raise_for_status()
+                # aiter_lines splits the NDJSON body as bytes arrive.
+                async for line in r.aiter_lines():
+                    if not line:
+                        continue
+                    try:
+                        obj = json.loads(line)
+                    except Exception:
+                        logger.debug("Ollama stream non-json line: %s", line)
+                        continue
+                    for chunk in framer.feed(obj):
+                        yield chunk
+                    if obj.get("done"):
+                        break
+        except httpx.TransportError as exc:
+            raise RuntimeError(f"Ollama stream from {self.base_url} failed: {type(exc).__name__} {exc}".strip()) from exc
+
+    async def aclose(self) -> None:
+        if self._aclient is not None:
+            await self._aclient.aclose()
+            self._aclient = None
+
     def chat(self, messages: List[Message], params: GenerationParams) -> str:
         self._ensure_model_ready()
-        url = f"{self.base_url}/api/chat"
-        payload = {
-            "model": self.model,
-            "messages": messages,
-            "stream": False,
-            "options": {
-                "temperature": params.temperature,
-                "top_p": params.top_p,
-                "num_predict": params.max_new_tokens,
-            },
-        }
-        if self.think:
-            payload["think"] = True
-        try:
-            logger.debug("Ollama chat payload: %s", json.dumps(payload, ensure_ascii=False)[:2000])
-        except Exception:
-            logger.exception("Failed to serialize Ollama payload for logging")
-        r = self._session.post(url, json=payload, timeout=600)
+        payload = self._chat_payload(messages, params, stream=False)
+        r = self._session.post(f"{self.base_url}/api/chat", json=payload, timeout=600)
         self._raise_for_status(r)
         try:
             obj = r.json()
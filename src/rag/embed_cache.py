@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent content-addressed embedding cache.
+src/rag/embed_cache.py
+
+Vectors are keyed by (embedder identity, sha1 of the chunk text), where the identity
+covers backend, model and dim, so the cache survives full index rebuilds and re-chunking
+of edited documents. Stored in its own SQLite file next to rag_meta.db; least recently
+used rows are evicted once the cache exceeds its size budget. The stored byte total is
+kept in cache_meta and updated on every insert/evict, so checking the budget is O(batch).
+
+@author: LIU Ziyi
+@date: 2026-01-01
+@license: Apache-2.0
+"""
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+_SQL_VARS = 500
+_BYTES_KEY = "vec_bytes"
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8", errors="ignore")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, db_path: str, max_mb: int = 512) -> None:
+        self.db_path = str(db_path)
+        self.max_bytes = max(0, int(max_mb)) * 1024 * 1024
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._init()
+
+    def _conn(self) -> sqlite3.Connection:
+        """This thread's connection; `with` on it is one transaction."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=NORMAL;")
+            self._local.conn = conn
+        return conn
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _init(self) -> None:
+        with self._conn() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embeddings
+                (
+                    model     TEXT    NOT NULL,
+                    text_sha1 TEXT    NOT NULL,
+                    dim       INTEGER NOT NULL,
+                    vec       BLOB    NOT NULL,
+                    last_used REAL    NOT NULL,
+                    PRIMARY KEY (model, text_sha1)
+                ) WITHOUT ROWID;
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_lru ON embeddings(last_used);")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);")
+            if conn.execute("SELECT 1 FROM cache_meta WHERE key=?", (_BYTES_KEY,)).fetchone() is None:
+                # Caches from before the running total: count once.
+                self._store_total(conn)
+
+    @staticmethod
+    def _store_total(conn: sqlite3.Connection) -> int:
+        total = int(conn.execute("SELECT COALESCE(SUM(LENGTH(vec)), 0) FROM embeddings").fetchone()[0])
+        conn.execute("INSERT OR REPLACE INTO cache_meta(key, value) VALUES (?, ?)", (_BYTES_KEY, total))
+        return total
+
+    def get_many(self, model: str, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Return cached float32 vectors for the given text keys and refresh their LRU stamp."""
+        out: Dict[str, np.ndarray] = {}
+        uniq = list(dict.fromkeys(keys))
+        if not uniq:
+            return out
+        now = time.time()
+        with self._conn() as conn:
+            for start in range(0, len(uniq), _SQL_VARS):
+                part = uniq[start:start + _SQL_VARS]
+                marks = ",".join(["?"] * len(part))
+                rows = conn.execute(
+                    f"SELECT text_sha1, dim, vec FROM embeddings WHERE model=? AND text_sha1 IN ({marks})",
+                    (model, *part),
+                ).fetchall()
+                for key, dim, blob in rows:
+                    out[key] = np.frombuffer(blob, dtype=np.float32, count=int(dim))
+                if rows:
+                    conn.execute(
+                        f"UPDATE embeddings SET last_used=? WHERE model=? AND text_sha1 IN ({marks})",
+                        (now, model, *part),
+                    )
+        return out
+
+    def put_many(self, model: str, keys: List[str], vecs: np.ndarray) -> None:
+        if not keys:
+            return
+        vecs = np.ascontiguousarray(vecs, dtype=np.float32)
+        rows = {k: v.tobytes() for k, v in zip(keys, vecs)}
+        now = time.time()
+        with self._conn() as conn:
+            # Bytes of rows about to be replaced, so the running total stays exact.
+            replaced = 0
+            uniq = list(rows)
+            for start in range(0, len(uniq), _SQL_VARS):
+                part = uniq[start:start + _SQL_VARS]
+                marks = ",".join(["?"] * len(part))
+                replaced += int(
+                    conn.execute(
+                        f"SELECT COALESCE(SUM(LENGTH(vec)), 0) FROM embeddings WHERE model=? AND text_sha1 IN ({marks})",
+                        (model, *part),
+                    ).fetchone()[0]
+                )
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO embeddings(model, text_sha1, dim, vec, last_used)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                [(model, k, len(blob) // 4, blob, now) for k, blob in rows.items()],
+            )
+            added = sum(len(blob) for blob in rows.values()) - replaced
+            conn.execute("UPDATE cache_meta SET value = value + ? WHERE key=?", (added, _BYTES_KEY))
+            total = int(conn.execute("SELECT value FROM cache_meta WHERE key=?", (_BYTES_KEY,)).fetchone()[0])
+            self._evict(conn, total)
+
+    def _evict(self, conn: sqlite3.Connection, total: int) -> None:
+        if not self.max_bytes or total <= self.max_bytes:
+            return
+        # Drop oldest rows until back under ~90% of the budget, so eviction is not run on every put.
+        excess = total - int(self.max_bytes * 0.9)
+        conn.execute(
+            """
+            DELETE FROM embeddings WHERE (model, text_sha1) IN (
+                SELECT model, text_sha1 FROM (
+                    SELECT model, text_sha1,
+                           SUM(LENGTH(vec)) OVER (ORDER BY last_used, model, text_sha1) - LENGTH(vec) AS freed
+                    FROM embeddings
+                ) WHERE freed < ?
+            )
+            """,
+            (excess,),
+        )
+        # The eviction scan is O(cache) anyway (and rare); recount rather than track what it freed.
+        self._store_total(conn)
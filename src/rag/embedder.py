@@ -10,13 +10,17 @@ src/rag/embedder.py
 """
 from __future__ import annotations
 
-import json
-import urllib.request
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import List
 
 import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+import scipy.sparse as sp
 from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
 
 
 def _l2_normalize(x: np.ndarray) -> np.ndarray:
@@ -28,6 +32,14 @@ def _l2_normalize(x: np.ndarray) -> np.ndarray:
 
 
 class Embedder:
+    # Worth caching on disk (see embed_cache.py); cheap local embedders opt out.
+    cacheable: bool = True
+
+    @property
+    def identity(self) -> str:
+        """Cache namespace: everything that changes the vectors (backend, model, dim)."""
+        raise NotImplementedError
+
     def embed(self, texts: List[str]) -> np.ndarray:
         raise NotImplementedError
 
@@ -35,6 +47,11 @@ class Embedder:
 @dataclass
 class HashingEmbedder(Embedder):
     dim: int = 2048
+    cacheable = False
+
+    @property
+    def identity(self) -> str:
+        return f"hashing:{self.dim}"
 
     def __post_init__(self) -> None:
         self._vec = HashingVectorizer(
@@ -46,70 +63,144 @@ class HashingEmbedder(Embedder):
             token_pattern=r"(?u)\b\w+\b",
         )
 
+    def embed_sparse(self, texts: List[str]) -> sp.csr_matrix:
+        """L2-normalized CSR rows; same values as embed() without densifying."""
+        X = self._vec.transform(texts).astype(np.float32)
+        return normalize(X, norm="l2", copy=False)
+
     def embed(self, texts: List[str]) -> np.ndarray:
         if not texts:
             return np.zeros((0, self.dim), dtype=np.float32)
-        X = self._vec.transform(texts)
-        dense = X.toarray().astype(np.float32, copy=False)
-        return _l2_normalize(dense)
+        return self.embed_sparse(texts).toarray()
 
 
 @dataclass
 class OllamaEmbedder(Embedder):
+    """
+    Batched Ollama embeddings.
+
+    Uses /api/embed with a list `input` (one request per batch), falling back to the
+    legacy per-text /api/embeddings endpoint on old servers. The working endpoint is
+    detected once; requests share a pooled keep-alive session and up to `concurrency`
+    batches are in flight at once.
+    """
+
     base_url: str = "http://localhost:11434"
     model: str = "nomic-embed-text"
     timeout_s: int = 60
+    batch_size: int = 32
+    concurrency: int = 4
 
-    def _post_json(self, path: str, payload: dict) -> dict:
-        req = urllib.request.Request(
-            url=self.base_url.rstrip("/") + path,
-            data=json.dumps(payload).encode("utf-8"),
-            headers={"Content-Type": "application/json"},
-            method="POST",
-        )
-        with urllib.request.urlopen(req, timeout=self.timeout_s) as resp:
-            body = resp.read().decode("utf-8", errors="ignore")
-            return json.loads(body)
+    def __post_init__(self) -> None:
+        self.batch_size = max(1, int(self.batch_size))
+        self.concurrency = max(1, int(self.concurrency))
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._endpoint: str | None = None
+        self._endpoint_lock = threading.Lock()
+
+    @property
+    def identity(self) -> str:
+        # The output dim is fixed by the model.
+        return f"ollama:{self.model}"
+
+    def _post_json(self, path: str, payload: dict) -> requests.Response:
+        return self._session.post(self.base_url.rstrip("/") + path, json=payload, timeout=self.timeout_s)
+
+    def _embed_batch_api(self, texts: List[str]) -> List[List[float]]:
+        return self._read_embed_response(self._post_json("/api/embed", {"model": self.model, "input": texts}), len(texts))
+
+    @staticmethod
+    def _read_embed_response(resp: requests.Response, n: int) -> List[List[float]]:
+        resp.raise_for_status()
+        out = resp.json()
+        vecs = out.get("embeddings") if isinstance(out, dict) else None
+        if not isinstance(vecs, list) or len(vecs) != n:
+            raise RuntimeError(f"unexpected ollama embed response: {list(out.keys()) if isinstance(out, dict) else out!r}")
+        return vecs
+
+    def _embed_batch_legacy(self, texts: List[str]) -> List[List[float]]:
+        vecs: List[List[float]] = []
+        for t in texts:
+            resp = self._post_json("/api/embeddings", {"model": self.model, "prompt": t})
+            resp.raise_for_status()
+            out = resp.json()
+            if not isinstance(out, dict) or not isinstance(out.get("embedding"), list):
+                raise RuntimeError(f"unexpected ollama embeddings response: {out!r}")
+            vecs.append(out["embedding"])
+        return vecs
+
+    def _detect_endpoint(self, probe: List[str]) -> List[List[float]]:
+        """
+        Embed the first batch while finding out which endpoint the server supports.
+
+        Only a server without /api/embed (404/405) is switched to the per-text legacy
+        endpoint. Other failures (a cold model load timing out, a 5xx, a dropped
+        connection) are raised with the endpoint still unknown, so the next call probes again.
+        """
+        try:
+            resp = self._post_json("/api/embed", {"model": self.model, "input": probe})
+            if resp.status_code not in (404, 405):
+                vecs = self._read_embed_response(resp, len(probe))
+                self._endpoint = "/api/embed"
+                return vecs
+            vecs = self._embed_batch_legacy(probe)
+        except requests.RequestException as e:
+            raise RuntimeError(f"ollama embed request failed: {e}") from e
+        self._endpoint = "/api/embeddings"
+        return vecs
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        try:
+            if self._endpoint == "/api/embed":
+                return self._embed_batch_api(texts)
+            return self._embed_batch_legacy(texts)
+        except requests.RequestException as e:
+            raise RuntimeError(f"ollama embed request failed: {e}") from e
 
     def embed(self, texts: List[str]) -> np.ndarray:
         if not texts:
             return np.zeros((0, 0), dtype=np.float32)
 
-        vecs: List[List[float]] = []
-        for t in texts:
-            payload = {"model": self.model, "prompt": t}
-
-            out = None
-            last_error: Exception | None = None
-            for endpoint in ("/api/embeddings", "/api/embed"):
-                try:
-                    out = self._post_json(endpoint, payload)
-                    if isinstance(out, dict) and ("embedding" in out or "embeddings" in out):
-                        break
-                except Exception as e:
-                    last_error = e
-                    out = None
-
-            if out is None:
-                raise RuntimeError(f"ollama embed request failed: {last_error}")
-
-            if "embedding" in out and isinstance(out["embedding"], list):
-                vec = out["embedding"]
-            elif "embeddings" in out and isinstance(out["embeddings"], list) and out["embeddings"]:
-                vec = out["embeddings"][0]
-            else:
-                raise RuntimeError(f"unexpected ollama embed response keys: {list(out.keys())}")
-
-            vecs.append([float(x) for x in vec])
-
-        arr = np.asarray(vecs, dtype=np.float32)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        results: List[List[List[float]] | None] = [None] * len(batches)
+        start = 0
+        with self._endpoint_lock:
+            if self._endpoint is None:
+                results[0] = self._detect_endpoint(batches[0])
+                start = 1
+
+        pending = range(start, len(batches))
+        if self.concurrency == 1 or len(pending) <= 1:
+            for bi in pending:
+                results[bi] = self._embed_batch(batches[bi])
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(pending))) as pool:
+                for bi, vecs in zip(pending, pool.map(self._embed_batch, [batches[bi] for bi in pending])):
+                    results[bi] = vecs
+
+        arr = np.asarray([v for batch in results for v in (batch or [])], dtype=np.float32)
         return _l2_normalize(arr)
 
 
-def create_embedder(backend: str, dim: int, ollama_url: str, ollama_model: str) -> Embedder:
+def create_embedder(
+        backend: str,
+        dim: int,
+        ollama_url: str,
+        ollama_model: str,
+        batch_size: int = 32,
+        concurrency: int = 4,
+) -> Embedder:
     b = (backend or "").lower()
     if b in ("hashing", "hash", "hashing_vectorizer", "bow"):
         return HashingEmbedder(dim=dim)
     if b in ("ollama", "ollama_embed"):
-        return OllamaEmbedder(base_url=ollama_url, model=ollama_model)
+        return OllamaEmbedder(
+            base_url=ollama_url,
+            model=ollama_model,
+            batch_size=batch_size,
+            concurrency=concurrency,
+        )
     raise ValueError(f"unknown embedder backend: {backend}")
@@ -10,10 +10,12 @@ src/rag/fs_scan.py
 """
 from __future__ import annotations
 
+import fnmatch
 import glob
 import os
+import stat
 from pathlib import Path
-from typing import Iterable, List, Sequence, Union, Optional
+from typing import Dict, Iterable, List, Sequence, Tuple, Union, Optional
 
 GlobLike = Union[str, Path]
 GlobPatterns = Union[GlobLike, Sequence[GlobLike]]
@@ -86,3 +88,110 @@ def list_doc_paths(
             continue
 
     return out
+
+
+_Match = Tuple[str, os.stat_result, bool]  # (path, stat, is symlink)
+
+
+def _iter_scandir(dir_path: str, name_pat: str, follow_symlinks: bool) -> Iterable[_Match]:
+    """Match one directory level with os.scandir; d_type saves a syscall per non-matching entry."""
+    hidden_ok = name_pat.startswith(".")
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            if not hidden_ok and entry.name.startswith("."):
+                continue
+            if not fnmatch.fnmatch(entry.name, name_pat):
+                continue
+            try:
+                is_link = entry.is_symlink()
+                if is_link and not follow_symlinks:
+                    continue
+                if not entry.is_file():
+                    continue
+                yield entry.path, entry.stat(), is_link
+            except OSError:
+                continue
+
+
+def _iter_glob_stat(pat: str, follow_symlinks: bool) -> Iterable[_Match]:
+    for m in glob.iglob(pat, recursive=True):
+        try:
+            st = os.lstat(m)
+            is_link = stat.S_ISLNK(st.st_mode)
+            if is_link:
+                if not follow_symlinks:
+                    continue
+                st = os.stat(m)
+        except OSError:
+            continue
+        if stat.S_ISREG(st.st_mode):
+            yield m, st, is_link
+
+
+def scan_doc_files(
+        patterns: Sequence[str],
+        *,
+        exts: Optional[Sequence[str]] = None,
+        follow_symlinks: bool = False,
+        max_file_size_mb: Optional[float] = None,
+) -> List[Tuple[str, os.stat_result]]:
+    """
+    Like list_doc_paths, but returns (resolved path, stat result) pairs and keeps syscalls
+    to about one stat per matching file, so callers never need to stat or resolve again.
+
+    Patterns whose only wildcard is in the last component ("data/raw/*", "docs/*.md") are
+    read with os.scandir; anything else ("**", wildcard directories) goes through glob.
+    """
+    out: List[Tuple[str, os.stat_result]] = []
+    seen: set[str] = set()
+    real_dirs: Dict[str, str] = {}
+
+    exts_norm = None
+    if exts:
+        exts_norm = {
+            e.lower() if e.startswith(".") else f".{e.lower()}"
+            for e in exts
+        }
+    max_bytes = max_file_size_mb * 1024 * 1024 if max_file_size_mb is not None else None
+
+    for pat in patterns:
+        if not pat:
+            continue
+
+        pat = os.path.expanduser(os.path.expandvars(pat))
+        dir_part, name_part = os.path.split(pat)
+        try:
+            if glob.has_magic(name_part) and not glob.has_magic(dir_part) and "**" not in name_part:
+                matches = _iter_scandir(dir_part or ".", name_part, follow_symlinks)
+            else:
+                matches = _iter_glob_stat(pat, follow_symlinks)
+            for path, st, is_link in matches:
+                try:
+                    if exts_norm and os.path.splitext(path)[1].lower() not in exts_norm:
+                        continue
+                    if max_bytes is not None and st.st_size > max_bytes:
+                        continue
+
+                    # Resolve each parent directory once; the file itself is not a symlink
+                    # unless follow_symlinks allowed it, in which case resolve it fully.
+                    parent, name = os.path.split(path)
+                    if is_link:
+                        key = os.path.realpath(path)
+                    else:
+                        real_parent = real_dirs.get(parent)
+                        if real_parent is None:
+                            real_parent = os.path.realpath(parent or ".")
+                            real_dirs[parent] = real_parent
+                        key = os.path.join(real_parent, name)
+                    if key in seen:
+                        continue
+
+                    seen.add(key)
+                    out.append((key, st))
+
+                except (OSError, PermissionError):
+                    continue
+        except (OSError, NotImplementedError):
+            continue
+
+    return out
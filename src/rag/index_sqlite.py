@@ -10,24 +10,98 @@ src/rag/index_sqlite.py
 """
 from __future__ import annotations
 
+import os
+import re
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from src.rag.types import ChunkRecord, DocRecord
 
+_FTS_TERM_RE = re.compile(r"\w+", re.UNICODE)
+_MMAP_SIZE = 256 * 1024 * 1024
+_CACHE_KIB = 64 * 1024
+# `id` aliases the rowid, which makes it stable: VACUUM may renumber implicit rowids, and
+# the FTS index refers to chunks by this number.
+_CHUNKS_DDL = """
+CREATE TABLE {exists}{table}
+(
+    id       INTEGER PRIMARY KEY,
+    chunk_id TEXT    NOT NULL UNIQUE,
+    doc_id   TEXT    NOT NULL,
+    path     TEXT    NOT NULL,
+    idx      INTEGER NOT NULL,
+    start    INTEGER NOT NULL,
+    end      INTEGER NOT NULL,
+    source_label TEXT,
+    text     TEXT    NOT NULL,
+    content_hash TEXT,
+    FOREIGN KEY (doc_id) REFERENCES docs (doc_id)
+);
+"""
+_CHUNK_COLS = "chunk_id, doc_id, path, idx, start, end, source_label, text, content_hash"
+
 
 class RagSqliteStore:
+    """
+    Chunk/doc metadata store.
+
+    Each thread keeps one persistent WAL-mode connection, so retrieval reads never wait for
+    an index build writing. Every method runs in its own transaction unless called inside
+    transaction(), which groups them into a single commit.
+    """
+
     def __init__(self, db_path: str) -> None:
         self.db_path = str(db_path)
         Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
         self._init()
 
-    def _conn(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit at the driver level; transactions are explicit (see transaction()).
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=NORMAL;")
+            conn.execute("PRAGMA temp_store=MEMORY;")
+            conn.execute(f"PRAGMA mmap_size={_MMAP_SIZE};")
+            conn.execute(f"PRAGMA cache_size=-{_CACHE_KIB};")
+            self._local.conn = conn
+            self._local.depth = 0
         return conn
 
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Group store calls into one transaction (re-entrant; commits at the outermost exit)."""
+        conn = self._connection()
+        if self._local.depth == 0:
+            conn.execute("BEGIN")
+        self._local.depth += 1
+        try:
+            yield conn
+        except BaseException:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                conn.execute("ROLLBACK")
+            raise
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            conn.execute("COMMIT")
+
+    def _conn(self):
+        return self.transaction()
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
     def _init(self) -> None:
         with self._conn() as conn:
             conn.execute(
@@ -38,33 +112,78 @@ class RagSqliteStore:
                     path   TEXT NOT NULL,
                     mtime  REAL NOT NULL,
                     sha1   TEXT NOT NULL,
-                    mime   TEXT NOT NULL
-                );
-                """
-            )
-            conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS chunks
-                (
-                    chunk_id TEXT PRIMARY KEY,
-                    doc_id   TEXT    NOT NULL,
-                    path     TEXT    NOT NULL,
-                    idx      INTEGER NOT NULL,
-                    start    INTEGER NOT NULL,
-                    end      INTEGER NOT NULL,
-                    source_label TEXT,
-                    text     TEXT    NOT NULL,
-                    FOREIGN KEY (doc_id) REFERENCES docs (doc_id)
+                    mime   TEXT NOT NULL,
+                    size   INTEGER NOT NULL DEFAULT -1
                 );
                 """
             )
+            conn.execute(_CHUNKS_DDL.format(table="chunks", exists="IF NOT EXISTS "))
             conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_doc ON chunks(doc_id);")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_docs_path ON docs(path);")
             cols = {
                 row["name"]
                 for row in conn.execute("PRAGMA table_info(chunks)").fetchall()
             }
             if "source_label" not in cols:
                 conn.execute("ALTER TABLE chunks ADD COLUMN source_label TEXT;")
+            if "content_hash" not in cols:
+                conn.execute("ALTER TABLE chunks ADD COLUMN content_hash TEXT;")
+            if "id" not in cols:
+                self._migrate_chunks_id(conn)
+            doc_cols = {
+                row["name"]
+                for row in conn.execute("PRAGMA table_info(docs)").fetchall()
+            }
+            if "size" not in doc_cols:
+                # -1: unknown (rows from before sizes were recorded); forces one re-hash.
+                conn.execute("ALTER TABLE docs ADD COLUMN size INTEGER NOT NULL DEFAULT -1;")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS failed_docs
+                (
+                    path      TEXT PRIMARY KEY,
+                    mtime     REAL    NOT NULL,
+                    size      INTEGER NOT NULL,
+                    sha1      TEXT    NOT NULL,
+                    error     TEXT    NOT NULL,
+                    failed_at REAL    NOT NULL
+                );
+                """
+            )
+            self.fts_enabled = self._init_fts(conn)
+
+    @staticmethod
+    def _migrate_chunks_id(conn: sqlite3.Connection) -> None:
+        """Give a pre-`id` chunks table its explicit key, keeping the current rowids."""
+        conn.execute(_CHUNKS_DDL.format(table="chunks_v2", exists=""))
+        conn.execute(f"INSERT INTO chunks_v2(id, {_CHUNK_COLS}) SELECT rowid, {_CHUNK_COLS} FROM chunks")
+        # The old FTS table is declared against the implicit rowid; _init_fts recreates it.
+        conn.execute("DROP TABLE IF EXISTS chunks_fts")
+        conn.execute("DROP TABLE chunks")
+        conn.execute("ALTER TABLE chunks_v2 RENAME TO chunks")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_doc ON chunks(doc_id);")
+
+    def _init_fts(self, conn: sqlite3.Connection) -> bool:
+        """Create the FTS5 (BM25) table over chunk text; False if SQLite lacks FTS5."""
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name='chunks_fts'").fetchone() is not None
+        if exists:
+            return True
+        try:
+            # External content: the text lives once, in `chunks`; chunks.id links the two tables.
+            conn.execute(
+                "CREATE VIRTUAL TABLE chunks_fts USING fts5(text, content='chunks', content_rowid='id');"
+            )
+        except sqlite3.OperationalError:
+            return False
+        conn.execute("INSERT INTO chunks_fts(chunks_fts) VALUES('rebuild');")
+        return True
+
+    def _fts_delete(self, conn: sqlite3.Connection, where: str, params: tuple) -> None:
+        if self.fts_enabled:
+            conn.execute(
+                f"INSERT INTO chunks_fts(chunks_fts, rowid, text) SELECT 'delete', id, text FROM chunks WHERE {where}",
+                params,
+            )
 
     def list_docs(self) -> List[DocRecord]:
         with self._conn() as conn:
@@ -76,10 +195,42 @@ class RagSqliteStore:
                 mtime=float(row["mtime"]),
                 sha1=row["sha1"],
                 mime=row["mime"],
+                size=int(row["size"]),
             )
             for row in rows
         ]
 
+    def load_manifest(self) -> Dict[str, DocRecord]:
+        """path -> doc record for every indexed doc, read once per build for change detection."""
+        return {doc.path: doc for doc in self.list_docs()}
+
+    def load_failed(self) -> Dict[str, Tuple[float, int]]:
+        """path -> (mtime, size) of files that failed to parse when last seen."""
+        with self._conn() as conn:
+            rows = conn.execute("SELECT path, mtime, size FROM failed_docs").fetchall()
+        return {row["path"]: (float(row["mtime"]), int(row["size"])) for row in rows}
+
+    def get_failure(self, path: str) -> Optional[Tuple[float, int]]:
+        with self._conn() as conn:
+            row = conn.execute("SELECT mtime, size FROM failed_docs WHERE path=?", (path,)).fetchone()
+        return (float(row["mtime"]), int(row["size"])) if row else None
+
+    def record_failure(self, path: str, mtime: float, size: int, sha1: str, error: str) -> None:
+        with self._conn() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO failed_docs(path, mtime, size, sha1, error, failed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (path, mtime, size, sha1, error[:2000], time.time()),
+            )
+
+    def delete_failures(self, paths: List[str]) -> None:
+        if not paths:
+            return
+        with self._conn() as conn:
+            conn.executemany("DELETE FROM failed_docs WHERE path=?", [(p,) for p in paths])
+
     def get_doc_by_path(self, path: str) -> Optional[DocRecord]:
         with self._conn() as conn:
             row = conn.execute("SELECT * FROM docs WHERE path=?", (path,)).fetchone()
@@ -91,8 +242,17 @@ class RagSqliteStore:
             mtime=float(row["mtime"]),
             sha1=row["sha1"],
             mime=row["mime"],
+            size=int(row["size"]),
         )
 
+    def list_doc_paths_under(self, directory: str) -> List[str]:
+        """Paths of indexed docs below a directory (a range scan on idx_docs_path)."""
+        lo = directory.rstrip(os.sep) + os.sep
+        hi = lo[:-1] + chr(ord(os.sep) + 1)
+        with self._conn() as conn:
+            rows = conn.execute("SELECT path FROM docs WHERE path >= ? AND path < ?", (lo, hi)).fetchall()
+        return [row["path"] for row in rows]
+
     def get_doc_by_id(self, doc_id: str) -> Optional[DocRecord]:
         with self._conn() as conn:
             row = conn.execute("SELECT * FROM docs WHERE doc_id=?", (doc_id,)).fetchone()
@@ -104,24 +264,27 @@ class RagSqliteStore:
             mtime=float(row["mtime"]),
             sha1=row["sha1"],
             mime=row["mime"],
+            size=int(row["size"]),
         )
 
     def upsert_doc(self, doc: DocRecord) -> None:
         with self._conn() as conn:
             conn.execute(
                 """
-                INSERT INTO docs(doc_id, path, mtime, sha1, mime)
-                VALUES (?, ?, ?, ?, ?)
+                INSERT INTO docs(doc_id, path, mtime, sha1, mime, size)
+                VALUES (?, ?, ?, ?, ?, ?)
                 ON CONFLICT(doc_id) DO UPDATE SET path=excluded.path,
                                                   mtime=excluded.mtime,
                                                   sha1=excluded.sha1,
-                                                  mime=excluded.mime
+                                                  mime=excluded.mime,
+                                                  size=excluded.size
                 """,
-                (doc.doc_id, doc.path, doc.mtime, doc.sha1, doc.mime),
+                (doc.doc_id, doc.path, doc.mtime, doc.sha1, doc.mime, doc.size),
             )
 
     def delete_chunks_for_doc(self, doc_id: str) -> None:
         with self._conn() as conn:
+            self._fts_delete(conn, "doc_id=?", (doc_id,))
             conn.execute("DELETE FROM chunks WHERE doc_id=?", (doc_id,))
 
     def list_chunk_ids_for_doc(self, doc_id: str) -> List[str]:
@@ -132,8 +295,43 @@ class RagSqliteStore:
             ).fetchall()
         return [str(row["chunk_id"]) for row in rows]
 
+    def list_chunk_hashes_for_doc(self, doc_id: str) -> List[Tuple[str, Optional[str], Optional[str]]]:
+        """(chunk_id, content_hash, text) per chunk; text is only loaded for rows without a hash."""
+        with self._conn() as conn:
+            rows = conn.execute(
+                """
+                SELECT chunk_id, content_hash, CASE WHEN content_hash IS NULL THEN text END AS text
+                FROM chunks WHERE doc_id=? ORDER BY idx ASC
+                """,
+                (doc_id,),
+            ).fetchall()
+        return [(str(row["chunk_id"]), row["content_hash"], row["text"]) for row in rows]
+
+    def delete_chunks(self, chunk_ids: List[str]) -> None:
+        if not chunk_ids:
+            return
+        with self._conn() as conn:
+            params = [(cid,) for cid in chunk_ids]
+            if self.fts_enabled:
+                conn.executemany(
+                    "INSERT INTO chunks_fts(chunks_fts, rowid, text) SELECT 'delete', id, text FROM chunks WHERE chunk_id=?",
+                    params,
+                )
+            conn.executemany("DELETE FROM chunks WHERE chunk_id=?", params)
+
+    def update_chunk_positions(self, chunks: List[ChunkRecord]) -> None:
+        """Move kept chunks to their new place in the doc; text (and so id / FTS entry) is unchanged."""
+        if not chunks:
+            return
+        with self._conn() as conn:
+            conn.executemany(
+                "UPDATE chunks SET path=?, idx=?, start=?, end=?, source_label=?, content_hash=? WHERE chunk_id=?",
+                [(c.path, c.idx, c.start, c.end, c.source_label, c.content_hash or None, c.chunk_id) for c in chunks],
+            )
+
     def delete_doc(self, doc_id: str) -> None:
         with self._conn() as conn:
+            self._fts_delete(conn, "doc_id=?", (doc_id,))
             conn.execute("DELETE FROM chunks WHERE doc_id=?", (doc_id,))
             conn.execute("DELETE FROM docs WHERE doc_id=?", (doc_id,))
 
@@ -141,13 +339,53 @@ class RagSqliteStore:
         if not chunks:
             return
         with self._conn() as conn:
+            if self.fts_enabled:
+                # Replaced rows get a new id; drop their old FTS entries first.
+                conn.executemany(
+                    """
+                    INSERT INTO chunks_fts(chunks_fts, rowid, text)
+                    SELECT 'delete', id, text FROM chunks WHERE chunk_id=?
+                    """,
+                    [(c.chunk_id,) for c in chunks],
+                )
             conn.executemany(
                 """
-                INSERT OR REPLACE INTO chunks(chunk_id, doc_id, path, idx, start, end, source_label, text)
-                VALUES(?,?,?,?,?,?,?,?)
+                INSERT OR REPLACE INTO chunks(chunk_id, doc_id, path, idx, start, end, source_label, text, content_hash)
+                VALUES(?,?,?,?,?,?,?,?,?)
                 """,
-                [(c.chunk_id, c.doc_id, c.path, c.idx, c.start, c.end, c.source_label, c.text) for c in chunks],
+                [
+                    (c.chunk_id, c.doc_id, c.path, c.idx, c.start, c.end, c.source_label, c.text, c.content_hash or None)
+                    for c in chunks
+                ],
             )
+            if self.fts_enabled:
+                conn.executemany(
+                    "INSERT INTO chunks_fts(rowid, text) SELECT id, text FROM chunks WHERE chunk_id=?",
+                    [(c.chunk_id,) for c in chunks],
+                )
+
+    def search_fts(self, query: str, k: int) -> List[str]:
+        """BM25-ranked chunk ids whose text matches any query term (best first)."""
+        if not self.fts_enabled:
+            return []
+        terms = list(dict.fromkeys(m.group(0).lower() for m in _FTS_TERM_RE.finditer(query)))
+        if not terms:
+            return []
+        # Quote every term so user input is never parsed as FTS5 query syntax.
+        match = " OR ".join('"%s"' % t.replace('"', '""') for t in terms)
+        with self._conn() as conn:
+            rows = conn.execute(
+                """
+                SELECT c.chunk_id
+                FROM chunks_fts
+                JOIN chunks c ON c.id = chunks_fts.rowid
+                WHERE chunks_fts MATCH ?
+                ORDER BY bm25(chunks_fts)
+                LIMIT ?
+                """,
+                (match, int(k)),
+            ).fetchall()
+        return [str(r["chunk_id"]) for r in rows]
 
     def get_all_chunks(self) -> List[ChunkRecord]:
         with self._conn() as conn:
@@ -164,10 +402,42 @@ class RagSqliteStore:
                     end=int(r["end"]),
                     text=r["text"],
                     source_label=r["source_label"],
+                    content_hash=r["content_hash"] or "",
                 )
             )
         return out
 
+    def count_chunks(self) -> int:
+        with self._conn() as conn:
+            return int(conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0])
+
+    def iter_chunks(self, batch_size: int = 2048) -> Iterator[List[ChunkRecord]]:
+        """Yield all chunks ordered by chunk_id, one page of at most batch_size at a time."""
+        last = ""
+        while True:
+            with self._conn() as conn:
+                rows = conn.execute(
+                    "SELECT * FROM chunks WHERE chunk_id > ? ORDER BY chunk_id LIMIT ?",
+                    (last, int(batch_size)),
+                ).fetchall()
+            if not rows:
+                return
+            last = rows[-1]["chunk_id"]
+            yield [
+                ChunkRecord(
+                    chunk_id=r["chunk_id"],
+                    doc_id=r["doc_id"],
+                    path=r["path"],
+                    idx=int(r["idx"]),
+                    start=int(r["start"]),
+                    end=int(r["end"]),
+                    text=r["text"],
+                    source_label=r["source_label"],
+                    content_hash=r["content_hash"] or "",
+                )
+                for r in rows
+            ]
+
     def get_chunk_text_by_ids(self, chunk_ids: List[str]) -> List[ChunkRecord]:
         if not chunk_ids:
             return []
@@ -190,6 +460,7 @@ class RagSqliteStore:
                     end=int(r["end"]),
                     text=r["text"],
                     source_label=r["source_label"],
+                    content_hash=r["content_hash"] or "",
                 )
             )
         return out
@@ -212,6 +483,7 @@ class RagSqliteStore:
                     end=int(r["end"]),
                     text=r["text"],
                     source_label=r["source_label"],
+                    content_hash=r["content_hash"] or "",
                 )
             )
         return out
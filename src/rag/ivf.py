@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pure-numpy IVF (+ optional PQ) approximate search for the numpy vector backend.
+src/rag/ivf.py
+
+Coarse quantizer: spherical k-means over the index vectors (inner-product metric).
+Inverted lists hold matrix row numbers; PQ codes (if enabled) encode the residual
+to the list centroid and are only used to shortlist candidates, which are then
+re-scored exactly against the stored matrix.
+
+@author: LIU Ziyi
+@date: 2026-01-01
+@license: Apache-2.0
+"""
+from __future__ import annotations
+
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+MIN_POINTS_PER_LIST = 39
+PQ_KSUB = 256
+_ASSIGN_BLOCK = 8192
+_TRAIN_BYTES = 128 * 1024 * 1024
+
+
+def _l2_normalize_rows(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+def _argmax_ip(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    out = np.empty(x.shape[0], dtype=np.int32)
+    for start in range(0, x.shape[0], _ASSIGN_BLOCK):
+        part = np.asarray(x[start:start + _ASSIGN_BLOCK], dtype=np.float32)
+        out[start:start + part.shape[0]] = np.argmax(part @ centroids.T, axis=1)
+    return out
+
+
+def _grow(buf: np.ndarray, used: int, needed: int) -> np.ndarray:
+    """buf if it holds `needed` rows, else a copy of its first `used` rows with doubled capacity."""
+    if needed <= buf.shape[0]:
+        return buf
+    grown = np.empty((max(needed, 2 * buf.shape[0], 16),) + buf.shape[1:], dtype=buf.dtype)
+    grown[:used] = buf[:used]
+    return grown
+
+
+def _argmin_l2(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    c_norms = (centroids * centroids).sum(axis=1)
+    out = np.empty(x.shape[0], dtype=np.int32)
+    for start in range(0, x.shape[0], _ASSIGN_BLOCK):
+        part = x[start:start + _ASSIGN_BLOCK]
+        out[start:start + part.shape[0]] = np.argmin(c_norms[None, :] - 2.0 * (part @ centroids.T), axis=1)
+    return out
+
+
+def kmeans(
+        x: np.ndarray,
+        k: int,
+        *,
+        spherical: bool,
+        iters: int = 20,
+        seed: int = 0,
+) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    x = np.asarray(x, dtype=np.float32)
+    k = min(k, x.shape[0])
+    centroids = x[rng.choice(x.shape[0], size=k, replace=False)].copy()
+    for _ in range(iters):
+        assign = _argmax_ip(x, centroids) if spherical else _argmin_l2(x, centroids)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=k).astype(np.float32)
+        empty = counts == 0
+        starts = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)[:-1]])[~empty]
+        sums = np.zeros_like(centroids)
+        sums[~empty] = np.add.reduceat(x[order], starts, axis=0)
+        if empty.any():
+            # Re-seed empty clusters from random points instead of leaving them dead.
+            sums[empty] = x[rng.choice(x.shape[0], size=int(empty.sum()), replace=False)]
+            counts[empty] = 1.0
+        centroids = sums / counts[:, None]
+        if spherical:
+            centroids = _l2_normalize_rows(centroids)
+    return centroids.astype(np.float32, copy=False)
+
+
+class IvfIndex:
+    """
+    Inverted-file index over row numbers of an external matrix.
+
+    The owner (VectorIndex) keeps the vectors; this class only keeps centroids,
+    per-row list assignments, optional PQ codes, and the derived inverted lists.
+    Assignments, codes and every list have spare capacity, so add() costs O(new rows).
+    """
+
+    def __init__(self, dim: int, nlist: int, pq_m: int = 0) -> None:
+        if pq_m and dim % pq_m != 0:
+            raise ValueError(f"PQ_M must divide dim: {dim} % {pq_m} != 0")
+        self.dim = int(dim)
+        self.nlist = int(nlist)
+        self.pq_m = int(pq_m)
+        self.centroids: np.ndarray | None = None
+        self.codebooks: np.ndarray | None = None  # (m, ksub, dsub)
+        self.n_rows = 0
+        self._assign = np.empty(0, dtype=np.int32)  # capacity >= n_rows
+        self._codes = np.empty((0, self.pq_m), dtype=np.uint8)
+        self._lists: List[np.ndarray] = []  # row numbers per list; capacity >= _list_len
+        self._list_len = np.zeros(0, dtype=np.int64)
+
+    @property
+    def assign(self) -> np.ndarray:
+        return self._assign[:self.n_rows]
+
+    @property
+    def codes(self) -> np.ndarray:
+        return self._codes[:self.n_rows]
+
+    @staticmethod
+    def auto_nlist(n_rows: int) -> int:
+        return int(max(1, min(65536, 4 * int(np.sqrt(max(1, n_rows))))))
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def train_size(self, n_rows: int) -> int:
+        budget_rows = max(PQ_KSUB, _TRAIN_BYTES // (self.dim * 4))
+        return int(min(n_rows, max(PQ_KSUB, self.nlist * 64), budget_rows))
+
+    def train(self, sample: np.ndarray, seed: int = 0) -> None:
+        """Train on a row sample (see train_size); lists start empty, fill them with add()."""
+        sample = np.asarray(sample, dtype=np.float32)
+        nlist = min(self.nlist, max(1, sample.shape[0] // MIN_POINTS_PER_LIST))
+
+        self.nlist = nlist
+        self.centroids = kmeans(sample, nlist, spherical=True, seed=seed)
+        self.codebooks = None
+        if self.pq_m:
+            assign = _argmax_ip(sample, self.centroids)
+            residual = sample - self.centroids[assign]
+            dsub = self.dim // self.pq_m
+            ksub = min(PQ_KSUB, sample.shape[0])
+            books = np.zeros((self.pq_m, ksub, dsub), dtype=np.float32)
+            for j in range(self.pq_m):
+                books[j] = kmeans(residual[:, j * dsub:(j + 1) * dsub], ksub, spherical=False, iters=12, seed=seed + j)
+            self.codebooks = books
+        self.n_rows = 0
+        self._assign = np.empty(0, dtype=np.int32)
+        self._codes = np.empty((0, self.pq_m), dtype=np.uint8)
+        self._lists = [np.empty(0, dtype=np.int64) for _ in range(self.nlist)]
+        self._list_len = np.zeros(self.nlist, dtype=np.int64)
+
+    def _encode(self, x: np.ndarray, assign: np.ndarray) -> np.ndarray:
+        assert self.centroids is not None and self.codebooks is not None
+        residual = x - self.centroids[assign]
+        dsub = self.dim // self.pq_m
+        codes = np.empty((x.shape[0], self.pq_m), dtype=np.uint8)
+        for j in range(self.pq_m):
+            codes[:, j] = _argmin_l2(residual[:, j * dsub:(j + 1) * dsub], self.codebooks[j])
+        return codes
+
+    def add(self, x: np.ndarray, first_row: int) -> None:
+        """Append vectors that occupy rows [first_row, first_row + len(x)) of the owner matrix."""
+        if not self.trained or x.shape[0] == 0:
+            return
+        if first_row != self.n_rows:
+            raise ValueError(f"ivf rows out of sync: {first_row} != {self.n_rows}")
+        assert self.centroids is not None
+        end = first_row + x.shape[0]
+        # Filled before n_rows moves, so a concurrent reader never sees unwritten rows.
+        self._assign = _grow(self._assign, first_row, end)
+        self._codes = _grow(self._codes, first_row, end)
+        new_assign = self._assign[first_row:end]
+        for start in range(0, x.shape[0], _ASSIGN_BLOCK):
+            part = np.asarray(x[start:start + _ASSIGN_BLOCK], dtype=np.float32)
+            a = _argmax_ip(part, self.centroids)
+            new_assign[start:start + part.shape[0]] = a
+            if self.pq_m:
+                self._codes[first_row + start:first_row + start + part.shape[0]] = self._encode(part, a)
+        self.n_rows = end
+
+        rows = np.arange(first_row, end, dtype=np.int64)
+        order = np.argsort(new_assign, kind="stable")
+        touched, starts = np.unique(new_assign[order], return_index=True)
+        bounds = list(starts[1:]) + [order.shape[0]]
+        for lid, s, e in zip(touched.tolist(), starts.tolist(), bounds):
+            used = int(self._list_len[lid])
+            buf = _grow(self._lists[lid], used, used + e - s)
+            buf[used:used + e - s] = rows[order[s:e]]
+            self._lists[lid] = buf
+            self._list_len[lid] = used + e - s
+
+    def kept(self, keep: np.ndarray) -> "IvfIndex":
+        """
+        A new index for the owner matrix after a compaction (kept rows renumbered densely).
+        This one is left untouched for searches still running on the old rows.
+        """
+        out = IvfIndex(dim=self.dim, nlist=self.nlist, pq_m=self.pq_m)
+        out.centroids = self.centroids
+        out.codebooks = self.codebooks
+        out._set_rows(self.assign[keep], self.codes[keep])
+        return out
+
+    def _set_rows(self, assign: np.ndarray, codes: np.ndarray) -> None:
+        self._assign = assign
+        self._codes = codes
+        self.n_rows = int(assign.shape[0])
+        order = np.argsort(assign, kind="stable").astype(np.int64)
+        counts = np.bincount(assign, minlength=self.nlist)
+        self._lists = np.split(order, np.cumsum(counts)[:-1])
+        self._list_len = counts.astype(np.int64)
+
+    def candidates(
+            self,
+            q: np.ndarray,
+            nprobe: int,
+            shortlist: int,
+            deleted: np.ndarray | None = None,
+    ) -> np.ndarray:
+        """
+        Return candidate row numbers for one query vector, skipping rows flagged in `deleted`.
+        Rows at or past len(deleted) are skipped too (added after the caller's view of the rows).
+        """
+        assert self.centroids is not None
+        coarse = self.centroids @ q
+        nprobe = min(max(1, nprobe), self.nlist)
+        probe = np.argpartition(-coarse, nprobe - 1)[:nprobe]
+        lists = [self._lists[int(lid)][:self._list_len[lid]] for lid in probe]
+        rows = np.concatenate(lists) if lists else np.empty(0, dtype=np.int64)
+        if deleted is not None and rows.shape[0]:
+            rows = rows[rows < deleted.shape[0]]
+            rows = rows[~deleted[rows]]
+        if not self.pq_m or rows.shape[0] <= shortlist:
+            return rows
+
+        assert self.codebooks is not None
+        dsub = self.dim // self.pq_m
+        lut = np.einsum("mkd,md->mk", self.codebooks, q.reshape(self.pq_m, dsub))
+        codes = self.codes[rows]
+        approx = coarse[self.assign[rows]] + lut[np.arange(self.pq_m)[None, :], codes].sum(axis=1)
+        top = np.argpartition(-approx, shortlist - 1)[:shortlist]
+        return rows[top]
+
+    def state(self) -> Dict[str, np.ndarray]:
+        assert self.centroids is not None
+        out = {
+            "centroids": self.centroids,
+            "assign": self.assign,
+            "codes": self.codes,
+            "pq_m": np.asarray(self.pq_m, dtype=np.int64),
+        }
+        if self.codebooks is not None:
+            out["codebooks"] = self.codebooks
+        return out
+
+    @classmethod
+    def from_state(cls, dim: int, state) -> "IvfIndex":
+        centroids = np.asarray(state["centroids"], dtype=np.float32)
+        pq_m = int(state["pq_m"])
+        ivf = cls(dim=dim, nlist=centroids.shape[0], pq_m=pq_m)
+        ivf.centroids = centroids
+        ivf.codebooks = np.asarray(state["codebooks"], dtype=np.float32) if "codebooks" in state else None
+        assign = np.asarray(state["assign"], dtype=np.int32)
+        ivf._set_rows(assign, np.asarray(state["codes"], dtype=np.uint8).reshape(assign.shape[0], pq_m))
+        return ivf
+
+    def save(self, path: Path) -> None:
+        _write_npz(path, self.state())
+
+    def save_rows(self, path: Path, first_row: int) -> None:
+        """Write only the assignments/codes of rows [first_row, n_rows) (see VectorIndex._save_ivf)."""
+        _write_npz(path, {"assign": self.assign[first_row:], "codes": self.codes[first_row:]})
+
+    @classmethod
+    def load(cls, path: Path, dim: int, row_files: Iterable[Path] = ()) -> "IvfIndex":
+        """Load a save() file, then append the rows of save_rows() files, in order."""
+        with np.load(path, allow_pickle=False) as data:
+            state = {k: data[k] for k in data.files}
+        assign, codes = [state["assign"]], [state["codes"]]
+        for row_file in row_files:
+            with np.load(row_file, allow_pickle=False) as data:
+                assign.append(data["assign"])
+                codes.append(data["codes"])
+        if len(assign) > 1:
+            state["assign"] = np.concatenate(assign)
+            state["codes"] = np.concatenate(codes)
+        return cls.from_state(dim, state)
+
+
+def _write_npz(path: Path, arrays: Dict[str, np.ndarray]) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as f:
+        np.savez(f, **arrays)
+    tmp.replace(path)
+
+
+def recall_latency_report(
+        mat: np.ndarray,
+        queries: np.ndarray,
+        *,
+        k: int = 10,
+        nlist: int = 0,
+        nprobes: Tuple[int, ...] = (1, 4, 16, 64),
+        pq_m: int = 0,
+        rerank_factor: int = 10,
+) -> Dict[str, object]:
+    """
+    Compare IVF(/PQ) search against exact flat search on the same vectors.
+
+    Returns flat latency, train time and, per nprobe, recall@k and latency percentiles.
+    """
+    from src.rag.vector_index import VectorIndex
+
+    def _timed(index: VectorIndex) -> Tuple[List[List[str]], List[float]]:
+        out: List[List[str]] = []
+        lat: List[float] = []
+        for qi in range(queries.shape[0]):
+            t = time.perf_counter()
+            _, ids = index.search(queries[qi:qi + 1], k)
+            lat.append((time.perf_counter() - t) * 1000.0)
+            out.append(ids[0])
+        return out, lat
+
+    def _pct(lat: List[float]) -> Dict[str, float]:
+        arr = np.asarray(lat, dtype=np.float64)
+        return {"mean_ms": round(float(arr.mean()), 3), "p95_ms": round(float(np.percentile(arr, 95)), 3)}
+
+    ids = [str(i) for i in range(mat.shape[0])]
+    flat = VectorIndex(index_path="bench.index", dim=mat.shape[1], index_type="flat")
+    flat.build(mat, ids)
+    truth, flat_lat = _timed(flat)
+
+    index_type = "ivfpq" if pq_m else "ivf"
+    t_train = time.perf_counter()
+    approx = VectorIndex(
+        index_path="bench.index",
+        dim=mat.shape[1],
+        index_type=index_type,
+        nlist=nlist,
+        pq_m=pq_m,
+        ivf_min_rows=0,
+        rerank_factor=rerank_factor,
+    )
+    approx.build(mat, ids)
+    train_ms = (time.perf_counter() - t_train) * 1000.0
+
+    rows: List[Dict[str, object]] = []
+    for nprobe in nprobes:
+        approx.nprobe = int(nprobe)
+        got, lat = _timed(approx)
+        hits = sum(len(set(g) & set(t)) for g, t in zip(got, truth))
+        recall = hits / max(1, sum(len(t) for t in truth))
+        rows.append({"nprobe": int(nprobe), f"recall@{k}": round(recall, 4), **_pct(lat)})
+
+    return {
+        "rows": int(mat.shape[0]),
+        "dim": int(mat.shape[1]),
+        "queries": int(queries.shape[0]),
+        "index_type": index_type,
+        "nlist": approx.ivf_nlist,
+        "pq_m": int(pq_m),
+        "train_ms": round(train_ms, 1),
+        "flat": _pct(flat_lat),
+        "approx": rows,
+    }
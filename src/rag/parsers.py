@@ -10,16 +10,24 @@ src/rag/fs_scan.py
 """
 from __future__ import annotations
 
+from collections import deque
 import csv
+from dataclasses import dataclass
+import gzip
 import hashlib
 import html
 from html.parser import HTMLParser
+import json
 import mimetypes
+import multiprocessing
+from multiprocessing.connection import Connection, wait as connection_wait
+import os
 from pathlib import Path
 import shutil
 import subprocess
 import tempfile
-from typing import List, Tuple
+import time
+from typing import IO, Callable, Iterable, Iterator, List, Optional, Tuple
 from xml.etree import ElementTree
 from zipfile import BadZipFile, ZipFile
 
@@ -39,12 +47,138 @@ class _HTMLTextExtractor(HTMLParser):
         return "\n".join(self._parts)
 
 
+# Bump whenever a reader's output changes, so cached sections of the old readers are not reused.
+PARSER_VERSION = 1
+
+# Formats whose extraction costs far more than reading the cached result back.
+_CACHED_EXTS = {".pdf", ".docx", ".xlsx", ".xlsm", ".doc", ".xls"}
+
+
 class ParsedSection:
     def __init__(self, text: str, source_label: str | None = None) -> None:
+        try:
+            text.encode("utf-8")
+        except UnicodeEncodeError:
+            # Lone surrogates (e.g. from broken PDF font maps) cannot be stored in SQLite;
+            # each becomes U+FFFD, so offsets are unchanged.
+            text = text.encode("utf-16-le", "surrogatepass").decode("utf-16-le", "replace")
         self.text = text
         self.source_label = source_label
 
 
+class SectionCache:
+    """
+    Parsed sections on disk, one gzip'd JSON-lines file per (file sha1, extension, PARSER_VERSION).
+
+    Lets re-chunking and index rebuilds skip text extraction. Files are touched on every hit;
+    once the directory exceeds max_mb the least recently used files are deleted. Safe to
+    share between processes: writes are atomic and a vanished file is just a miss.
+    """
+
+    def __init__(self, cache_dir: str, max_mb: int = 1024) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max(0, int(max_mb)) * 1024 * 1024
+        self._total: Optional[int] = None  # bytes on disk, scanned on first put
+
+    def _path(self, sha1: str, ext: str) -> Path:
+        return self.cache_dir / sha1[:2] / f"{sha1}{ext.lower()}.v{PARSER_VERSION}.jsonl.gz"
+
+    def get(self, sha1: str, ext: str) -> Optional[List[ParsedSection]]:
+        path = self._path(sha1, ext)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                sections = [ParsedSection(text=row["t"], source_label=row.get("l")) for row in map(json.loads, f)]
+            os.utime(path)
+        except (OSError, EOFError, ValueError, KeyError):
+            return None
+        return sections
+
+    def put(self, sha1: str, ext: str, sections: List[ParsedSection]) -> None:
+        for _ in self.write_through(sha1, ext, sections):
+            pass
+
+    def write_through(
+            self,
+            sha1: str,
+            ext: str,
+            sections: Iterable[ParsedSection],
+            complete: Callable[[], bool] = lambda: True,
+    ) -> Iterator[ParsedSection]:
+        """Pass sections through while writing them to the cache; the entry is committed only
+        once the stream is exhausted (and complete() agrees), so a failed, abandoned or
+        partial parse leaves nothing behind."""
+        path = self._path(sha1, ext)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        f = None
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            f = gzip.open(tmp, "wt", encoding="utf-8", compresslevel=6)
+        except OSError:
+            f = None
+        try:
+            for section in sections:
+                if f is not None:
+                    try:
+                        f.write(json.dumps({"t": section.text, "l": section.source_label}, ensure_ascii=False) + "\n")
+                    except OSError:
+                        f.close()
+                        f = None
+                        tmp.unlink(missing_ok=True)
+                yield section
+        except BaseException:
+            if f is not None:
+                f.close()
+                tmp.unlink(missing_ok=True)
+            raise
+        if f is None:
+            return
+        if not complete():
+            f.close()
+            tmp.unlink(missing_ok=True)
+            return
+        try:
+            f.close()
+            os.replace(tmp, path)
+            size = path.stat().st_size
+        except OSError:
+            tmp.unlink(missing_ok=True)
+            return
+        if self.max_bytes:
+            if self._total is None:
+                self._total = sum(size for _, size, _ in self._entries())
+            else:
+                self._total += size
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _entries(self) -> List[Tuple[Path, int, float]]:
+        out: List[Tuple[Path, int, float]] = []
+        if not self.cache_dir.exists():
+            return out
+        for sub in os.scandir(self.cache_dir):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                out.append((Path(entry.path), st.st_size, st.st_mtime))
+        return out
+
+    def _evict(self) -> None:
+        # Drop least recently used files until back under ~90% of the budget.
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+        self._total = total
+
+
 def guess_mime(path: Path) -> str:
     mime, _ = mimetypes.guess_type(str(path))
     return mime or "application/octet-stream"
@@ -96,6 +230,194 @@ def read_pdf_sections(path: Path) -> List[ParsedSection]:
     return sections
 
 
+@dataclass(frozen=True)
+class PdfOptions:
+    workers: int = 1  # extraction processes per document
+    page_timeout_s: float = 30.0  # a page taking longer is skipped; 0 disables
+    doc_timeout_s: float = 300.0  # pages not extracted by then are skipped; 0 disables
+
+
+_PDF_PAGES_PER_TASK = 8
+_PDF_INPROCESS_MAX_PAGES = 2 * _PDF_PAGES_PER_TASK  # shorter PDFs are not worth starting workers for
+
+
+def mp_context():
+    """
+    Multiprocessing context for parser workers.
+
+    Never fork: indexing runs on threads of the API server, and a forked child inherits
+    whatever locks those threads held at that moment.
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    ctx = multiprocessing.get_context("forkserver")
+    # Workers fork from a server that has already imported this module (and pypdf).
+    ctx.set_forkserver_preload([__name__])
+    return ctx
+
+
+def _pdf_page_worker(path: str, conn: Connection) -> None:
+    """Child process: extract the page ranges sent over conn, replying (page index, text) per page."""
+    try:
+        reader = PdfReader(path)
+        while True:
+            task = conn.recv()
+            if task is None:
+                return
+            for i in range(*task):
+                try:
+                    t = reader.pages[i].extract_text() or ""
+                except Exception:
+                    t = ""
+                conn.send((i, t))
+    except (EOFError, KeyboardInterrupt):
+        return
+
+
+class _PdfWorker:
+    def __init__(self, ctx, path: str) -> None:
+        self.conn, child = ctx.Pipe()
+        self.proc = ctx.Process(target=_pdf_page_worker, args=(path, child), daemon=True)
+        self.proc.start()
+        child.close()
+        self.next_page = 0
+        self.end = 0
+        self.deadline = 0.0
+
+    @property
+    def busy(self) -> bool:
+        return self.next_page < self.end
+
+    def assign(self, start: int, end: int, page_timeout_s: float) -> None:
+        self.next_page, self.end = start, end
+        self.deadline = time.monotonic() + page_timeout_s if page_timeout_s > 0 else float("inf")
+        self.conn.send((start, end))
+
+    def kill(self) -> None:
+        self.proc.kill()
+        self.proc.join()
+        self.conn.close()
+
+    def close(self) -> None:
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.proc.join(timeout=1.0)
+        if self.proc.is_alive():
+            self.proc.kill()
+            self.proc.join()
+        self.conn.close()
+
+
+def _iter_pdf_pages(reader: PdfReader, doc_timeout_s: float, skipped: List[int]) -> Iterator[ParsedSection]:
+    """In-process extraction; the doc deadline is checked between pages, a slow page runs to the end."""
+    deadline = time.monotonic() + doc_timeout_s if doc_timeout_s > 0 else float("inf")
+    num_pages = len(reader.pages)
+    for idx, page in enumerate(reader.pages, start=1):
+        if time.monotonic() >= deadline:
+            skipped.extend(range(idx, num_pages + 1))
+            return
+        try:
+            t = page.extract_text() or ""
+        except Exception:
+            t = ""
+        if t.strip():
+            yield ParsedSection(text=t.strip(), source_label=f"page {idx}")
+
+
+def iter_pdf_sections(
+        path: Path,
+        options: PdfOptions = PdfOptions(),
+        skipped: Optional[List[int]] = None,
+) -> Iterator[ParsedSection]:
+    """
+    Yield `page N` sections in page order while worker processes extract page ranges.
+
+    A page that exceeds page_timeout_s has its worker killed and replaced; the rest of that
+    range continues in the new worker. Once doc_timeout_s is spent every page not yet
+    extracted is given up. Skipped 1-based page numbers are appended to `skipped`.
+
+    With workers <= 1, or a PDF of at most _PDF_INPROCESS_MAX_PAGES pages, pages are read
+    in this process instead: starting workers would cost more than it saves, and only
+    doc_timeout_s (checked between pages) applies.
+    """
+    reader = PdfReader(str(path))
+    num_pages = len(reader.pages)
+    if skipped is None:
+        skipped = []
+    if options.workers <= 1 or num_pages <= _PDF_INPROCESS_MAX_PAGES:
+        yield from _iter_pdf_pages(reader, options.doc_timeout_s, skipped)
+        return
+
+    ctx = mp_context()
+    doc_deadline = time.monotonic() + options.doc_timeout_s if options.doc_timeout_s > 0 else float("inf")
+    pending = deque((i, min(i + _PDF_PAGES_PER_TASK, num_pages)) for i in range(0, num_pages, _PDF_PAGES_PER_TASK))
+    max_workers = max(1, min(int(options.workers), len(pending)))
+    workers: List[_PdfWorker] = []
+    done: dict[int, Optional[str]] = {}  # page index -> text, None when skipped
+    next_out = 0
+
+    def give_up(worker: _PdfWorker) -> None:
+        # The page in flight is lost; the remainder of its range goes back to the queue.
+        done[worker.next_page] = None
+        if worker.next_page + 1 < worker.end:
+            pending.appendleft((worker.next_page + 1, worker.end))
+        worker.kill()
+        workers.remove(worker)
+
+    try:
+        while next_out < num_pages:
+            while next_out in done:
+                text = done.pop(next_out)
+                next_out += 1
+                if text is None:
+                    skipped.append(next_out)
+                elif text.strip():
+                    yield ParsedSection(text=text.strip(), source_label=f"page {next_out}")
+            if next_out >= num_pages:
+                break
+
+            now = time.monotonic()
+            if now >= doc_deadline:
+                for worker in list(workers):
+                    worker.kill()
+                    workers.remove(worker)
+                for i in range(next_out, num_pages):
+                    done.setdefault(i, None)
+                continue
+
+            for worker in workers:
+                if not worker.busy and pending:
+                    worker.assign(*pending.popleft(), options.page_timeout_s)
+            while pending and len(workers) < max_workers:
+                worker = _PdfWorker(ctx, str(path))
+                workers.append(worker)
+                worker.assign(*pending.popleft(), options.page_timeout_s)
+
+            busy = [w for w in workers if w.busy]
+            wake = min([doc_deadline] + [w.deadline for w in busy])
+            ready = connection_wait([w.conn for w in busy], timeout=max(0.0, min(wake - now, 60.0)))
+            for worker in busy:
+                if worker.conn not in ready:
+                    continue
+                try:
+                    i, text = worker.conn.recv()
+                except (EOFError, OSError):
+                    give_up(worker)  # crashed, e.g. out of memory on a hostile page
+                    continue
+                done[i] = text
+                worker.next_page = i + 1
+                if options.page_timeout_s > 0:
+                    worker.deadline = time.monotonic() + options.page_timeout_s
+            now = time.monotonic()
+            for worker in [w for w in workers if w.busy and w.deadline <= now]:
+                give_up(worker)
+    finally:
+        for worker in workers:
+            worker.close()
+
+
 def read_docx_sections(path: Path) -> List[ParsedSection]:
     try:
         with ZipFile(path) as zf:
@@ -115,16 +437,92 @@ def read_docx_sections(path: Path) -> List[ParsedSection]:
     return [ParsedSection(text="\n".join(paras))]
 
 
-def read_xlsx_sections(path: Path, rows_per_section: int = 40) -> List[ParsedSection]:
+def _render_rows(header: List[str], batch: List[List[str]], first_row: int) -> str:
+    """Render body rows as `row N: header: value; ...` lines (row 1 is the header)."""
+    rendered = []
+    for offset, row in enumerate(batch, start=first_row):
+        pairs = []
+        for idx, cell in enumerate(row):
+            key = header[idx].strip() if idx < len(header) and str(header[idx]).strip() else f"col{idx + 1}"
+            val = cell.strip()
+            if val:
+                pairs.append(f"{key}: {val}")
+        if pairs:
+            rendered.append(f"row {offset}: " + "; ".join(pairs))
+    return "\n".join(rendered).strip()
+
+
+def _iter_row_sections(rows: Iterator[List[str]], rows_per_section: int, label: str) -> Iterator[ParsedSection]:
+    """Group a row stream into sections of rows_per_section rows, holding one batch at a time."""
+    header = next(rows, None)
+    if header is None:
+        return
+    prefix = f"{label} " if label else ""
+    batch: List[List[str]] = []
+    first = 2
+    for row in rows:
+        batch.append(row)
+        if len(batch) == rows_per_section:
+            text = _render_rows(header, batch, first)
+            if text:
+                yield ParsedSection(text=text, source_label=f"{prefix}rows {first}-{first + len(batch) - 1}")
+            first += len(batch)
+            batch = []
+    if batch:
+        text = _render_rows(header, batch, first)
+        if text:
+            yield ParsedSection(text=text, source_label=f"{prefix}rows {first}-{first + len(batch) - 1}")
+    elif first == 2:
+        # Header only.
+        line = " | ".join(cell.strip() for cell in header if cell.strip())
+        if line:
+            yield ParsedSection(text=line, source_label=label or None)
+
+
+_XLSX_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+
+
+def _iter_xlsx_rows(stream: IO[bytes], shared_strings: List[str]) -> Iterator[List[str]]:
+    """Stream the non-empty rows of one worksheet, clearing parsed elements as it goes."""
+    sheet_data = None
+    for event, elem in ElementTree.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            if elem.tag == f"{_XLSX_NS}sheetData":
+                sheet_data = elem
+            continue
+        if elem.tag != f"{_XLSX_NS}row":
+            continue
+        rendered: List[str] = []
+        for cell in elem.iterfind(f"{_XLSX_NS}c"):
+            cell_type = cell.attrib.get("t", "")
+            value_node = cell.find(f"{_XLSX_NS}v")
+            raw = value_node.text if value_node is not None and value_node.text is not None else ""
+            if cell_type == "s" and raw.isdigit():
+                idx = int(raw)
+                raw = shared_strings[idx] if 0 <= idx < len(shared_strings) else raw
+            elif cell_type == "inlineStr":
+                raw = "".join(node.text or "" for node in cell.iter(f"{_XLSX_NS}t"))
+            rendered.append(raw.strip())
+        # Drop the finished row so the tree never holds more than one.
+        if sheet_data is not None:
+            sheet_data.clear()
+        else:
+            elem.clear()
+        if any(cell for cell in rendered):
+            yield rendered
+
+
+def iter_xlsx_sections(path: Path, rows_per_section: int = 40) -> Iterator[ParsedSection]:
+    """Yield sheet sections while streaming each worksheet; memory does not grow with sheet size."""
     try:
         with ZipFile(path) as zf:
             shared_strings: List[str] = []
             if "xl/sharedStrings.xml" in zf.namelist():
-                sroot = ElementTree.fromstring(zf.read("xl/sharedStrings.xml"))
-                sns = {"a": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
-                for si in sroot.findall(".//a:si", sns):
-                    parts = [node.text or "" for node in si.findall(".//a:t", sns)]
-                    shared_strings.append("".join(parts))
+                with zf.open("xl/sharedStrings.xml") as f:
+                    for _, si in ElementTree.iterparse(f, events=("end",)):
+                        if si.tag == f"{_XLSX_NS}si":
+                            shared_strings.append("".join(node.text or "" for node in si.iter(f"{_XLSX_NS}t")))
+                            si.clear()
 
             wb = ElementTree.fromstring(zf.read("xl/workbook.xml"))
             ns = {"a": "http://schemas.openxmlformats.org/spreadsheetml/2006/main", "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships"}
@@ -134,7 +532,6 @@ def read_xlsx_sections(path: Path, rows_per_section: int = 40) -> List[ParsedSec
                 for rel in rels_root.findall(".//{http://schemas.openxmlformats.org/package/2006/relationships}Relationship")
             }
 
-            sections: List[ParsedSection] = []
             for sheet in wb.findall(".//a:sheets/a:sheet", ns):
                 sheet_name = sheet.attrib.get("name", "sheet")
                 rel_id = sheet.attrib.get("{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id", "")
@@ -142,54 +539,16 @@ def read_xlsx_sections(path: Path, rows_per_section: int = 40) -> List[ParsedSec
                 if not target:
                     continue
                 sheet_path = "xl/" + target.lstrip("/")
-                sroot = ElementTree.fromstring(zf.read(sheet_path))
-                rows: List[List[str]] = []
-                for row in sroot.findall(".//a:sheetData/a:row", ns):
-                    rendered: List[str] = []
-                    for cell in row.findall("a:c", ns):
-                        cell_type = cell.attrib.get("t", "")
-                        value_node = cell.find("a:v", ns)
-                        raw = value_node.text if value_node is not None and value_node.text is not None else ""
-                        if cell_type == "s" and raw.isdigit():
-                            idx = int(raw)
-                            raw = shared_strings[idx] if 0 <= idx < len(shared_strings) else raw
-                        elif cell_type == "inlineStr":
-                            raw = "".join(node.text or "" for node in cell.findall(".//a:t", ns))
-                        raw = raw.strip()
-                        rendered.append(raw)
-                    if any(cell for cell in rendered):
-                        rows.append(rendered)
-
-                if not rows:
-                    continue
-                header = rows[0]
-                body = rows[1:] if len(rows) > 1 else []
-                if not body:
-                    line = " | ".join(cell for cell in header if cell)
-                    if line:
-                        sections.append(ParsedSection(text=line, source_label=sheet_name))
-                    continue
-                for start in range(0, len(body), rows_per_section):
-                    batch = body[start:start + rows_per_section]
-                    rendered_rows = []
-                    for offset, row in enumerate(batch, start=start + 2):
-                        pairs = []
-                        for idx, cell in enumerate(row):
-                            key = header[idx].strip() if idx < len(header) and str(header[idx]).strip() else f"col{idx + 1}"
-                            val = cell.strip()
-                            if val:
-                                pairs.append(f"{key}: {val}")
-                        if pairs:
-                            rendered_rows.append(f"row {offset}: " + "; ".join(pairs))
-                    text = "\n".join(rendered_rows).strip()
-                    if text:
-                        end_row = start + 1 + len(batch)
-                        sections.append(ParsedSection(text=text, source_label=f"{sheet_name} rows {start + 2}-{end_row}"))
-            return sections
+                with zf.open(sheet_path) as f:
+                    yield from _iter_row_sections(_iter_xlsx_rows(f, shared_strings), rows_per_section, sheet_name)
     except (BadZipFile, KeyError, ElementTree.ParseError) as exc:
         raise ValueError("not a readable xlsx file") from exc
 
 
+def read_xlsx_sections(path: Path, rows_per_section: int = 40) -> List[ParsedSection]:
+    return list(iter_xlsx_sections(path, rows_per_section))
+
+
 def _run_text_converter(cmd: list[str], cwd: Path | None = None) -> str:
     out = subprocess.run(
         cmd,
@@ -269,59 +628,83 @@ def read_html_sections(path: Path) -> List[ParsedSection]:
     return [ParsedSection(text=text)] if text else []
 
 
-def read_csv_sections(path: Path, rows_per_section: int = 40) -> List[ParsedSection]:
-    sections: List[ParsedSection] = []
+def iter_csv_sections(path: Path, rows_per_section: int = 40) -> Iterator[ParsedSection]:
+    """Yield row sections while reading the CSV incrementally."""
     with path.open("r", encoding="utf-8", errors="ignore", newline="") as f:
-        reader = csv.reader(f)
-        rows = list(reader)
-    if not rows:
-        return sections
-    header = rows[0]
-    body = rows[1:] if len(rows) > 1 else []
-    if not body:
-        line = " | ".join(cell.strip() for cell in header if cell.strip())
-        return [ParsedSection(text=line)] if line else []
-    for start in range(0, len(body), rows_per_section):
-        batch = body[start:start + rows_per_section]
-        rendered = []
-        for offset, row in enumerate(batch, start=start + 2):
-            pairs = []
-            for idx, cell in enumerate(row):
-                key = header[idx].strip() if idx < len(header) and header[idx].strip() else f"col{idx + 1}"
-                val = cell.strip()
-                if val:
-                    pairs.append(f"{key}: {val}")
-            if pairs:
-                rendered.append(f"row {offset}: " + "; ".join(pairs))
-        text = "\n".join(rendered).strip()
-        if text:
-            row_end = start + 1 + len(batch)
-            sections.append(ParsedSection(text=text, source_label=f"rows {start + 2}-{row_end}"))
-    return sections
+        yield from _iter_row_sections(iter(csv.reader(f)), rows_per_section, "")
 
 
-def parse_file_sections(path: Path) -> Tuple[List[ParsedSection], str]:
+def read_csv_sections(path: Path, rows_per_section: int = 40) -> List[ParsedSection]:
+    return list(iter_csv_sections(path, rows_per_section))
+
+
+def parse_file_sections(
+        path: Path,
+        sha1: Optional[str] = None,
+        cache: Optional[SectionCache] = None,
+) -> Tuple[List[ParsedSection], str]:
+    """Parse a file into text sections; with a cache and the file's sha1, reuse earlier extraction."""
+    sections, mime = iter_file_sections(path, sha1=sha1, cache=cache)
+    return list(sections), mime
+
+
+def iter_file_sections(
+        path: Path,
+        sha1: Optional[str] = None,
+        cache: Optional[SectionCache] = None,
+        pdf: PdfOptions = PdfOptions(),
+        skipped: Optional[List[int]] = None,
+) -> Tuple[Iterator[ParsedSection], str]:
+    """
+    Like parse_file_sections, but CSV, XLSX and PDF files are parsed lazily as the sections
+    are consumed: spreadsheets keep memory flat however large the sheet, and PDF pages are
+    extracted in parallel under the `pdf` time limits (skipped page numbers are appended to
+    `skipped`; such partial text is not cached). Other formats are parsed up front.
+    Streaming parse errors (and "empty document") surface while iterating.
+    """
     mime = guess_mime(path)
     ext = path.suffix.lower()
+    use_cache = cache is not None and sha1 is not None and ext in _CACHED_EXTS
+    if use_cache:
+        cached = cache.get(sha1, ext)
+        if cached is not None:
+            return iter(cached), mime
+
+    if skipped is None:
+        skipped = []
+    if ext == ".csv":
+        sections = _non_empty(iter_csv_sections(path))
+    elif ext in (".xlsx", ".xlsm"):
+        sections = _non_empty(iter_xlsx_sections(path))
+    elif ext == ".pdf":
+        sections = _non_empty(iter_pdf_sections(path, pdf, skipped))
+    else:
+        sections = iter(_parse_sections(path, ext))
+    if use_cache:
+        sections = cache.write_through(sha1, ext, sections, complete=lambda: not skipped)
+    return sections, mime
+
+
+def _non_empty(sections: Iterable[ParsedSection]) -> Iterator[ParsedSection]:
+    seen = False
+    for section in sections:
+        if section.text.strip():
+            seen = True
+            yield section
+    if not seen:
+        raise ValueError("empty document")
+
+
+def _parse_sections(path: Path, ext: str) -> List[ParsedSection]:
     sections: List[ParsedSection] | None = None
     errors: List[str] = []
 
     # Prefer explicit handlers first, then fall back to text if readable.
-    if ext == ".pdf":
-        try:
-            sections = read_pdf_sections(path)
-        except Exception as exc:
-            errors.append(str(exc))
-    elif ext == ".docx":
+    if ext == ".docx":
         try:
             sections = read_docx_sections(path)
         except Exception as exc:
             errors.append(str(exc))
-    elif ext in (".xlsx", ".xlsm"):
-        try:
-            sections = read_xlsx_sections(path)
-        except Exception as exc:
-            errors.append(str(exc))
     elif ext == ".doc":
         try:
             sections = read_legacy_doc_sections(path)
@@ -337,11 +720,6 @@ def parse_file_sections(path: Path) -> Tuple[List[ParsedSection], str]:
             sections = read_html_sections(path)
         except Exception as exc:
             errors.append(str(exc))
-    elif ext == ".csv":
-        try:
-            sections = read_csv_sections(path)
-        except Exception as exc:
-            errors.append(str(exc))
 
     if sections is None:
         try:
@@ -354,4 +732,4 @@ def parse_file_sections(path: Path) -> Tuple[List[ParsedSection], str]:
     sections = [section for section in sections if section.text.strip()]
     if not sections:
         raise ValueError("empty document")
-    return sections, mime
+    return sections
@@ -1,39 +1,222 @@
 from __future__ import annotations
 
 import hashlib
+import os
+import shutil
+import stat
+import sys
 import time
-from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import numpy as np
 
 from src.config import AppConfig
-from src.rag.chunker import chunk_text
+from src.rag.chunker import chunk_text, chunk_text_cdc
+from src.rag.embed_cache import EmbeddingCache, text_key
 from src.rag.embedder import create_embedder
-from src.rag.fs_scan import list_doc_paths
+from src.rag.fs_scan import scan_doc_files
 from src.rag.index_sqlite import RagSqliteStore
-from src.rag.parsers import file_sha1, parse_file_sections
+from src.rag.parsers import ParsedSection, PdfOptions, SectionCache, file_sha1, iter_file_sections, mp_context
 from src.rag.rerank import create_reranker
+from src.rag.rwlock import RWLock
+from src.rag.sparse_index import SparseIndex
 from src.rag.types import ChunkRecord, DocRecord, RagSnippet
 from src.rag.vector_index import VectorIndex
 
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def _pending(doc: DocRecord) -> DocRecord:
+    """
+    The manifest row for a doc whose new chunks are not in the vector index yet.
+
+    It matches no file on disk, so the next build re-plans the doc even if this one dies
+    between the SQLite commit and the index save.
+    """
+    return replace(doc, mtime=-1.0, sha1="", size=-1)
+
+
+def _swap_index_files(staging: Path, index_path: Path) -> None:
+    """
+    Replace the files of the index at index_path with the ones saved under staging.
+
+    Every index file is named after index_path. The metadata goes first and comes back
+    last, so a crash in between leaves an index that reads as missing (-> full rebuild).
+    """
+    fresh = {p.name: p for p in staging.iterdir() if p.is_file()}
+    old = list(index_path.parent.glob(index_path.name + "*"))
+    for p in old:
+        if p.name.endswith(".meta.json"):
+            p.unlink(missing_ok=True)
+    for p in old:
+        if p.name not in fresh:
+            p.unlink(missing_ok=True)
+    for name in sorted(fresh, key=lambda n: n.endswith(".meta.json")):
+        os.replace(fresh[name], index_path.parent / name)
+
 
 def _stable_doc_id(path: str) -> str:
     return hashlib.sha1(path.encode("utf-8", errors="ignore")).hexdigest()
 
 
-def _embed_chunks(embedder, chunks: List[ChunkRecord]):
+def _rrf_fuse(rankings: List[List[str]], k: int = 60) -> Dict[str, float]:
+    """Reciprocal-rank fusion, scaled so an id ranked first in every list scores 1.0."""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, cid in enumerate(ranking):
+            fused[cid] = fused.get(cid, 0.0) + 1.0 / (k + rank + 1)
+    scale = len(rankings) / (k + 1)
+    return {cid: score / scale for cid, score in fused.items()}
+
+
+def _peak_rss_mb() -> float:
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS.
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _timed_embed(embedder, texts: List[str], stats: Optional["BuildStats"], sparse: bool = False):
+    t0 = time.perf_counter()
+    vecs = embedder.embed_sparse(texts) if sparse else embedder.embed(texts)
+    if stats is not None:
+        stats.embedded += len(texts)
+        stats.embed_s += time.perf_counter() - t0
+    return vecs
+
+
+def _embed_chunks(
+        embedder,
+        chunks: List[ChunkRecord],
+        cache: Optional[EmbeddingCache] = None,
+        stats: Optional["BuildStats"] = None,
+        sparse: bool = False,
+):
     if not chunks:
         return None, []
     ids = [c.chunk_id for c in chunks]
     texts = [c.text for c in chunks]
-    vecs = embedder.embed(texts)
-    if vecs.shape[0] != len(ids):
-        raise RuntimeError("embedding count mismatch")
+    if sparse or cache is None or not embedder.cacheable:
+        vecs = _timed_embed(embedder, texts, stats, sparse=sparse)
+        if vecs.shape[0] != len(ids):
+            raise RuntimeError("embedding count mismatch")
+        return vecs, ids
+
+    keys = [text_key(t) for t in texts]
+    cached = cache.get_many(embedder.identity, keys)
+    miss = [i for i, key in enumerate(keys) if key not in cached]
+    if stats is not None:
+        stats.cache_hits += len(keys) - len(miss)
+        stats.cache_misses += len(miss)
+    if miss:
+        # Identical texts within the batch are embedded once.
+        todo = list(dict.fromkeys(keys[i] for i in miss))
+        first_text = {keys[i]: texts[i] for i in reversed(miss)}
+        fresh = _timed_embed(embedder, [first_text[key] for key in todo], stats)
+        if fresh.shape[0] != len(todo):
+            raise RuntimeError("embedding count mismatch")
+        cache.put_many(embedder.identity, todo, fresh)
+        cached.update(zip(todo, fresh))
+    vecs = np.stack([cached[key] for key in keys]).astype(np.float32, copy=False)
     return vecs, ids
 
 
+# (doc record, chunks, hash seconds, parse+chunk seconds, parse error, skipped PDF pages).
+# chunks is None when the content did not change or parsing failed.
+_PreparedDoc = Tuple[DocRecord, Optional[List[ChunkRecord]], float, float, Optional[str], List[int]]
+_PrepJob = Tuple[str, float, int, Optional[DocRecord]]  # (path, mtime, size, existing doc)
+
+
+def _unique_chunk_id(chunk_id: str, taken: set[str]) -> str:
+    """chunk_id, or chunk_id-N for repeated text within one doc; records the result in taken."""
+    out, n = chunk_id, 1
+    while out in taken:
+        out = f"{chunk_id}-{n}"
+        n += 1
+    taken.add(out)
+    return out
+
+
+def _prepare_doc(
+        ap: str,
+        mtime: float,
+        size: int,
+        existing: DocRecord | None,
+        chunk_size: int,
+        overlap: int,
+        chunker: str = "cdc",
+        section_cache: Optional[SectionCache] = None,
+        pdf: PdfOptions = PdfOptions(),
+) -> _PreparedDoc:
+    """Hash, parse and chunk one file. Runs in a worker process."""
+    p = Path(ap)
+    t0 = time.perf_counter()
+    sha1 = file_sha1(p)
+    hash_s = time.perf_counter() - t0
+    if existing is not None and existing.sha1 == sha1:
+        return DocRecord(existing.doc_id, ap, mtime, sha1, existing.mime, size), None, hash_s, 0.0, None, []
+
+    doc_id = existing.doc_id if existing is not None else _stable_doc_id(ap)
+    t0 = time.perf_counter()
+    skipped: List[int] = []
+    try:
+        # Spreadsheets and PDFs stream: each section is chunked as it is read, never held as a whole.
+        sections, mime = iter_file_sections(p, sha1=sha1, cache=section_cache, pdf=pdf, skipped=skipped)
+        chunks = _chunk_sections(sections, doc_id, ap, chunk_size, overlap, chunker)
+    except Exception as e:
+        failed = DocRecord(doc_id=doc_id, path=ap, mtime=mtime, sha1=sha1, mime="", size=size)
+        return failed, None, hash_s, time.perf_counter() - t0, f"{type(e).__name__}: {e}", skipped
+
+    next_doc = DocRecord(doc_id=doc_id, path=ap, mtime=mtime, sha1=sha1, mime=mime, size=size)
+    return next_doc, chunks, hash_s, time.perf_counter() - t0, None, skipped
+
+
+def _chunk_sections(
+        sections: Iterable[ParsedSection],
+        doc_id: str,
+        ap: str,
+        chunk_size: int,
+        overlap: int,
+        chunker: str,
+) -> List[ChunkRecord]:
+    split = chunk_text_cdc if chunker == "cdc" else chunk_text
+    chunks: List[ChunkRecord] = []
+    seen_ids: set[str] = set()
+    chunk_idx = 0
+    for section in sections:
+        spans = split(
+            section.text,
+            chunk_size=chunk_size,
+            overlap=overlap,
+        )
+        for s, e, ctext in spans:
+            # Ids follow content, not position, so unchanged chunks keep theirs across edits.
+            content_hash = text_key(ctext)
+            chunk_id = _unique_chunk_id(f"{doc_id}:{content_hash[:16]}", seen_ids)
+            chunks.append(
+                ChunkRecord(
+                    chunk_id=chunk_id,
+                    doc_id=doc_id,
+                    path=ap,
+                    idx=chunk_idx,
+                    start=s,
+                    end=e,
+                    text=ctext,
+                    source_label=section.source_label,
+                    content_hash=content_hash,
+                )
+            )
+            chunk_idx += 1
+    return chunks
+
+
 @dataclass
 class BuildStats:
     scanned: int = 0
@@ -41,9 +224,72 @@ class BuildStats:
     removed_docs: int = 0
     updated_chunks: int = 0
     rebuilt_index: bool = False
+    reused_chunks: int = 0  # chunks of edited docs whose text (and vector) was kept
+    cache_hits: int = 0
+    cache_misses: int = 0
+    embedded: int = 0
+    embed_s: float = 0.0
+    skipped_bad: int = 0
+    failed_docs: int = 0
+    skipped_pages: int = 0  # PDF pages given up on (timeout or crashed extractor)
+    scan_s: float = 0.0
+    hash_s: float = 0.0  # summed over workers
+    parse_s: float = 0.0  # parse + chunk, summed over workers
     ms: int = 0
 
 
+ProgressFn = Callable[[Dict[str, Any]], None]
+
+
+class BuildProgress:
+    """
+    Throttled progress reports for one build: files prepared, chunks embedded and an ETA.
+
+    The ETA extrapolates the current stage only (parse rate for files, embed rate for chunks).
+    """
+
+    def __init__(self, callback: Optional[ProgressFn], interval_s: float = 0.25) -> None:
+        self.callback = callback
+        self.interval_s = float(interval_s)
+        self.files_total = 0
+        self.files_done = 0
+        self.chunks_total = 0
+        self.chunks_done = 0
+        self._stage = ""
+        self._stage_t0 = time.perf_counter()
+        self._last = 0.0
+
+    def stage(self, name: str, total: int) -> None:
+        self._stage = name
+        self._stage_t0 = time.perf_counter()
+        if name == "embedding":
+            self.chunks_total, self.chunks_done = int(total), 0
+        else:
+            self.files_total, self.files_done = int(total), 0
+        self.report(force=True)
+
+    def report(self, force: bool = False) -> None:
+        if self.callback is None:
+            return
+        now = time.perf_counter()
+        if not force and now - self._last < self.interval_s:
+            return
+        self._last = now
+        done, total = (
+            (self.chunks_done, self.chunks_total) if self._stage == "embedding" else (self.files_done, self.files_total)
+        )
+        elapsed = now - self._stage_t0
+        eta_s = round(elapsed / done * (total - done), 1) if done and total > done else (0.0 if done else None)
+        self.callback({
+            "stage": self._stage,
+            "files_done": self.files_done,
+            "files_total": self.files_total,
+            "chunks_done": self.chunks_done,
+            "chunks_total": self.chunks_total,
+            "eta_s": eta_s,
+        })
+
+
 class RagPipeline:
     def __init__(self, cfg: AppConfig) -> None:
         self.cfg = cfg
@@ -61,12 +307,58 @@ class RagPipeline:
             dim=cfg.RAG.EMBED_DIM,
             ollama_url=cfg.RAG.OLLAMA_URL,
             ollama_model=cfg.RAG.OLLAMA_EMBED_MODEL,
+            batch_size=cfg.RAG.EMBED_BATCH_SIZE,
+            concurrency=cfg.RAG.EMBED_CONCURRENCY,
+        )
+        self.embed_cache = (
+            EmbeddingCache(str(base / cfg.RAG.EMBED_CACHE_FILE), max_mb=cfg.RAG.EMBED_CACHE_MAX_MB)
+            if cfg.RAG.EMBED_CACHE_ENABLED
+            else None
+        )
+        self.section_cache = (
+            SectionCache(str(base / cfg.RAG.PARSE_CACHE_DIR), max_mb=cfg.RAG.PARSE_CACHE_MAX_MB)
+            if cfg.RAG.PARSE_CACHE_ENABLED
+            else None
         )
         self.reranker = create_reranker(cfg.RAG.RERANK_BACKEND, cfg.RAG.RERANK_ALPHA)
-        self.vindex = VectorIndex(index_path=self.index_path, dim=cfg.RAG.EMBED_DIM, metric="ip")
-
+        index_type = cfg.RAG.INDEX_TYPE
+        if index_type == "auto":
+            index_type = "sparse" if hasattr(self.embedder, "embed_sparse") else "flat"
+        if index_type == "sparse" and not hasattr(self.embedder, "embed_sparse"):
+            raise ValueError(f"INDEX_TYPE sparse needs a sparse embedder, not {cfg.RAG.EMBEDDER_BACKEND}")
+        # Bag-of-words (hashing) vectors are searched through an inverted index instead of dense rows.
+        self.sparse = index_type == "sparse"
+        self.index_type = index_type
+        self.vindex = self._create_index(self.index_path)
+
+        self._lexical_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-fts")
+        # Shared by retrieve(); exclusive while vindex is loaded, mutated or saved.
+        self._index_lock = RWLock()
         self._loaded = False
 
+    def _create_index(self, index_path: str) -> VectorIndex | SparseIndex:
+        rag = self.cfg.RAG
+        if self.sparse:
+            return SparseIndex(
+                index_path=index_path,
+                dim=rag.EMBED_DIM,
+                compact_ratio=rag.COMPACT_RATIO,
+                max_segments=rag.MAX_SEGMENTS,
+            )
+        return VectorIndex(
+            index_path=index_path,
+            dim=rag.EMBED_DIM,
+            metric="ip",
+            store_dtype=rag.INDEX_DTYPE,
+            index_type=self.index_type,
+            nlist=rag.IVF_NLIST,
+            nprobe=rag.IVF_NPROBE,
+            pq_m=rag.PQ_M,
+            ivf_min_rows=rag.IVF_MIN_ROWS,
+            compact_ratio=rag.COMPACT_RATIO,
+            max_segments=rag.MAX_SEGMENTS,
+        )
+
     def warmup(self, build_if_missing: bool = True) -> Dict[str, int | bool]:
         if not self.enabled:
             return {"ok": True, "enabled": False, "loaded": False, "rebuilt_index": False}
@@ -83,83 +375,246 @@ class RagPipeline:
     def _ensure_loaded(self) -> None:
         if not self.enabled:
             return
-        if self._loaded and self.vindex.exists():
+        if self._loaded or not self.vindex.exists():
+            return
+        with self._index_lock.write():
+            if not self._loaded and self.vindex.exists():
+                self.vindex.load()
+                self._loaded = True
+
+    def _prepare_docs(
+            self,
+            jobs: List[_PrepJob],
+            workers: int,
+    ) -> Iterator[tuple[_PrepJob, _PreparedDoc | None]]:
+        """Hash/parse/chunk changed files, yielding (job, result) in completion order."""
+        chunk_size = self.cfg.RAG.CHUNK_SIZE
+        overlap = self.cfg.RAG.CHUNK_OVERLAP
+        chunker = self.cfg.RAG.CHUNKER
+        file_workers = 1 if workers <= 1 or len(jobs) <= 1 else min(workers, len(jobs))
+        pdf_workers = int(self.cfg.RAG.PDF_WORKERS)
+        if pdf_workers <= 0:
+            # Page-parallel extraction shares the CPUs with the file-level pool.
+            pdf_workers = max(1, (os.cpu_count() or 1) // file_workers)
+        pdf = PdfOptions(
+            workers=pdf_workers,
+            page_timeout_s=float(self.cfg.RAG.PDF_PAGE_TIMEOUT_S),
+            doc_timeout_s=float(self.cfg.RAG.PDF_DOC_TIMEOUT_S),
+        )
+        args = (chunk_size, overlap, chunker, self.section_cache, pdf)
+        if file_workers == 1:
+            for job in jobs:
+                yield job, _prepare_doc(*job, *args)
             return
-        if self.vindex.exists():
-            self.vindex.load()
-            self._loaded = True
 
-    def build_or_update_index(self) -> Dict[str, int | bool]:
+        with ProcessPoolExecutor(max_workers=file_workers, mp_context=mp_context()) as pool:
+            futures = {pool.submit(_prepare_doc, *job, *args): job for job in jobs}
+            for fut in as_completed(futures):
+                try:
+                    result = fut.result()
+                except Exception:
+                    # A crashed worker only loses its own file; it is retried next build.
+                    result = None
+                yield futures[fut], result
+
+    def build_or_update_index(
+            self,
+            workers: Optional[int] = None,
+            progress: Optional[ProgressFn] = None,
+    ) -> Dict[str, int | bool]:
+        """
+        Sync SQLite and the vector index with the files under DOCS_GLOBS.
+
+        `workers` > 1 fans hashing/parsing/chunking of changed files out to a process pool
+        (default: RAG.INDEX_WORKERS); all writes stay on the calling thread. `progress`, if
+        given, receives throttled BuildProgress reports on that same thread.
+        """
         if not self.enabled:
             return {"ok": True, "updated_docs": 0, "updated_chunks": 0, "rebuilt_index": False}
 
         t0 = time.perf_counter()
         stats = BuildStats()
 
-        paths = list_doc_paths(
+        t_scan = time.perf_counter()
+        files = scan_doc_files(
             patterns=self.cfg.DOCS_GLOBS,
-            exts=None,
+            exts=self.cfg.DOCS_EXTS,
             follow_symlinks=False,
             max_file_size_mb=self.cfg.RAG.MAX_FILE_SIZE_MB,
         )
-        stats.scanned = len(paths)
-        live_paths = {str(p.resolve()) for p in paths}
-
-        removed_docs: List[DocRecord] = []
-        changed_docs: List[tuple[DocRecord | None, DocRecord, List[ChunkRecord]]] = []
+        stats.scanned = len(files)
+
+        # Change detection is a dict lookup against the manifest; unchanged files cost no
+        # syscalls beyond the scan's own stat.
+        manifest = self.store.load_manifest()
+        known_bad = self.store.load_failed()
+        jobs: List[_PrepJob] = []
+        for ap, st in files:
+            self._plan_file(ap, st, manifest.pop(ap, None), known_bad.pop(ap, None), stats, jobs)
+        # Whatever the scan did not claim is gone from disk.
+        removed_docs = list(manifest.values())
+        stats.scan_s = time.perf_counter() - t_scan
+        return self._sync(jobs, removed_docs, list(known_bad), stats, workers, t0, progress)
+
+    def index_paths(
+            self,
+            paths: Iterable[str | Path],
+            workers: Optional[int] = None,
+            progress: Optional[ProgressFn] = None,
+    ) -> Dict[str, int | bool]:
+        """
+        Index (or re-index) only the given files, e.g. fresh uploads.
+
+        Work is proportional to these files: nothing else is scanned and the index save
+        only writes the new rows. Paths that no longer exist, or that DOCS_EXTS /
+        MAX_FILE_SIZE_MB exclude, are dropped from the index instead. A directory (present
+        or deleted) stands for the docs indexed below it. Paths outside DOCS_GLOBS are
+        indexed too, but the next full build will remove them.
+        """
+        if not self.enabled:
+            return {"ok": True, "updated_docs": 0, "updated_chunks": 0, "rebuilt_index": False}
 
-        for existing_doc in self.store.list_docs():
-            if existing_doc.path not in live_paths:
-                removed_docs.append(existing_doc)
-                stats.removed_docs += 1
+        t0 = time.perf_counter()
+        stats = BuildStats()
+        exts = {e.lower() if e.startswith(".") else f".{e.lower()}" for e in self.cfg.DOCS_EXTS}
+        max_bytes = self.cfg.RAG.MAX_FILE_SIZE_MB * 1024 * 1024
 
-        for p in paths:
-            ap = str(p.resolve())
-            mtime = float(p.stat().st_mtime)
+        jobs: List[_PrepJob] = []
+        removed_docs: List[DocRecord] = []
+        cleared: List[str] = []
+        targets = list(dict.fromkeys(os.path.realpath(os.path.expanduser(str(p))) for p in paths))
+        seen = set(targets)
+        for ap in targets:
             existing = self.store.get_doc_by_path(ap)
-
-            if existing is not None and abs(existing.mtime - mtime) < 1e-6:
+            try:
+                st = os.stat(ap)
+            except OSError:
+                st = None
+            if existing is None and (st is None or stat.S_ISDIR(st.st_mode)):
+                under = [p for p in self.store.list_doc_paths_under(ap) if p not in seen]
+                seen.update(under)
+                targets.extend(under)
+                if st is None:
+                    cleared.append(ap)
                 continue
-
-            sha1 = file_sha1(p)
-            if existing is not None and existing.sha1 == sha1:
-                self.store.upsert_doc(DocRecord(existing.doc_id, ap, mtime, sha1, existing.mime))
+            if st is None or not stat.S_ISREG(st.st_mode) or os.path.splitext(ap)[1].lower() not in exts \
+                    or st.st_size > max_bytes:
+                if existing is not None:
+                    removed_docs.append(existing)
+                cleared.append(ap)
                 continue
+            stats.scanned += 1
+            self._plan_file(ap, st, existing, self.store.get_failure(ap), stats, jobs)
+        stats.scan_s = time.perf_counter() - t0
+        return self._sync(jobs, removed_docs, cleared, stats, workers, t0, progress)
 
-            try:
-                sections, mime = parse_file_sections(p)
-            except Exception:
-                continue
+    def remove_paths(self, paths: Iterable[str | Path], progress: Optional[ProgressFn] = None) -> Dict[str, int | bool]:
+        """Drop the given files from SQLite and the index, whether or not they still exist on disk."""
+        if not self.enabled:
+            return {"ok": True, "updated_docs": 0, "updated_chunks": 0, "rebuilt_index": False}
 
-            doc_id = existing.doc_id if existing is not None else _stable_doc_id(ap)
-            next_doc = DocRecord(doc_id=doc_id, path=ap, mtime=mtime, sha1=sha1, mime=mime)
+        t0 = time.perf_counter()
+        keys = list(dict.fromkeys(os.path.realpath(os.path.expanduser(str(p))) for p in paths))
+        removed_docs = [doc for doc in (self.store.get_doc_by_path(ap) for ap in keys) if doc is not None]
+        return self._sync([], removed_docs, keys, BuildStats(), 1, t0, progress)
+
+    @staticmethod
+    def _plan_file(
+            ap: str,
+            st: os.stat_result,
+            existing: Optional[DocRecord],
+            failed: Optional[Tuple[float, int]],
+            stats: "BuildStats",
+            jobs: List[_PrepJob],
+    ) -> None:
+        """Queue a file for hashing/parsing unless its stat shows it is unchanged or known bad."""
+        if failed is not None and abs(failed[0] - st.st_mtime) < 1e-6 and failed[1] == st.st_size:
+            # Failed to parse before and untouched since: skip without hashing.
+            stats.skipped_bad += 1
+            return
+        if existing is not None and abs(existing.mtime - st.st_mtime) < 1e-6 and existing.size == st.st_size:
+            return
+        if failed is not None and existing is not None:
+            # Indexed with pages missing: re-parse even if the content hash still matches.
+            existing = replace(existing, sha1="")
+        jobs.append((ap, float(st.st_mtime), int(st.st_size), existing))
 
-            chunks: List[ChunkRecord] = []
-            chunk_idx = 0
-            for section in sections:
-                spans = chunk_text(
-                    section.text,
-                    chunk_size=self.cfg.RAG.CHUNK_SIZE,
-                    overlap=self.cfg.RAG.CHUNK_OVERLAP,
-                )
-                for s, e, ctext in spans:
-                    chunk_id = f"{doc_id}:{chunk_idx:06d}"
-                    chunks.append(
-                        ChunkRecord(
-                            chunk_id=chunk_id,
-                            doc_id=doc_id,
-                            path=ap,
-                            idx=chunk_idx,
-                            start=s,
-                            end=e,
-                            text=ctext,
-                            source_label=section.source_label,
-                        )
-                    )
-                    chunk_idx += 1
+    def _diff_chunks(
+            self,
+            doc_id: str,
+            chunks: List[ChunkRecord],
+    ) -> tuple[List[ChunkRecord], List[ChunkRecord], List[str]]:
+        """
+        Match the new chunks of an edited doc against its stored ones by content hash.
+
+        Returns (fresh chunks to insert and embed, kept chunks carrying their stored ids,
+        stored chunk ids that are gone).
+        """
+        free: Dict[str, List[str]] = {}
+        old_ids: List[str] = []
+        for cid, content_hash, text in self.store.list_chunk_hashes_for_doc(doc_id):
+            free.setdefault(content_hash or text_key(text or ""), []).append(cid)
+            old_ids.append(cid)
+
+        kept: List[ChunkRecord] = []
+        fresh: List[ChunkRecord] = []
+        for chunk in chunks:
+            ids = free.get(chunk.content_hash)
+            if ids:
+                kept.append(replace(chunk, chunk_id=ids.pop(0)))
+            else:
+                fresh.append(chunk)
+        kept_ids = {c.chunk_id for c in kept}
+        stale = [cid for cid in old_ids if cid not in kept_ids]
+        # A fresh id may only clash with an id that stays (e.g. a duplicated paragraph).
+        taken = kept_ids | {c.chunk_id for c in fresh}
+        fresh = [replace(c, chunk_id=_unique_chunk_id(c.chunk_id, taken)) if c.chunk_id in kept_ids else c for c in fresh]
+        return fresh, kept, stale
+
+    def _sync(
+            self,
+            jobs: List[_PrepJob],
+            removed_docs: List[DocRecord],
+            cleared_failures: List[str],
+            stats: "BuildStats",
+            workers: Optional[int],
+            t0: float,
+            progress: Optional[ProgressFn] = None,
+    ) -> Dict[str, int | bool]:
+        """Prepare the queued files, then apply them and the removals to SQLite and the index."""
+        workers = int(self.cfg.RAG.INDEX_WORKERS if workers is None else workers)
+        if workers <= 0:
+            workers = os.cpu_count() or 1
+        stats.removed_docs = len(removed_docs)
+        changed_docs: List[tuple[DocRecord | None, DocRecord, List[ChunkRecord]]] = []
+        touched_docs: List[DocRecord] = []
+        failures: List[tuple[DocRecord, str]] = []
+        partial: List[tuple[DocRecord, str]] = []
+        tracker = BuildProgress(progress)
+
+        tracker.stage("parsing", len(jobs))
+        for (_, _, _, existing), result in self._prepare_docs(jobs, workers):
+            tracker.files_done += 1
+            tracker.report()
+            if result is None:
+                continue
+            next_doc, chunks, hash_s, parse_s, error, skipped_pages = result
+            stats.hash_s += hash_s
+            stats.parse_s += parse_s
+            if error is not None:
+                failures.append((next_doc, error))
+                continue
+            if skipped_pages:
+                # Indexed without these pages; the failure record holds the doc back until it is touched.
+                stats.skipped_pages += len(skipped_pages)
+                pages = ", ".join(str(n) for n in skipped_pages)
+                partial.append((next_doc, f"PageTimeout: skipped pages {pages}"))
+            if chunks is None:
+                touched_docs.append(next_doc)
+                continue
             changed_docs.append((existing, next_doc, chunks))
             stats.updated_docs += 1
-            stats.updated_chunks += len(chunks)
+        stats.failed_docs = len(failures)
 
         any_change = bool(removed_docs or changed_docs)
         needs_full_rebuild = not self.vindex.exists()
@@ -168,46 +623,99 @@ class RagPipeline:
             if any_change and not self.vindex.is_mutable():
                 needs_full_rebuild = True
 
-        if needs_full_rebuild:
+        # All doc/chunk mutations of this build land in a single commit.
+        stale_chunk_ids: List[str] = []
+        retired_chunk_ids: List[str] = []
+        to_embed: List[List[ChunkRecord]] = []
+        with self.store.transaction():
+            # Drop failure records of files that are gone or parsed fine this time.
+            self.store.delete_failures(cleared_failures + [doc.path for _, doc, _ in changed_docs])
+            for doc, error in failures + partial:
+                self.store.record_failure(doc.path, doc.mtime, doc.size, doc.sha1, error)
+            for doc in touched_docs:
+                self.store.upsert_doc(doc)
             for existing_doc in removed_docs:
+                stale_chunk_ids.extend(self.store.list_chunk_ids_for_doc(existing_doc.doc_id))
                 self.store.delete_doc(existing_doc.doc_id)
             for existing, next_doc, chunks in changed_docs:
-                if existing is not None:
-                    self.store.delete_chunks_for_doc(existing.doc_id)
-                self.store.upsert_doc(next_doc)
-                self.store.insert_chunks(chunks)
-
-            all_chunks = self.store.get_all_chunks()
-            if all_chunks:
-                vecs, ids = _embed_chunks(self.embedder, all_chunks)
-                assert vecs is not None
-                self.vindex.build(vecs, ids)
-            else:
-                self.vindex.build(np.empty((0, self.cfg.RAG.EMBED_DIM), dtype=np.float32), [])
-            self.vindex.save()
-            self._loaded = True
+                # The real mtime/sha1 are written only once the vectors are saved (below).
+                self.store.upsert_doc(_pending(next_doc))
+                if existing is None:
+                    fresh = chunks
+                elif existing.mtime < 0:
+                    # Left pending by a failed build: its stored chunks may have no vectors.
+                    fresh = chunks
+                    stale = self.store.list_chunk_ids_for_doc(existing.doc_id)
+                    self.store.delete_chunks(stale)
+                    stale_chunk_ids.extend(stale)
+                else:
+                    fresh, kept, stale = self._diff_chunks(existing.doc_id, chunks)
+                    if needs_full_rebuild:
+                        self.store.delete_chunks(stale)
+                    else:
+                        # Kept until the index is saved, so a retry of this (pending) doc
+                        # still finds every id the index on disk may hold for it.
+                        retired_chunk_ids.extend(stale)
+                    self.store.update_chunk_positions(kept)
+                    stats.reused_chunks += len(kept)
+                self.store.insert_chunks(fresh)
+                to_embed.append(fresh)
+        stats.updated_chunks = sum(len(chunks) for chunks in to_embed)
+
+        if needs_full_rebuild:
+            # Stream pages of chunks through the embedder into the index: O(batch) memory.
+            n_rows = self.store.count_chunks()
+            tracker.stage("embedding", n_rows)
+
+            def _batches():
+                for page in self.store.iter_chunks(self.cfg.RAG.REBUILD_BATCH_SIZE):
+                    batch = _embed_chunks(self.embedder, page, self.embed_cache, stats, sparse=self.sparse)
+                    tracker.chunks_done += len(page)
+                    tracker.report()
+                    yield batch
+
+            # The new index is written next to the live one, which keeps serving retrieve();
+            # the lock is only taken to swap the files in and load them.
+            index_path = Path(self.index_path)
+            staging = index_path.parent / "rebuild"
+            shutil.rmtree(staging, ignore_errors=True)
+            staging.mkdir()
+            fresh = self._create_index(str(staging / index_path.name))
+            fresh.build_from_batches(_batches(), n_rows=n_rows)
+            fresh.save()
+            del fresh
+            with self._index_lock.write():
+                _swap_index_files(staging, index_path)
+                self.vindex.load()
+                self._loaded = True
+            shutil.rmtree(staging, ignore_errors=True)
             stats.rebuilt_index = True
         elif any_change:
-            for existing_doc in removed_docs:
-                old_chunk_ids = self.store.list_chunk_ids_for_doc(existing_doc.doc_id)
-                self.vindex.remove_ids(old_chunk_ids)
-                self.store.delete_doc(existing_doc.doc_id)
-
-            for existing, next_doc, chunks in changed_docs:
-                old_chunk_ids = self.store.list_chunk_ids_for_doc(next_doc.doc_id) if existing is not None else []
-                if old_chunk_ids:
-                    self.vindex.remove_ids(old_chunk_ids)
-                if existing is not None:
-                    self.store.delete_chunks_for_doc(existing.doc_id)
-                self.store.upsert_doc(next_doc)
-                self.store.insert_chunks(chunks)
-                vecs, ids = _embed_chunks(self.embedder, chunks)
+            tracker.stage("embedding", stats.updated_chunks)
+            embedded = []
+            for chunks in to_embed:
+                vecs, ids = _embed_chunks(self.embedder, chunks, self.embed_cache, stats, sparse=self.sparse)
                 if vecs is not None:
+                    embedded.append((vecs, ids))
+                tracker.chunks_done += len(chunks)
+                tracker.report()
+
+            # Retrieval keeps running while files are parsed and embedded; it only waits
+            # for the index mutation and save.
+            with self._index_lock.write():
+                self.vindex.remove_ids(stale_chunk_ids + retired_chunk_ids)
+                for vecs, ids in embedded:
                     self.vindex.add(vecs, ids)
+                self.vindex.save()
+                self._loaded = True
 
-            self.vindex.save()
-            self._loaded = True
+        if changed_docs:
+            with self.store.transaction():
+                self.store.delete_chunks(retired_chunk_ids)
+                for _, next_doc, _ in changed_docs:
+                    self.store.upsert_doc(next_doc)
 
+        tracker.report(force=True)
         stats.ms = int((time.perf_counter() - t0) * 1000)
         return {
             "ok": True,
@@ -215,37 +723,49 @@ class RagPipeline:
             "updated_docs": stats.updated_docs,
             "removed_docs": stats.removed_docs,
             "updated_chunks": stats.updated_chunks,
+            "reused_chunks": stats.reused_chunks,
+            "reembedded_chunks": stats.updated_chunks,
+            "failed_docs": stats.failed_docs,
+            "skipped_known_bad": stats.skipped_bad,
+            "skipped_pages": stats.skipped_pages,
             "rebuilt_index": bool(stats.rebuilt_index),
+            "embed_cache_hits": stats.cache_hits,
+            "embed_cache_misses": stats.cache_misses,
+            "embedded": stats.embedded,
+            "embed_texts_per_s": round(stats.embedded / stats.embed_s, 1) if stats.embed_s > 0 else 0.0,
+            "peak_rss_mb": _peak_rss_mb(),
+            "scan_ms": int(stats.scan_s * 1000),
+            "hash_ms": int(stats.hash_s * 1000),
+            "parse_ms": int(stats.parse_s * 1000),
             "ms": stats.ms,
         }
 
-    def _snippets_from_chunks(
+    def _snippets_from_docs(
             self,
             query: str,
-            chunks: List[ChunkRecord],
+            qv,
+            doc_ids: List[str],
             top_k: int,
-            preferred_doc_ids: Optional[set[str]] = None,
+            cand_k: int,
     ) -> List[RagSnippet]:
-        if not chunks:
-            return []
-
-        qv = self.embedder.embed([query])
-        vecs, ids = _embed_chunks(self.embedder, chunks)
-        if vecs is None:
+        """Rank chunks of the given docs using their stored index vectors (no re-embedding)."""
+        scores, id_lists = self.vindex.search_docs(qv, k=cand_k, doc_ids=doc_ids)
+        if not id_lists or not id_lists[0]:
             return []
+        score_by_id = {cid: float(scores[0][rank]) for rank, cid in enumerate(id_lists[0])}
+        chunks = sorted(self.store.get_chunk_text_by_ids(id_lists[0]), key=lambda c: (c.doc_id, c.idx))
 
-        sims = (qv @ vecs.T)[0]
         by_doc_first_seen: set[str] = set()
         snips: List[RagSnippet] = []
-        for idx, chunk in enumerate(chunks):
-            score = float(sims[idx]) if idx < len(sims) else 0.0
+        for chunk in chunks:
+            score = score_by_id.get(chunk.chunk_id, 0.0)
             file_name = Path(chunk.path).name.lower()
             ql = query.lower()
             if ql and any(tok in file_name for tok in ql.split()):
                 score += 0.12
             if chunk.idx == 0:
                 score += 0.05
-            if preferred_doc_ids and chunk.doc_id in preferred_doc_ids and chunk.doc_id not in by_doc_first_seen:
+            if chunk.doc_id not in by_doc_first_seen:
                 score += 0.08
                 by_doc_first_seen.add(chunk.doc_id)
             snips.append(
@@ -267,39 +787,49 @@ class RagPipeline:
         if not self.enabled:
             return []
 
-        if not self.vindex.exists():
-            self.build_or_update_index()
+        # Building is the IndexScheduler's job (or warmup's); a chat turn never starts one.
         self._ensure_loaded()
+        if not self._loaded:
+            return []
+        with self._index_lock.read():
+            return self._retrieve(query, top_k, preferred_doc_ids)
 
+    def _retrieve(self, query: str, top_k: int | None, preferred_doc_ids: Optional[List[str]]) -> List[RagSnippet]:
         top_k = int(top_k or self.cfg.RAG.TOP_K)
         cand_k = int(max(top_k, self.cfg.RAG.CANDIDATES_K))
 
+        # BM25 over FTS5 runs on its own thread, overlapping query embedding and vector search.
+        lexical_k = int(self.cfg.RAG.LEXICAL_K)
+        lexical = None
+        if lexical_k > 0 and self.store.fts_enabled and not preferred_doc_ids:
+            lexical = self._lexical_pool.submit(self.store.search_fts, query, lexical_k)
+
+        qv = self.embedder.embed_sparse([query]) if self.sparse else self.embedder.embed([query])
         if preferred_doc_ids:
-            preferred_chunks = self.store.get_chunks_for_doc_ids(preferred_doc_ids)
-            preferred_snips = self._snippets_from_chunks(
-                query,
-                preferred_chunks,
-                top_k=top_k,
-                preferred_doc_ids=set(preferred_doc_ids),
-            )
+            preferred_snips = self._snippets_from_docs(query, qv, list(preferred_doc_ids), top_k=top_k, cand_k=cand_k)
             if preferred_snips:
                 return preferred_snips
+            if lexical_k > 0 and self.store.fts_enabled:
+                lexical = self._lexical_pool.submit(self.store.search_fts, query, lexical_k)
 
-        qv = self.embedder.embed([query])
         scores, id_lists = self.vindex.search(qv, k=cand_k)
-        if not id_lists or not id_lists[0]:
+        vector_ids = id_lists[0] if id_lists else []
+        score_by_id = {cid: float(scores[0][rank]) for rank, cid in enumerate(vector_ids)}
+        if lexical is not None:
+            score_by_id = _rrf_fuse([vector_ids, lexical.result()], k=self.cfg.RAG.RRF_K)
+        if not score_by_id:
             return []
 
-        cand_ids = id_lists[0]
+        cand_ids = sorted(score_by_id, key=score_by_id.__getitem__, reverse=True)
         cand_chunks = self.store.get_chunk_text_by_ids(cand_ids)
 
         by_id = {c.chunk_id: c for c in cand_chunks}
         snips: List[RagSnippet] = []
-        for rank, cid in enumerate(cand_ids):
+        for cid in cand_ids:
             c = by_id.get(cid)
             if c is None:
                 continue
-            score = float(scores[0][rank]) if scores.size else 0.0
+            score = score_by_id[cid]
             snips.append(
                 RagSnippet(
                     chunk_id=cid,
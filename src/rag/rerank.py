@@ -11,7 +11,7 @@ src/rag/rerank.py
 from __future__ import annotations
 
 import re
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from typing import List
 
 from src.rag.types import RagSnippet
@@ -41,7 +41,7 @@ class HybridReranker:
             if t:
                 overlap = len(q & t) / max(1, len(q))
             score = float(s.score) + self.alpha * float(overlap)
-            rescored.append(RagSnippet(s.chunk_id, s.doc_id, s.path, score, s.text, s.source_label, s.citation_id))
+            rescored.append(replace(s, score=score))
 
         rescored.sort(key=lambda x: x.score, reverse=True)
         return rescored
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sparse inverted index for bag-of-words embeddings (HashingEmbedder).
+src/rag/sparse_index.py
+
+Rows are kept as a CSC matrix (n_rows x n_features): each column is the posting list of
+one hashed feature, so a query only touches the postings of its own terms. Scores are the
+same inner products the dense index computes, at a fraction of the size.
+
+Files:
+- <index>.sparse.npz              base CSC data / indices / indptr / shape
+- <index>.sparse.ids.bin          base row ids (same format as the dense index)
+- <index>.sparse.segNNNNNN.npz    sealed CSR append segments (+ .ids.bin), one per save that added rows
+- <index>.sparse.del.npy          tombstoned rows
+- <index>.sparse.meta.json        dim / count / nnz / segments
+
+@author: LIU Ziyi
+@date: 2026-01-01
+@license: Apache-2.0
+"""
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+from src.rag.vector_index import (
+    _atomic_write,
+    _pad_scores,
+    _read_ids_bin,
+    _sorted_topk,
+    _write_ids_bin,
+    doc_id_of,
+    doc_row_index,
+)
+
+FORMAT_VERSION = 2
+
+
+class SparseIndex:
+    """
+    Mutable sparse index with the VectorIndex interface (build/add/remove_ids/search/save/load).
+
+    add() appends CSR rows to an in-memory tail and remove_ids() flags rows in a deletion
+    bitmap, as in the dense backend. save() seals the tail as a new CSR segment file, so a
+    small update writes only its own rows. Segments are folded into the CSC base once
+    tombstones exceed compact_ratio of all rows or more than max_segments segments exist.
+    """
+
+    def __init__(self, index_path: str, dim: int, compact_ratio: float = 0.2, max_segments: int = 16) -> None:
+        base = Path(index_path)
+        self.npz_path = base.with_name(base.name + ".sparse.npz")
+        self.ids_bin_path = base.with_name(base.name + ".sparse.ids.bin")
+        self.deleted_path = base.with_name(base.name + ".sparse.del.npy")
+        self.meta_path = base.with_name(base.name + ".sparse.meta.json")
+        self.dim = int(dim)
+        self.compact_ratio = float(compact_ratio)
+        self.max_segments = max(1, int(max_segments))
+        self._reset()
+
+    def _reset(self) -> None:
+        self._base = sp.csc_matrix((0, self.dim), dtype=np.float32)
+        self._segments: List[Tuple[str, sp.csr_matrix]] = []
+        self._next_segment = 1
+        self._tail: List[sp.csr_matrix] = []
+        self._tail_rows = 0
+        self._segments_stacked: Optional[sp.csr_matrix] = None  # sealed segments, for scoring
+        self._ids: List[str] = []
+        self._deleted = np.zeros(0, dtype=bool)  # tombstones; grown geometrically, may exceed len(_ids)
+        self._n_deleted = 0
+        self._row_of: Optional[Dict[str, int]] = None
+        self._doc_rows: Optional[Dict[str, List[int]]] = None
+        self._base_dirty = False
+
+    def exists(self) -> bool:
+        return self.npz_path.exists() and self.meta_path.exists()
+
+    def is_mutable(self) -> bool:
+        return True
+
+    def count(self) -> int:
+        return len(self._ids) - self._n_deleted
+
+    def _check(self, x: sp.spmatrix, ids: Optional[List[str]] = None) -> sp.csr_matrix:
+        if not sp.issparse(x):
+            raise ValueError("sparse index expects scipy sparse rows")
+        if x.shape[1] != self.dim:
+            raise ValueError(f"vector dim mismatch: got {x.shape[1]}, expected {self.dim}")
+        if ids is not None and len(ids) != x.shape[0]:
+            raise ValueError("ids length mismatch")
+        return sp.csr_matrix(x, dtype=np.float32)
+
+    def _row_index(self) -> Dict[str, int]:
+        if self._row_of is None:
+            deleted = self._deleted
+            self._row_of = {sid: i for i, sid in enumerate(self._ids) if not deleted[i]}
+        return self._row_of
+
+    def build(self, vectors: sp.spmatrix, ids: List[str]) -> None:
+        x = self._check(vectors, ids)
+        self._reset()
+        self._base = x.tocsc()
+        self._ids = list(ids)
+        self._deleted = np.zeros(len(self._ids), dtype=bool)
+        self._base_dirty = True
+
+    def build_from_batches(self, batches: Iterable[Tuple[sp.spmatrix, List[str]]], n_rows: int) -> None:
+        parts: List[sp.csr_matrix] = []
+        ids: List[str] = []
+        for vectors, batch_ids in batches:
+            parts.append(self._check(vectors, batch_ids))
+            ids.extend(batch_ids)
+        if len(ids) != n_rows:
+            raise ValueError(f"row count mismatch: {len(ids)} != {n_rows}")
+        x = sp.vstack(parts, format="csr") if parts else sp.csr_matrix((0, self.dim), dtype=np.float32)
+        self.build(x, ids)
+
+    def add(self, vectors: sp.spmatrix, ids: List[str]) -> None:
+        if not ids:
+            return
+        x = self._check(vectors, ids)
+        # Re-adding a live id replaces it.
+        self.remove_ids(ids)
+        first_row = len(self._ids)
+        self._tail.append(x)
+        self._tail_rows += x.shape[0]
+        needed = first_row + len(ids)
+        if needed > self._deleted.shape[0]:
+            grown = np.zeros(max(needed, 2 * self._deleted.shape[0], 1024), dtype=bool)
+            grown[:first_row] = self._deleted[:first_row]
+            self._deleted = grown
+        row_of = self._row_index()
+        for offset, sid in enumerate(ids):
+            row_of[sid] = first_row + offset
+        if self._doc_rows is not None:
+            for offset, sid in enumerate(ids):
+                self._doc_rows.setdefault(doc_id_of(sid), []).append(first_row + offset)
+        self._ids.extend(ids)
+
+    def remove_ids(self, ids: List[str]) -> None:
+        if not ids or not self._ids:
+            return
+        row_of = self._row_index()
+        rows = [row for row in (row_of.pop(sid, None) for sid in ids) if row is not None]
+        if rows:
+            self._deleted[np.asarray(rows, dtype=np.int64)] = True
+            self._n_deleted += len(rows)
+
+    def _scores(self, q: sp.csr_matrix) -> np.ndarray:
+        """Inner products of one query row with every row (tombstones included)."""
+        cols, vals = q.indices, q.data
+        out = np.zeros(len(self._ids), dtype=np.float32)
+        start = self._base.shape[0]
+        if cols.shape[0] and start:
+            # Column slice of a CSC matrix == the posting lists of the query terms.
+            out[:start] = self._base[:, cols] @ vals
+        if self._segments:
+            if self._segments_stacked is None:
+                self._segments_stacked = sp.vstack([m for _, m in self._segments], format="csr")
+            end = start + self._segments_stacked.shape[0]
+            out[start:end] = (self._segments_stacked @ q.T).toarray().ravel()
+            start = end
+        if self._tail_rows:
+            if len(self._tail) > 1:
+                # Merge the adds since the last search once; add() itself stays O(batch).
+                self._tail = [sp.vstack(self._tail, format="csr")]
+            out[start:] = (self._tail[0] @ q.T).toarray().ravel()
+        return out
+
+    def search(self, query_vectors: sp.spmatrix, k: int) -> Tuple[np.ndarray, List[List[str]]]:
+        q = self._check(query_vectors)
+        if k <= 0:
+            raise ValueError("k must be > 0")
+        n_live = self.count()
+        if n_live == 0:
+            return np.zeros((q.shape[0], 0), dtype=np.float32), [[] for _ in range(q.shape[0])]
+
+        k_eff = min(k, n_live)
+        score_rows: List[np.ndarray] = []
+        id_lists: List[List[str]] = []
+        for qi in range(q.shape[0]):
+            sims = self._scores(q[qi])
+            if self._n_deleted:
+                sims[self._deleted[:sims.shape[0]]] = -np.inf
+            rows, scores = _sorted_topk(sims[None, :], k_eff)
+            score_rows.append(scores[0])
+            id_lists.append([self._ids[int(i)] for i in rows[0]])
+        return _pad_scores(score_rows), id_lists
+
+    def search_docs(self, query_vectors: sp.spmatrix, k: int, doc_ids: Iterable[str]) -> Tuple[np.ndarray, List[List[str]]]:
+        """Search restricted to the chunks of the given doc_ids (see VectorIndex.search_docs)."""
+        q = self._check(query_vectors)
+        if self._doc_rows is None:
+            self._doc_rows = doc_row_index(self._ids)
+        rows = np.asarray(sorted(pos for doc_id in set(doc_ids) for pos in self._doc_rows.get(doc_id, [])), dtype=np.int64)
+        if self._n_deleted and rows.shape[0]:
+            rows = rows[~self._deleted[rows]]
+        if rows.shape[0] == 0:
+            return np.zeros((q.shape[0], 0), dtype=np.float32), [[] for _ in range(q.shape[0])]
+        sims = np.vstack([self._scores(q[qi])[rows] for qi in range(q.shape[0])])
+        top, scores = _sorted_topk(sims, k)
+        return scores, [[self._ids[int(rows[i])] for i in row] for row in top]
+
+    def compact(self) -> None:
+        """Fold segments and the tail into the base and drop tombstoned rows."""
+        rest = [m for _, m in self._segments] + self._tail
+        x = sp.vstack([self._base.tocsr()] + rest, format="csr") if rest else self._base.tocsr()
+        live = ~self._deleted[:len(self._ids)]
+        if self._n_deleted:
+            x = x[np.flatnonzero(live)]
+        ids = [sid for sid, ok in zip(self._ids, live.tolist()) if ok]
+        next_segment = self._next_segment
+        self.build(x, ids)
+        self._next_segment = next_segment
+
+    def _segment_path(self, name: str, suffix: str) -> Path:
+        return self.npz_path.parent / f"{name}{suffix}"
+
+    def _needs_compaction(self) -> bool:
+        n_rows = len(self._ids)
+        if self._base_dirty or n_rows == 0:
+            return False
+        if self._n_deleted > self.compact_ratio * n_rows:
+            return True
+        return len(self._segments) + (1 if self._tail_rows else 0) > self.max_segments
+
+    def _drop_stale_segment_files(self) -> None:
+        keep = {name for name, _ in self._segments}
+        base_name = self.npz_path.name[:-len(".npz")]
+        for p in self.npz_path.parent.glob(base_name + ".seg*"):
+            stem = p.name[:-len(".ids.bin")] if p.name.endswith(".ids.bin") else p.name[:-len(".npz")]
+            if stem not in keep:
+                p.unlink(missing_ok=True)
+
+    def save(self) -> None:
+        self.npz_path.parent.mkdir(parents=True, exist_ok=True)
+        if self._needs_compaction():
+            self.compact()
+        if (self._base_dirty or not self.npz_path.exists()) and (self._segments or self._tail_rows or self._n_deleted):
+            self.compact()
+
+        base = self._base
+        if self._base_dirty or not self.npz_path.exists():
+            base.sort_indices()
+            _atomic_write(self.npz_path, lambda f: np.savez(
+                f, data=base.data, indices=base.indices, indptr=base.indptr, shape=np.asarray(base.shape)))
+            _write_ids_bin(self.ids_bin_path, self._ids[:base.shape[0]])
+            self._base_dirty = False
+        if self._tail_rows:
+            # Seal the tail as a new immutable segment; existing files are not rewritten.
+            name = f"{self.npz_path.name[:-len('.npz')]}.seg{self._next_segment:06d}"
+            self._next_segment += 1
+            mat = sp.vstack(self._tail, format="csr")
+            mat.sort_indices()
+            _atomic_write(self._segment_path(name, ".npz"), lambda f: np.savez(
+                f, data=mat.data, indices=mat.indices, indptr=mat.indptr, shape=np.asarray(mat.shape)))
+            _write_ids_bin(self._segment_path(name, ".ids.bin"), self._ids[len(self._ids) - self._tail_rows:])
+            self._segments.append((name, mat))
+            self._segments_stacked = None
+            self._tail = []
+            self._tail_rows = 0
+        if self._n_deleted:
+            rows = np.flatnonzero(self._deleted[:len(self._ids)]).astype(np.int64)
+            _atomic_write(self.deleted_path, lambda f: np.lib.format.write_array(f, rows, allow_pickle=False))
+        elif self.deleted_path.exists():
+            self.deleted_path.unlink()
+
+        meta = {
+            "dim": self.dim,
+            "backend": "sparse",
+            "count": self.count(),
+            "nnz": int(base.nnz + sum(m.nnz for _, m in self._segments)),
+            "format_version": FORMAT_VERSION,
+            "base_rows": int(base.shape[0]),
+            "segments": [{"name": name, "rows": int(m.shape[0])} for name, m in self._segments],
+            "next_segment": self._next_segment,
+        }
+        _atomic_write(self.meta_path, lambda f: f.write(json.dumps(meta, ensure_ascii=False, indent=2).encode("utf-8")))
+        self._drop_stale_segment_files()
+
+    def load(self) -> None:
+        if not self.exists():
+            raise FileNotFoundError(f"missing sparse index files under {self.npz_path}")
+        meta = json.loads(self.meta_path.read_text(encoding="utf-8"))
+        self.dim = int(meta.get("dim", self.dim))
+        self._reset()
+        self._base = _load_npz(self.npz_path, sp.csc_matrix)
+        self._ids = _read_ids_bin(self.ids_bin_path)
+        if self._base.shape[0] != len(self._ids):
+            raise ValueError(f"sparse index rows/ids mismatch: {self._base.shape[0]} != {len(self._ids)}")
+        for seg in meta.get("segments", []):
+            name = str(seg["name"])
+            mat = _load_npz(self._segment_path(name, ".npz"), sp.csr_matrix)
+            seg_ids = _read_ids_bin(self._segment_path(name, ".ids.bin"))
+            if mat.shape[0] != len(seg_ids) or mat.shape[0] != int(seg.get("rows", mat.shape[0])):
+                raise ValueError(f"sparse index segment {name} is inconsistent")
+            self._segments.append((name, mat))
+            self._ids.extend(seg_ids)
+        self._next_segment = int(meta.get("next_segment", len(self._segments) + 1))
+        self._deleted = np.zeros(len(self._ids), dtype=bool)
+        if self.deleted_path.exists():
+            rows = np.load(self.deleted_path)
+            self._deleted[rows] = True
+            self._n_deleted = int(rows.shape[0])
+
+
+def _load_npz(path: Path, cls):
+    with np.load(path, allow_pickle=False) as data:
+        shape = tuple(int(v) for v in data["shape"])
+        return cls((data["data"], data["indices"], data["indptr"]), shape=shape)
@@ -32,6 +32,7 @@ class DocRecord:
     mtime: float
     sha1: str
     mime: str
+    size: int = -1  # bytes; -1 if unknown
 
 
 @dataclass(frozen=True)
@@ -44,3 +45,4 @@ class ChunkRecord:
     end: int
     text: str
     source_label: Optional[str] = None
+    content_hash: str = ""  # sha1 of text; "" for rows written before hashes were stored
@@ -6,6 +6,15 @@ src/rag/vector_index.py
 
 Supports incremental add/remove by stable string ids.
 
+numpy layout (format_version 4):
+- <index>                  base segment, raw .npy matrix opened with np.memmap (float32 or float16)
+- <index>.ids.bin          ids of the base segment: magic + uint64 count + uint64 offsets[count + 1] + utf-8 blob
+- <index>.segNNNNNN.npy    sealed append segments (+ .ids.bin), one per save that added rows
+- <index>.del.npy          tombstoned global row numbers (int64), masked at search time
+- <index>.meta.json        dim / metric / backend / dtype / count / segments
+
+Format 3 (base segment only) and the older npz format are still readable.
+
 @author: LIU Ziyi
 @date: 2026-01-01
 @license: Apache-2.0
@@ -14,11 +23,21 @@ from __future__ import annotations
 
 import hashlib
 import json
+import os
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import List, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import numpy as np
 
+from src.rag.ivf import IvfIndex
+
+FORMAT_VERSION = 4
+_IDS_MAGIC = b"MRIDS003"
+_SEARCH_BLOCK_BYTES = 32 * 1024 * 1024
+_STORE_DTYPES = {"float32": np.float32, "float16": np.float16}
+_INDEX_TYPES = ("flat", "ivf", "ivfpq")
+
 
 def _try_import_faiss():
     try:
@@ -28,28 +47,221 @@ def _try_import_faiss():
         return None
 
 
+def _atomic_write(path: Path, write: Callable[[object], None]) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _write_ids_bin(path: Path, ids: List[str]) -> None:
+    encoded = [sid.encode("utf-8") for sid in ids]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+    if encoded:
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+
+    def _write(f) -> None:
+        f.write(_IDS_MAGIC)
+        f.write(int(len(encoded)).to_bytes(8, "little"))
+        f.write(offsets.tobytes())
+        f.write(b"".join(encoded))
+
+    _atomic_write(path, _write)
+
+
+def _read_ids_bin(path: Path) -> List[str]:
+    raw = path.read_bytes()
+    if raw[:8] != _IDS_MAGIC:
+        raise ValueError(f"bad ids file: {path}")
+    count = int.from_bytes(raw[8:16], "little")
+    offsets = np.frombuffer(raw, dtype="<u8", count=count + 1, offset=16).tolist()
+    base = 16 + 8 * (count + 1)
+    blob = raw[base:]
+    return [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(count)]
+
+
+def _write_npy(path: Path, mat: np.ndarray) -> np.ndarray:
+    _atomic_write(path, lambda f: np.lib.format.write_array(f, np.ascontiguousarray(mat), allow_pickle=False))
+    return np.load(path, mmap_mode="r")
+
+
+def _sorted_topk(sims: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    k_eff = min(k, sims.shape[1])
+    idxs = np.argpartition(-sims, kth=k_eff - 1, axis=1)[:, :k_eff]
+    scores = np.take_along_axis(sims, idxs, axis=1)
+    order = np.argsort(-scores, axis=1, kind="stable")
+    return np.take_along_axis(idxs, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+
+def doc_id_of(chunk_id: str) -> str:
+    """Chunk ids are "<doc_id>:<idx>"."""
+    return chunk_id.rpartition(":")[0]
+
+
+def doc_row_index(ids: List[str]) -> Dict[str, List[int]]:
+    out: Dict[str, List[int]] = {}
+    for pos, sid in enumerate(ids):
+        out.setdefault(doc_id_of(sid), []).append(pos)
+    return out
+
+
+def _pad_scores(rows: List[np.ndarray]) -> np.ndarray:
+    width = max((r.shape[0] for r in rows), default=0)
+    out = np.full((len(rows), width), -np.inf, dtype=np.float32)
+    for qi, r in enumerate(rows):
+        out[qi, :r.shape[0]] = r
+    return out
+
+
+@dataclass(frozen=True)
+class _Rows:
+    """
+    One generation of the numpy backend's rows.
+
+    Writers build the next generation aside and publish it with a single assignment to
+    VectorIndex._rows; a search reads self._rows once, so row counts, ids, tombstones and
+    the IVF lists it sees always belong together. The only in-place writes land where an
+    older generation does not look: tail slots and ids past its row count, IVF rows past
+    its row count, and tombstone bits (a search that started before a removal may still
+    return the removed row). Readers therefore copy tombstone slices before masking with them.
+    """
+
+    base: Optional[np.ndarray]
+    segments: Tuple[Tuple[str, np.ndarray], ...]
+    tail: np.ndarray
+    tail_len: int
+    ids: List[str]  # global row -> string id, tombstoned rows included
+    deleted: np.ndarray  # tombstone bitmap; may be longer than n_rows
+    n_deleted: int
+    ivf: Optional[IvfIndex] = None
+
+    @property
+    def n_rows(self) -> int:
+        base = self.base.shape[0] if self.base is not None else 0
+        return base + sum(m.shape[0] for _, m in self.segments) + self.tail_len
+
+    def parts(self) -> Iterator[Tuple[int, np.ndarray]]:
+        """Yield (first global row, rows) for the base, each sealed segment, then the tail."""
+        start = 0
+        if self.base is not None:
+            yield start, self.base
+            start += self.base.shape[0]
+        for _, mat in self.segments:
+            yield start, mat
+            start += mat.shape[0]
+        if self.tail_len:
+            yield start, self.tail[:self.tail_len]
+
+    def gather(self, rows: np.ndarray) -> np.ndarray:
+        """Fetch sorted global rows as float32 across segments."""
+        out = np.empty((rows.shape[0], self.tail.shape[1]), dtype=np.float32)
+        for start, mat in self.parts():
+            lo, hi = np.searchsorted(rows, [start, start + mat.shape[0]])
+            if hi > lo:
+                out[lo:hi] = mat[rows[lo:hi] - start]
+        return out
+
+
 class VectorIndex:
     """
     If faiss is available -> store/load a mutable FAISS index with stable int64 ids.
-    Else -> store/load a numpy matrix and mutate by filtering/appending rows.
+    Else -> store/load numpy segments and mutate by appending rows / tombstoning rows.
+
+    numpy backend (LSM-style):
+    - immutable sealed segments (the base file plus one file per save that appended rows),
+      memory-mapped so startup does not depend on corpus size;
+    - a growable in-memory tail that receives add() and is sealed on save();
+    - a deletion bitmap over global rows, masked at search time.
+    add()/remove_ids() and save() cost O(changed rows). compact() rewrites live rows
+    into the base file; save() does it automatically once tombstones exceed
+    compact_ratio of all rows or more than max_segments segments exist.
+    The rows live in one _Rows generation, so searches need no lock against a single writer.
+
+    With faiss, removals are batched the same way and applied once per save().
+
+    index_type "ivf" / "ivfpq" adds an IVF (+ PQ) shortlist on top of the numpy rows
+    once there are at least ivf_min_rows live rows; candidates are always re-scored exactly.
 
     File name is kept as *.faiss for forward compatibility.
     """
 
-    def __init__(self, index_path: str, dim: int, metric: str = "ip") -> None:
+    def __init__(
+            self,
+            index_path: str,
+            dim: int,
+            metric: str = "ip",
+            store_dtype: str = "float32",
+            index_type: str = "flat",
+            nlist: int = 0,
+            nprobe: int = 16,
+            pq_m: int = 0,
+            ivf_min_rows: int = 20000,
+            rerank_factor: int = 10,
+            compact_ratio: float = 0.2,
+            max_segments: int = 16,
+    ) -> None:
         self.index_path = Path(index_path)
         self.meta_path = self.index_path.with_suffix(self.index_path.suffix + ".meta.json")
         self.ids_path = self.index_path.with_suffix(self.index_path.suffix + ".ids.txt")
+        self.ids_bin_path = self.index_path.with_suffix(self.index_path.suffix + ".ids.bin")
+        self.ivf_path = self.index_path.with_suffix(self.index_path.suffix + ".ivf.npz")
+        self.deleted_path = self.index_path.with_suffix(self.index_path.suffix + ".del.npy")
         self.dim = int(dim)
         self.metric = metric
+        if store_dtype not in _STORE_DTYPES:
+            raise ValueError(f"unknown index dtype: {store_dtype}")
+        if index_type not in _INDEX_TYPES:
+            raise ValueError(f"unknown index type: {index_type}")
+        self.store_dtype = store_dtype
+        self.index_type = index_type
+        self.nlist = int(nlist)
+        self.nprobe = int(nprobe)
+        self.pq_m = int(pq_m) if index_type == "ivfpq" else 0
+        self.ivf_min_rows = int(ivf_min_rows)
+        self.rerank_factor = max(1, int(rerank_factor))
+        self.compact_ratio = float(compact_ratio)
+        self.max_segments = max(1, int(max_segments))
         self._faiss = _try_import_faiss()
 
+        # faiss backend: string ids in insertion order (the numpy backend keeps them in _rows).
         self._ids: List[str] = []
-        self._mat: np.ndarray | None = None
         self._index = None
         self._legacy_positional_ids = False
         self._int_to_string: dict[int, str] = {}
         self._string_to_int: dict[str, int] = {}
+        self._faiss_pending_removal: set[int] = set()
+
+        self._reset_numpy()
+        self._ivf_dirty = False  # the IVF file must be rewritten in full (retrained / renumbered)
+        self._ivf_saved_rows = 0  # IVF rows already on disk (full file plus per-segment files)
+
+    def _empty_rows(self, ivf: Optional[IvfIndex] = None) -> _Rows:
+        return _Rows(
+            base=None,
+            segments=(),
+            tail=np.empty((0, self.dim), dtype=_STORE_DTYPES[self.store_dtype]),
+            tail_len=0,
+            ids=[],
+            deleted=np.zeros(0, dtype=bool),
+            n_deleted=0,
+            ivf=ivf,
+        )
+
+    def _reset_numpy(self, rows: Optional[_Rows] = None, next_segment: int = 1, base_dirty: bool = False) -> None:
+        """Publish a new generation of rows (default: empty) and drop the caches of the old one."""
+        self._rows = rows if rows is not None else self._empty_rows()
+        self._base_dirty = base_dirty
+        self._next_segment = next_segment
+        self._row_of: Optional[Dict[str, int]] = None
+        # (ids list, rows covered, doc_id -> positions); rebuilt when ids or row count move past it.
+        self._doc_rows: Optional[Tuple[List[str], int, Dict[str, List[int]]]] = None
+
+    @property
+    def ivf_nlist(self) -> int:
+        ivf = self._rows.ivf
+        return ivf.nlist if ivf is not None else 0
 
     def exists(self) -> bool:
         return self.index_path.exists() and self.meta_path.exists()
@@ -59,6 +271,36 @@ class VectorIndex:
             return not self._legacy_positional_ids
         return True
 
+    def count(self) -> int:
+        if self._faiss and self._index is not None:
+            return int(self._index.ntotal) - len(self._faiss_pending_removal)
+        rows = self._rows
+        return rows.n_rows - rows.n_deleted
+
+    def _row_index(self) -> Dict[str, int]:
+        """string id -> live global row; writer side only."""
+        if self._row_of is None:
+            rows = self._rows
+            deleted = rows.deleted
+            self._row_of = {sid: i for i, sid in enumerate(rows.ids) if not deleted[i]}
+        return self._row_of
+
+    def _doc_row_index(self, ids: List[str], n_rows: int) -> Dict[str, List[int]]:
+        """doc_id -> positions in ids (numpy: global rows; callers filter tombstones and rows >= n_rows)."""
+        cached = self._doc_rows
+        if cached is not None and cached[0] is ids and cached[1] >= n_rows:
+            return cached[2]
+        index = doc_row_index(ids[:n_rows])
+        self._doc_rows = (ids, n_rows, index)
+        return index
+
+    def _deleted_with_capacity(self, deleted: np.ndarray, n_rows: int) -> np.ndarray:
+        if deleted.shape[0] >= n_rows:
+            return deleted
+        grown = np.zeros(max(n_rows, 2 * deleted.shape[0], 1024), dtype=bool)
+        grown[:deleted.shape[0]] = deleted
+        return grown
+
     def _stable_int_id(self, string_id: str) -> int:
         existing = self._string_to_int.get(string_id)
         if existing is not None:
@@ -79,10 +321,58 @@ class VectorIndex:
                 candidate = 1
 
     def _reset_mappings(self) -> None:
+        self._doc_rows = None
         self._ids = []
         self._int_to_string = {}
         self._string_to_int = {}
         self._legacy_positional_ids = False
+        self._faiss_pending_removal = set()
+
+    def _maybe_train_ivf(self) -> None:
+        if self.index_type == "flat" or self.metric != "ip" or self._index is not None:
+            return
+        rows = self._rows
+        if rows.ivf is not None:
+            return
+        n_live = rows.n_rows - rows.n_deleted
+        if n_live < max(1, self.ivf_min_rows):
+            return
+        ivf = IvfIndex(dim=self.dim, nlist=self.nlist or IvfIndex.auto_nlist(n_live), pq_m=self.pq_m)
+        live_rows = np.flatnonzero(~rows.deleted[:rows.n_rows])
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(live_rows, size=ivf.train_size(n_live), replace=False))
+        ivf.train(rows.gather(sample_rows))
+        if ivf.nlist < 2:
+            return
+        for start, mat in rows.parts():
+            ivf.add(mat, first_row=start)
+        self._rows = replace(rows, ivf=ivf)
+        self._ivf_dirty = True
+
+    def _ivf_rows_path(self, segment: str) -> Path:
+        return self.index_path.parent / f"{segment}.ivf.npz"
+
+    def _save_ivf(self) -> None:
+        """
+        Persist the IVF after save() sealed the tail: rows added since the last write went
+        into the newest segment, so only their assignments are written, next to it.
+        """
+        rows = self._rows
+        ivf = rows.ivf
+        if ivf is None:
+            if self.ivf_path.exists():
+                self.ivf_path.unlink()
+            return
+        if ivf.n_rows == self._ivf_saved_rows and not self._ivf_dirty and self.ivf_path.exists():
+            return
+        newest = rows.segments[-1] if rows.segments else None
+        if self._ivf_dirty or not self.ivf_path.exists() or newest is None \
+                or rows.n_rows - newest[1].shape[0] != self._ivf_saved_rows:
+            ivf.save(self.ivf_path)
+            self._ivf_dirty = False
+        else:
+            ivf.save_rows(self._ivf_rows_path(newest[0]), self._ivf_saved_rows)
+        self._ivf_saved_rows = ivf.n_rows
 
     def _make_empty_faiss_index(self):
         if not self._faiss:
@@ -93,27 +383,165 @@ class VectorIndex:
             base = self._faiss.IndexFlatL2(self.dim)
         return self._faiss.IndexIDMap2(base)
 
+    def _flush_faiss_removals(self) -> None:
+        if not self._faiss_pending_removal or self._index is None:
+            return
+        # One linear pass over the flat index for all removals since the last flush.
+        self._index.remove_ids(np.asarray(sorted(self._faiss_pending_removal), dtype=np.int64))
+        self._faiss_pending_removal = set()
+
+    def _segment_name(self, seq: int) -> str:
+        return f"{self.index_path.name}.seg{seq:06d}"
+
+    def _needs_compaction(self) -> bool:
+        rows = self._rows
+        n_rows = rows.n_rows
+        if self._base_dirty or n_rows == 0:
+            return False
+        if rows.n_deleted > self.compact_ratio * n_rows:
+            return True
+        return len(rows.segments) + (1 if rows.tail_len else 0) > self.max_segments
+
+    def _write_meta(self, meta: dict) -> None:
+        _atomic_write(self.meta_path, lambda f: f.write(json.dumps(meta, ensure_ascii=False, indent=2).encode("utf-8")))
+
+    def _drop_stale_segment_files(self) -> None:
+        keep = {name for name, _ in self._rows.segments}
+        prefix = f"{self.index_path.name}.seg"
+        for p in self.index_path.parent.glob(prefix + "*"):
+            stem = next((p.name[:-len(s)] for s in (".ivf.npz", ".ids.bin", ".npy") if p.name.endswith(s)), p.name)
+            if stem not in keep:
+                p.unlink(missing_ok=True)
+
     def save(self) -> None:
         self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        is_faiss = bool(self._faiss and self._index is not None)
+
+        if is_faiss:
+            self._flush_faiss_removals()
+            self._ids = [sid for sid in dict.fromkeys(self._ids) if sid in self._string_to_int]
+            meta = {
+                "dim": self.dim,
+                "metric": self.metric,
+                "backend": "faiss",
+                "count": len(self._ids),
+                "format_version": 2,
+            }
+            self.meta_path.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+            self._faiss.write_index(self._index, str(self.index_path))
+            lines = [f"{self._string_to_int[sid]}\t{sid}" for sid in self._ids]
+            self.ids_path.write_text("\n".join(lines), encoding="utf-8")
+            return
+
+        if self._rows.base is None:
+            raise RuntimeError("cannot save: numpy matrix is empty")
+
+        store = _STORE_DTYPES[self.store_dtype]
+        if self._needs_compaction():
+            self.compact()
+        rows = self._rows
+        if self._base_dirty or not isinstance(rows.base, np.memmap) or rows.base.dtype != store:
+            if rows.segments or rows.tail_len or rows.n_deleted:
+                self.compact()
+            else:
+                base = _write_npy(self.index_path, np.asarray(rows.base, dtype=store))
+                _write_ids_bin(self.ids_bin_path, rows.ids)
+                self._rows = replace(rows, base=base)
+                self._base_dirty = False
+        rows = self._rows
+        if rows.tail_len:
+            # Seal the tail as a new immutable segment; existing files are not rewritten.
+            name = self._segment_name(self._next_segment)
+            self._next_segment += 1
+            first_row = rows.n_rows - rows.tail_len
+            mat = _write_npy(self.index_path.parent / f"{name}.npy", rows.tail[:rows.tail_len])
+            _write_ids_bin(self.index_path.parent / f"{name}.ids.bin", rows.ids[first_row:])
+            self._rows = rows = replace(
+                rows,
+                segments=rows.segments + ((name, mat),),
+                tail=np.empty((0, self.dim), dtype=store),
+                tail_len=0,
+            )
+
+        if rows.n_deleted:
+            deleted_rows = np.flatnonzero(rows.deleted[:rows.n_rows]).astype(np.int64)
+            _atomic_write(self.deleted_path, lambda f: np.lib.format.write_array(f, deleted_rows, allow_pickle=False))
+        elif self.deleted_path.exists():
+            self.deleted_path.unlink()
+        self._save_ivf()
+
         meta = {
             "dim": self.dim,
             "metric": self.metric,
-            "backend": "faiss" if self._faiss and self._index is not None else "numpy",
-            "count": len(self._ids),
-            "format_version": 2,
+            "backend": "numpy",
+            "count": self.count(),
+            "format_version": FORMAT_VERSION,
+            "dtype": self.store_dtype,
+            "index_type": self.index_type if rows.ivf is not None else "flat",
+            "pq_m": self.pq_m if rows.ivf is not None else 0,
+            "base_rows": int(rows.base.shape[0]),
+            "segments": [{"name": name, "rows": int(mat.shape[0])} for name, mat in rows.segments],
+            "next_segment": self._next_segment,
+            "deleted": rows.n_deleted,
         }
-        self.meta_path.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+        self._write_meta(meta)
+        self._drop_stale_segment_files()
 
+    def compact(self) -> None:
+        """
+        Merge all segments and the tail into a single base segment, dropping tombstones.
+
+        For a saved index the merge streams into a new base file (bounded memory), then
+        save() records the new layout; in-memory indexes are merged in memory.
+        """
         if self._faiss and self._index is not None:
-            self._faiss.write_index(self._index, str(self.index_path))
-            lines = [f"{self._string_to_int[sid]}\t{sid}" for sid in self._ids]
-            self.ids_path.write_text("\n".join(lines), encoding="utf-8")
+            self._flush_faiss_removals()
             return
+        rows = self._rows
+        n_rows = rows.n_rows
+        live = ~rows.deleted[:n_rows]
+        n_live = int(live.sum())
+        store = _STORE_DTYPES[self.store_dtype]
+
+        on_disk = self.meta_path.exists()
+        if on_disk:
+            tmp = self.index_path.with_name(self.index_path.name + ".compact.tmp")
+            out = np.lib.format.open_memmap(tmp, mode="w+", dtype=store, shape=(n_live, self.dim))
+        else:
+            out = np.empty((n_live, self.dim), dtype=store)
+        pos = 0
+        for start, mat in rows.parts():
+            keep = live[start:start + mat.shape[0]]
+            n_keep = int(keep.sum())
+            if n_keep:
+                out[pos:pos + n_keep] = mat[keep] if n_keep < mat.shape[0] else mat
+                pos += n_keep
+        ids = [sid for sid, ok in zip(rows.ids, live.tolist()) if ok]
+
+        ivf = rows.ivf
+        if ivf is not None:
+            # Renumbered into a new index; searches still running on the old generation keep the old lists.
+            ivf = ivf.kept(np.flatnonzero(live))
+            self._ivf_dirty = True
+
+        if on_disk:
+            out.flush()
+            del out
+            os.replace(tmp, self.index_path)
+            _write_ids_bin(self.ids_bin_path, ids)
+            base = np.load(self.index_path, mmap_mode="r")
+            base_dirty = False
+        else:
+            base = out
+            base_dirty = True
 
-        if self._mat is None:
-            raise RuntimeError("cannot save: numpy matrix is empty")
-        with self.index_path.open("wb") as f:
-            np.savez_compressed(f, mat=self._mat, ids=np.asarray(self._ids, dtype=object))
+        compacted = replace(
+            self._empty_rows(ivf=ivf),
+            base=base,
+            ids=ids,
+            deleted=np.zeros(n_live, dtype=bool),
+        )
+        self._reset_numpy(compacted, next_segment=self._next_segment, base_dirty=base_dirty)
 
     def load(self) -> None:
         if not self.exists():
@@ -127,8 +555,8 @@ class VectorIndex:
         self._reset_mappings()
 
         if self._faiss and backend == "faiss":
+            self._reset_numpy()
             self._index = self._faiss.read_index(str(self.index_path))
-            self._mat = None
             raw_lines = self.ids_path.read_text(encoding="utf-8").splitlines() if self.ids_path.exists() else []
             if raw_lines and all("\t" in line for line in raw_lines):
                 ordered: list[tuple[int, str]] = []
@@ -145,15 +573,73 @@ class VectorIndex:
                 self._legacy_positional_ids = True
             return
 
-        with self.index_path.open("rb") as f:
-            data = np.load(f, allow_pickle=True)
-            mat = data["mat"].astype(np.float32, copy=False)
-            ids = [str(x) for x in data["ids"].tolist()]
-        self._mat = mat
         self._index = None
-        self._ids = ids
-        for sid in self._ids:
-            self._stable_int_id(sid)
+        version = int(meta.get("format_version", 2))
+        segments: List[Tuple[str, np.ndarray]] = []
+        n_deleted = 0
+        if version >= 3:
+            base = np.load(self.index_path, mmap_mode="r")
+            ids = _read_ids_bin(self.ids_bin_path)
+            if base.shape[0] != len(ids):
+                raise ValueError(f"index rows/ids mismatch: {base.shape[0]} != {len(ids)}")
+            for seg in meta.get("segments", []) if version >= 4 else []:
+                name = str(seg["name"])
+                mat = np.load(self.index_path.parent / f"{name}.npy", mmap_mode="r")
+                seg_ids = _read_ids_bin(self.index_path.parent / f"{name}.ids.bin")
+                if mat.shape[0] != len(seg_ids) or mat.shape[0] != int(seg.get("rows", mat.shape[0])):
+                    raise ValueError(f"index segment {name} is inconsistent")
+                segments.append((name, mat))
+                ids.extend(seg_ids)
+            deleted = np.zeros(len(ids), dtype=bool)
+            if version >= 4 and self.deleted_path.exists():
+                dead_rows = np.load(self.deleted_path)
+                deleted[dead_rows] = True
+                n_deleted = int(dead_rows.shape[0])
+            base_dirty = False
+        else:
+            # Legacy npz (format_version <= 2): decompress once, rewritten on next save.
+            with self.index_path.open("rb") as f:
+                data = np.load(f, allow_pickle=True)
+                base = data["mat"].astype(np.float32, copy=False)
+                ids = [str(x) for x in data["ids"].tolist()]
+            deleted = np.zeros(len(ids), dtype=bool)
+            base_dirty = True
+        loaded = replace(self._empty_rows(), base=base, segments=tuple(segments), ids=ids, deleted=deleted, n_deleted=n_deleted)
+        self._reset_numpy(loaded, next_segment=int(meta.get("next_segment", len(segments) + 1)), base_dirty=base_dirty)
+
+        self._ivf_dirty = False
+        self._ivf_saved_rows = 0
+        if self.index_type == "flat":
+            return
+        saved_type = str(meta.get("index_type", "flat"))
+        if saved_type == self.index_type and int(meta.get("pq_m", 0)) == self.pq_m and self.ivf_path.exists():
+            ivf = self._load_ivf(loaded)
+            if ivf is not None and ivf.n_rows == loaded.n_rows:
+                self._rows = replace(loaded, ivf=ivf)
+                self._ivf_saved_rows = ivf.n_rows
+                return
+        # Index type changed (or sidecar missing): train once and persist only the sidecar.
+        self._maybe_train_ivf()
+        if self._rows.ivf is not None and not self._base_dirty:
+            self._save_ivf()
+            meta["index_type"] = self.index_type
+            meta["pq_m"] = self.pq_m
+            self._write_meta(meta)
+
+    def _load_ivf(self, rows: _Rows) -> Optional[IvfIndex]:
+        """The full IVF file plus the row files of the segments sealed after it; None if one is missing."""
+        with np.load(self.ivf_path, allow_pickle=False) as data:
+            covered = int(data["assign"].shape[0])
+        row_files: List[Path] = []
+        start = int(rows.base.shape[0])
+        for name, mat in rows.segments:
+            if start >= covered:
+                path = self._ivf_rows_path(name)
+                if not path.exists():
+                    return None
+                row_files.append(path)
+            start += mat.shape[0]
+        return IvfIndex.load(self.ivf_path, dim=self.dim, row_files=row_files)
 
     def build(self, vectors: np.ndarray, ids: List[str]) -> None:
         if vectors.ndim != 2:
@@ -164,9 +650,10 @@ class VectorIndex:
             raise ValueError("ids length mismatch")
 
         self._reset_mappings()
-        self._ids = list(ids)
 
         if self._faiss:
+            self._reset_numpy()
+            self._ids = list(ids)
             idx = self._make_empty_faiss_index()
             if idx is None:
                 raise RuntimeError("failed to create faiss index")
@@ -174,13 +661,73 @@ class VectorIndex:
                 int_ids = np.asarray([self._stable_int_id(sid) for sid in ids], dtype=np.int64)
                 idx.add_with_ids(vectors.astype(np.float32, copy=False), int_ids)
             self._index = idx
-            self._mat = None
             return
 
-        self._mat = vectors.astype(np.float32, copy=False)
+        built = replace(
+            self._empty_rows(),
+            base=vectors.astype(np.float32, copy=False),
+            ids=list(ids),
+            deleted=np.zeros(len(ids), dtype=bool),
+        )
         self._index = None
-        for sid in self._ids:
-            self._stable_int_id(sid)
+        self._reset_numpy(built, base_dirty=True)
+        self._maybe_train_ivf()
+
+    def build_from_batches(self, batches: Iterable[Tuple[np.ndarray, List[str]]], n_rows: int) -> None:
+        """
+        Like build(), but consumes (vectors, ids) batches so memory stays O(batch).
+
+        The numpy backend streams rows straight into a new memory-mapped base file; call
+        save() afterwards to write the metadata. n_rows must be the total row count.
+        """
+        self._reset_mappings()
+
+        if self._faiss:
+            self._reset_numpy()
+            idx = self._make_empty_faiss_index()
+            if idx is None:
+                raise RuntimeError("failed to create faiss index")
+            for vectors, ids in batches:
+                int_ids = np.asarray([self._stable_int_id(sid) for sid in ids], dtype=np.int64)
+                idx.add_with_ids(vectors.astype(np.float32, copy=False), int_ids)
+                self._ids.extend(ids)
+            self._index = idx
+            return
+
+        self._index = None
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.index_path.with_name(self.index_path.name + ".build.tmp")
+        out = np.lib.format.open_memmap(tmp, mode="w+", dtype=_STORE_DTYPES[self.store_dtype], shape=(n_rows, self.dim))
+        all_ids: List[str] = []
+        pos = 0
+        for vectors, ids in batches:
+            if vectors.ndim != 2 or vectors.shape[1] != self.dim:
+                raise ValueError(f"vector dim mismatch: got {vectors.shape}, expected (*, {self.dim})")
+            if len(ids) != vectors.shape[0]:
+                raise ValueError("ids length mismatch")
+            if pos + len(ids) > n_rows:
+                raise ValueError(f"more rows than announced: > {n_rows}")
+            out[pos:pos + len(ids)] = vectors
+            pos += len(ids)
+            all_ids.extend(ids)
+        if pos != n_rows:
+            raise ValueError(f"fewer rows than announced: {pos} != {n_rows}")
+        out.flush()
+        del out
+        # The old index stays valid on disk while the new one is written. Once the base is
+        # replaced the old metadata no longer describes the files; without it the index
+        # reads as missing (-> full rebuild) if we die before save().
+        self.meta_path.unlink(missing_ok=True)
+        os.replace(tmp, self.index_path)
+        _write_ids_bin(self.ids_bin_path, all_ids)
+        built = replace(
+            self._empty_rows(),
+            base=np.load(self.index_path, mmap_mode="r"),
+            ids=all_ids,
+            deleted=np.zeros(n_rows, dtype=bool),
+        )
+        self._reset_numpy(built)
+        self._maybe_train_ivf()
 
     def add(self, vectors: np.ndarray, ids: List[str]) -> None:
         if not ids:
@@ -198,47 +745,67 @@ class VectorIndex:
             if self._legacy_positional_ids:
                 raise RuntimeError("legacy faiss index does not support incremental mutation")
             int_ids = np.asarray([self._stable_int_id(sid) for sid in ids], dtype=np.int64)
+            if self._faiss_pending_removal.intersection(int_ids.tolist()):
+                self._flush_faiss_removals()
             self._index.add_with_ids(vectors.astype(np.float32, copy=False), int_ids)
             self._ids.extend(ids)
+            self._doc_rows = None
             return
 
-        if self._mat is None:
-            self._mat = np.empty((0, self.dim), dtype=np.float32)
-        self._mat = np.concatenate([self._mat, vectors.astype(np.float32, copy=False)], axis=0)
-        self._ids.extend(ids)
-        for sid in ids:
-            self._stable_int_id(sid)
+        # Re-adding a live id replaces it: the old row becomes a tombstone.
+        self.remove_ids(ids)
+
+        rows = self._rows
+        n_new = vectors.shape[0]
+        first_row = rows.n_rows
+        base = rows.base if rows.base is not None else np.empty((0, self.dim), dtype=np.float32)
+        tail = rows.tail
+        needed = rows.tail_len + n_new
+        if needed > tail.shape[0]:
+            tail = np.empty((max(needed, 2 * tail.shape[0], 256), self.dim), dtype=rows.tail.dtype)
+            tail[:rows.tail_len] = rows.tail[:rows.tail_len]
+        tail[rows.tail_len:needed] = vectors
+        deleted = self._deleted_with_capacity(rows.deleted, first_row + n_new)
+        row_of = self._row_index()
+        rows.ids.extend(ids)
+        if rows.ivf is not None:
+            rows.ivf.add(vectors, first_row=first_row)
+
+        for offset, sid in enumerate(ids):
+            row_of[sid] = first_row + offset
+        cached = self._doc_rows
+        if cached is not None and cached[0] is rows.ids and cached[1] == first_row:
+            for offset, sid in enumerate(ids):
+                cached[2].setdefault(doc_id_of(sid), []).append(first_row + offset)
+            self._doc_rows = (rows.ids, first_row + n_new, cached[2])
+
+        self._rows = replace(rows, base=base, tail=tail, tail_len=needed, deleted=deleted)
+        self._maybe_train_ivf()
 
     def remove_ids(self, ids: List[str]) -> None:
         if not ids:
             return
-        id_set = set(ids)
 
         if self._faiss:
             if self._index is None:
                 return
             if self._legacy_positional_ids:
                 raise RuntimeError("legacy faiss index does not support incremental mutation")
-            int_ids = [self._string_to_int[sid] for sid in ids if sid in self._string_to_int]
-            if int_ids:
-                arr = np.asarray(int_ids, dtype=np.int64)
-                self._index.remove_ids(arr)
-            self._ids = [sid for sid in self._ids if sid not in id_set]
             for sid in ids:
                 int_id = self._string_to_int.pop(sid, None)
                 if int_id is not None:
                     self._int_to_string.pop(int_id, None)
+                    self._faiss_pending_removal.add(int_id)
             return
 
-        if self._mat is None or not self._ids:
+        rows = self._rows
+        if not rows.ids:
             return
-        keep_idx = [i for i, sid in enumerate(self._ids) if sid not in id_set]
-        self._mat = self._mat[np.asarray(keep_idx, dtype=np.int64)] if keep_idx else np.empty((0, self.dim), dtype=np.float32)
-        self._ids = [self._ids[i] for i in keep_idx]
-        for sid in ids:
-            int_id = self._string_to_int.pop(sid, None)
-            if int_id is not None:
-                self._int_to_string.pop(int_id, None)
+        row_of = self._row_index()
+        dead = [row for row in (row_of.pop(sid, None) for sid in ids) if row is not None]
+        if dead:
+            rows.deleted[np.asarray(dead, dtype=np.int64)] = True
+            self._rows = replace(rows, n_deleted=rows.n_deleted + len(dead))
 
     def search(self, query_vectors: np.ndarray, k: int) -> Tuple[np.ndarray, List[List[str]]]:
         if query_vectors.ndim != 2:
@@ -249,45 +816,133 @@ class VectorIndex:
             raise ValueError("k must be > 0")
 
         if self._faiss and self._index is not None:
-            scores, idxs = self._index.search(query_vectors.astype(np.float32, copy=False), k)
+            pending = self._faiss_pending_removal
+            k_query = min(k + len(pending), max(1, int(self._index.ntotal)))
+            scores, idxs = self._index.search(query_vectors.astype(np.float32, copy=False), k_query)
+            score_rows: List[np.ndarray] = []
             id_lists: List[List[str]] = []
-            for row in idxs:
+            for qi, row in enumerate(idxs):
                 row_ids: List[str] = []
-                for raw_id in row:
+                row_scores: List[float] = []
+                for pos, raw_id in enumerate(row):
                     idx = int(raw_id)
-                    if idx < 0:
+                    if idx < 0 or idx in pending or len(row_ids) >= k:
                         continue
                     if self._legacy_positional_ids:
                         if 0 <= idx < len(self._ids):
                             row_ids.append(self._ids[idx])
+                            row_scores.append(float(scores[qi][pos]))
                         continue
                     sid = self._int_to_string.get(idx)
                     if sid:
                         row_ids.append(sid)
+                        row_scores.append(float(scores[qi][pos]))
                 id_lists.append(row_ids)
-            return scores, id_lists
+                score_rows.append(np.asarray(row_scores, dtype=np.float32))
+            return _pad_scores(score_rows), id_lists
 
-        if self._mat is None:
+        rows = self._rows
+        if rows.base is None:
             raise RuntimeError("index not loaded")
-        if self._mat.shape[0] == 0:
+        n_live = rows.n_rows - rows.n_deleted
+        if n_live == 0:
             return np.zeros((query_vectors.shape[0], 0), dtype=np.float32), [[] for _ in range(query_vectors.shape[0])]
 
-        sims = query_vectors.astype(np.float32, copy=False) @ self._mat.T
-        k_eff = min(k, sims.shape[1])
-        idxs = np.argpartition(-sims, kth=k_eff - 1, axis=1)[:, :k_eff]
-
-        sorted_rows = []
-        sorted_scores = []
-        for qi in range(idxs.shape[0]):
-            row = idxs[qi]
-            row_scores = sims[qi, row]
-            order = np.argsort(-row_scores)
-            row = row[order]
-            row_scores = row_scores[order]
-            sorted_rows.append(row)
-            sorted_scores.append(row_scores)
-
-        idxs2 = np.stack(sorted_rows, axis=0)
-        scores2 = np.stack(sorted_scores, axis=0)
-        id_lists = [[self._ids[i] for i in row] for row in idxs2]
-        return scores2, id_lists
+        q = query_vectors.astype(np.float32, copy=False)
+        if rows.ivf is not None and self.nprobe < rows.ivf.nlist:
+            return self._search_ivf(rows, q, k)
+
+        itemsize = np.dtype(np.float32).itemsize
+        block = max(1024, _SEARCH_BLOCK_BYTES // max(1, self.dim * itemsize))
+
+        # Score every segment in row blocks so that neither an upcast copy of a mmapped /
+        # float16 segment nor the full similarity row is materialized at once.
+        best_rows: np.ndarray | None = None
+        best_scores: np.ndarray | None = None
+        for seg_start, mat in rows.parts():
+            for offset in range(0, mat.shape[0], block):
+                part = np.asarray(mat[offset:offset + block], dtype=np.float32)
+                if part.shape[0] == 0:
+                    continue
+                start = seg_start + offset
+                sims = q @ part.T
+                if rows.n_deleted:
+                    # Copy: remove_ids() may flip bits while numpy applies the mask.
+                    dead = rows.deleted[start:start + part.shape[0]].copy()
+                    if dead.any():
+                        sims[:, dead] = -np.inf
+                top, scores = _sorted_topk(sims, k)
+                top = top + start
+                if best_rows is None or best_scores is None:
+                    best_rows, best_scores = top, scores
+                    continue
+                merged_rows = np.concatenate([best_rows, top], axis=1)
+                merged_scores = np.concatenate([best_scores, scores], axis=1)
+                pick, best_scores = _sorted_topk(merged_scores, k)
+                best_rows = np.take_along_axis(merged_rows, pick, axis=1)
+
+        assert best_rows is not None and best_scores is not None
+        k_eff = min(k, n_live)
+        best_rows, best_scores = best_rows[:, :k_eff], best_scores[:, :k_eff]
+        id_lists = [[rows.ids[int(i)] for i in row] for row in best_rows]
+        return best_scores, id_lists
+
+    def _search_ivf(self, rows: _Rows, q: np.ndarray, k: int) -> Tuple[np.ndarray, List[List[str]]]:
+        assert rows.ivf is not None
+        shortlist = max(k, k * self.rerank_factor)
+        # Bounded by this generation's row count: the IVF lists may already hold newer rows.
+        deleted = rows.deleted[:rows.n_rows]
+        score_rows: List[np.ndarray] = []
+        id_lists: List[List[str]] = []
+        for qi in range(q.shape[0]):
+            cand = np.sort(rows.ivf.candidates(q[qi], nprobe=self.nprobe, shortlist=shortlist, deleted=deleted))
+            if cand.shape[0] == 0:
+                score_rows.append(np.zeros(0, dtype=np.float32))
+                id_lists.append([])
+                continue
+            # Exact re-scoring of the shortlist against the stored (possibly mmapped) rows.
+            sims = rows.gather(cand) @ q[qi]
+            top, scores = _sorted_topk(sims[None, :], k)
+            score_rows.append(scores[0])
+            id_lists.append([rows.ids[int(cand[i])] for i in top[0]])
+        return _pad_scores(score_rows), id_lists
+
+    def search_docs(self, query_vectors: np.ndarray, k: int, doc_ids: Iterable[str]) -> Tuple[np.ndarray, List[List[str]]]:
+        """
+        Exact search restricted to the chunks of the given doc_ids, scored against the stored
+        vectors (nothing is re-embedded). Same return shape as search().
+        """
+        if query_vectors.ndim != 2 or query_vectors.shape[1] != self.dim:
+            raise ValueError(f"query dim mismatch: got {query_vectors.shape}, expected (*, {self.dim})")
+        q = query_vectors.astype(np.float32, copy=False)
+
+        if self._faiss and self._index is not None:
+            doc_rows = self._doc_row_index(self._ids, len(self._ids))
+            positions = sorted(pos for doc_id in set(doc_ids) for pos in doc_rows.get(doc_id, []))
+            if self._legacy_positional_ids:
+                ids = [self._ids[pos] for pos in positions]
+                vecs = np.vstack([self._index.reconstruct(pos) for pos in positions]) if positions else None
+            else:
+                ids = list(dict.fromkeys(self._ids[pos] for pos in positions if self._ids[pos] in self._string_to_int))
+                vecs = np.vstack([self._index.reconstruct(self._string_to_int[sid]) for sid in ids]) if ids else None
+        else:
+            rows = self._rows
+            n_rows = rows.n_rows
+            doc_rows = self._doc_row_index(rows.ids, n_rows)
+            positions = sorted(pos for doc_id in set(doc_ids) for pos in doc_rows.get(doc_id, []) if pos < n_rows)
+            sel = np.asarray(positions, dtype=np.int64)
+            if rows.n_deleted and sel.shape[0]:
+                sel = sel[~rows.deleted[sel]]
+            ids = [rows.ids[int(i)] for i in sel]
+            vecs = rows.gather(sel) if sel.shape[0] else None
+
+        if vecs is None:
+            return np.zeros((q.shape[0], 0), dtype=np.float32), [[] for _ in range(q.shape[0])]
+        top, scores = _sorted_topk(q @ vecs.T, k)
+        return scores, [[ids[int(i)] for i in row] for row in top]
+
+    def live_vectors(self) -> Tuple[np.ndarray, List[str]]:
+        """Materialize live numpy rows as float32 (for benchmarks and tooling, not the hot path)."""
+        rows = self._rows
+        live = np.flatnonzero(~rows.deleted[:rows.n_rows])
+        return rows.gather(live), [rows.ids[int(i)] for i in live]
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Filesystem watcher for continuous incremental indexing.
+src/rag/watcher.py
+
+DocWatcher follows the roots of DOCS_GLOBS and hands batches of changed paths to a callback,
+normally RagPipeline.index_paths. On Linux it uses inotify through ctypes, so an idle
+watcher sleeps in select() and costs no CPU. Elsewhere, or when inotify is unavailable or
+out of watches, it polls file stats with the same scandir scan build-index uses.
+
+Events are debounced: a batch is flushed once no event arrived for debounce_s, or after
+max_delay_s of continuous activity. A lost-event condition (inotify queue overflow) is
+reported through on_overflow so the caller can fall back to a full rescan.
+
+@author: LIU Ziyi
+@date: 2026-01-01
+@license: Apache-2.0
+"""
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import glob
+import logging
+import os
+import re
+import select
+import struct
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from src.config import AppConfig
+from src.rag.fs_scan import scan_doc_files
+
+logger = logging.getLogger("rag_watcher")
+
+# <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0o2000000)
+
+_WATCH_MASK = (
+        IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len; followed by len bytes of name
+
+# (changed paths, events were lost)
+PollResult = Tuple[List[str], bool]
+
+
+def _glob_to_regex(pattern: str) -> str:
+    """Translate a relative glob (with `**`) into a regex with glob's path semantics."""
+    out: List[str] = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:[^/]*/)*")
+            i += 3
+        elif pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+        elif c == "*":
+            out.append("[^/]*")
+            i += 1
+        elif c == "?":
+            out.append("[^/]")
+            i += 1
+        elif c == "[" and "]" in pattern[i + 2:]:
+            j = pattern.index("]", i + 2)
+            body = pattern[i + 1:j]
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            out.append("[" + body.replace("\\", "\\\\") + "]")
+            i = j + 1
+        else:
+            out.append(re.escape(c))
+            i += 1
+    return "".join(out)
+
+
+@dataclass(frozen=True)
+class WatchRoot:
+    path: str  # resolved directory holding everything the pattern can match
+    recursive: bool  # the pattern reaches below `path`
+    regex: re.Pattern
+
+
+def watch_roots(patterns: Sequence[str]) -> List[WatchRoot]:
+    """Split each glob into its literal directory prefix (to watch) and a matcher for the rest."""
+    roots: List[WatchRoot] = []
+    for pat in patterns:
+        if not pat:
+            continue
+        pat = os.path.abspath(os.path.expanduser(os.path.expandvars(pat)))
+        parts = pat.split(os.sep)
+        magic = next((i for i, part in enumerate(parts) if glob.has_magic(part)), None)
+        if magic is None:
+            root, rest = os.path.split(pat)
+        else:
+            root, rest = os.sep.join(parts[:magic]) or os.sep, "/".join(parts[magic:])
+        real = os.path.realpath(root)
+        regex = re.compile(re.escape(real.rstrip(os.sep)) + "/" + _glob_to_regex(rest) + r"\Z")
+        roots.append(WatchRoot(path=real, recursive="/" in rest or "**" in rest, regex=regex))
+    return roots
+
+
+class _PathFilter:
+    def __init__(self, roots: List[WatchRoot], exts: Optional[Sequence[str]]) -> None:
+        self.roots = roots
+        self.exts = {e.lower() if e.startswith(".") else f".{e.lower()}" for e in exts} if exts else None
+
+    def _root_of(self, path: str) -> Optional[WatchRoot]:
+        for root in self.roots:
+            if path.startswith(root.path.rstrip(os.sep) + os.sep):
+                return root
+        return None
+
+    def wants_file(self, path: str) -> bool:
+        root = self._root_of(path)
+        if root is None:
+            return False
+        # Like glob, skip hidden files and directories (editor swap files, .git, ...).
+        if any(part.startswith(".") for part in path[len(root.path):].split(os.sep)):
+            return False
+        if self.exts is not None and os.path.splitext(path)[1].lower() not in self.exts:
+            return False
+        return any(r.regex.match(path) for r in self.roots)
+
+    def wants_dir(self, path: str) -> bool:
+        root = self._root_of(path)
+        return root is not None and root.recursive \
+            and not any(part.startswith(".") for part in path[len(root.path):].split(os.sep))
+
+
+class _InotifyBackend:
+    def __init__(self, roots: List[WatchRoot], path_filter: _PathFilter, wake_fd: int) -> None:
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._add_watch.restype = ctypes.c_int
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.filter = path_filter
+        self.wake_fd = wake_fd
+        self._dirs: Dict[int, Tuple[str, bool]] = {}  # wd -> (directory, watch its subdirectories)
+        try:
+            for root in roots:
+                if os.path.isdir(root.path):
+                    self._watch_tree(root.path, root.recursive)
+                else:
+                    logger.warning("Watch root does not exist: %s", root.path)
+        except OSError:
+            self.close()
+            raise
+
+    def _watch(self, directory: str, recursive: bool) -> None:
+        wd = self._add_watch(self.fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_add_watch({directory}): {os.strerror(err)}")
+        self._dirs[wd] = (directory, recursive)
+
+    def _watch_tree(self, directory: str, recursive: bool, files: Optional[List[str]] = None) -> None:
+        """Watch a directory (and, if recursive, its subdirectories); optionally list its files."""
+        self._watch(directory, recursive)
+        if not recursive and files is None:
+            return
+        for dirpath, dirnames, filenames in os.walk(directory):
+            if recursive:
+                dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+                for d in dirnames:
+                    self._watch(os.path.join(dirpath, d), True)
+            else:
+                dirnames[:] = []
+            if files is not None:
+                files.extend(p for p in (os.path.join(dirpath, f) for f in filenames) if self.filter.wants_file(p))
+
+    def poll(self, timeout: Optional[float]) -> PollResult:
+        ready, _, _ = select.select([self.fd, self.wake_fd], [], [], timeout)
+        if self.fd not in ready:
+            return [], False
+        changed: List[str] = []
+        overflow = False
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            off = 0
+            while off + _EVENT.size <= len(buf):
+                wd, mask, _, name_len = _EVENT.unpack_from(buf, off)
+                name = buf[off + _EVENT.size:off + _EVENT.size + name_len].split(b"\0", 1)[0]
+                off += _EVENT.size + name_len
+                overflow |= self._handle(wd, mask, os.fsdecode(name), changed)
+        return changed, overflow
+
+    def _handle(self, wd: int, mask: int, name: str, changed: List[str]) -> bool:
+        if mask & IN_Q_OVERFLOW:
+            return True
+        if mask & IN_IGNORED:
+            self._dirs.pop(wd, None)
+            return False
+        entry = self._dirs.get(wd)
+        if entry is None:
+            return False
+        directory, recursive = entry
+        if not name:
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                changed.append(directory)  # the pipeline expands a vanished directory to its docs
+            return False
+        path = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+            if not self.filter.wants_dir(path):
+                return False
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                files: List[str] = []
+                try:
+                    self._watch_tree(path, recursive, files)
+                except OSError:
+                    logger.warning("Cannot watch new directory %s; requesting a rescan", path, exc_info=True)
+                    return True
+                changed.extend(files)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                changed.append(path)
+            return False
+        if self.filter.wants_file(path):
+            changed.append(path)
+        return False
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class _PollBackend:
+    """Rescan every poll_s seconds and diff (mtime, size) against the previous scan."""
+
+    def __init__(self, patterns: Sequence[str], path_filter: _PathFilter, poll_s: float,
+                 max_file_size_mb: Optional[float], stop: threading.Event) -> None:
+        self.patterns = list(patterns)
+        self.filter = path_filter
+        self.poll_s = max(0.1, float(poll_s))
+        self.max_file_size_mb = max_file_size_mb
+        self.stop = stop
+        self._snapshot = self._scan()
+        self._next_scan = time.monotonic() + self.poll_s
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        files = scan_doc_files(
+            patterns=self.patterns,
+            exts=sorted(self.filter.exts) if self.filter.exts else None,
+            follow_symlinks=False,
+            max_file_size_mb=self.max_file_size_mb,
+        )
+        return {path: (st.st_mtime_ns, st.st_size) for path, st in files}
+
+    def poll(self, timeout: Optional[float]) -> PollResult:
+        wait = max(0.0, self._next_scan - time.monotonic())
+        if timeout is not None and timeout < wait:
+            self.stop.wait(timeout)
+            return [], False
+        if self.stop.wait(wait):
+            return [], False
+        self._next_scan = time.monotonic() + self.poll_s
+        current = self._scan()
+        previous, self._snapshot = self._snapshot, current
+        changed = [path for path, sig in current.items() if previous.get(path) != sig]
+        changed.extend(path for path in previous if path not in current)
+        return changed, False
+
+    def close(self) -> None:
+        pass
+
+
+class DocWatcher:
+    def __init__(
+            self,
+            patterns: Sequence[str],
+            on_changes: Callable[[List[str]], None],
+            on_overflow: Optional[Callable[[], None]] = None,
+            exts: Optional[Sequence[str]] = None,
+            max_file_size_mb: Optional[float] = None,
+            debounce_s: float = 1.0,
+            poll_s: float = 5.0,
+            max_delay_s: Optional[float] = None,
+            backend: str = "auto",  # "auto" | "inotify" | "poll"
+    ) -> None:
+        self.patterns = list(patterns)
+        self.on_changes = on_changes
+        self.on_overflow = on_overflow
+        self.exts = exts
+        self.max_file_size_mb = max_file_size_mb
+        self.debounce_s = max(0.0, float(debounce_s))
+        self.poll_s = float(poll_s)
+        self.max_delay_s = float(max_delay_s) if max_delay_s is not None else max(10.0, 10 * self.debounce_s)
+        self.backend = backend
+        self.backend_name = ""
+        self._stop = threading.Event()
+        self._wake_r, self._wake_w = os.pipe()
+        self._thread: Optional[threading.Thread] = None
+
+    def _open_backend(self):
+        roots = watch_roots(self.patterns)
+        path_filter = _PathFilter(roots, self.exts)
+        if self.backend in ("auto", "inotify"):
+            try:
+                backend = _InotifyBackend(roots, path_filter, self._wake_r)
+                self.backend_name = "inotify"
+                return backend
+            except OSError as exc:
+                if self.backend == "inotify":
+                    raise
+                logger.info("inotify unavailable (%s); polling every %.1fs", exc, self.poll_s)
+        self.backend_name = "poll"
+        return _PollBackend(self.patterns, path_filter, self.poll_s, self.max_file_size_mb, self._stop)
+
+    def _call(self, fn: Callable, *args) -> None:
+        try:
+            fn(*args)
+        except Exception:
+            logger.exception("Watcher callback failed")
+
+    def run(self) -> None:
+        """Watch until stop() is called; callbacks run on this thread."""
+        backend = self._open_backend()
+        logger.info("Watching %s with %s", ", ".join(self.patterns), self.backend_name)
+        pending: Dict[str, None] = {}
+        first = last = 0.0
+        try:
+            while not self._stop.is_set():
+                timeout = None
+                if pending:
+                    timeout = max(0.0, min(last + self.debounce_s, first + self.max_delay_s) - time.monotonic())
+                paths, overflow = backend.poll(timeout)
+                if self._stop.is_set():
+                    break
+                if overflow:
+                    logger.warning("File events were lost; requesting a full rescan")
+                    pending.clear()
+                    if self.on_overflow is not None:
+                        self._call(self.on_overflow)
+                    continue
+                now = time.monotonic()
+                if paths:
+                    if not pending:
+                        first = now
+                    last = now
+                    pending.update(dict.fromkeys(paths))
+                if pending and now >= min(last + self.debounce_s, first + self.max_delay_s):
+                    batch = list(pending)
+                    pending.clear()
+                    self._call(self.on_changes, batch)
+        finally:
+            backend.close()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="rag-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        os.write(self._wake_w, b"\0")
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+        for fd in (self._wake_r, self._wake_w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+def create_doc_watcher(
+        cfg: AppConfig,
+        on_changes: Callable[[List[str]], None],
+        on_overflow: Optional[Callable[[], None]] = None,
+) -> DocWatcher:
+    return DocWatcher(
+        patterns=cfg.DOCS_GLOBS,
+        on_changes=on_changes,
+        on_overflow=on_overflow,
+        exts=cfg.DOCS_EXTS,
+        max_file_size_mb=cfg.RAG.MAX_FILE_SIZE_MB,
+        debounce_s=cfg.RAG.WATCH_DEBOUNCE_S,
+        poll_s=cfg.RAG.WATCH_POLL_S,
+    )